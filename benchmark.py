@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import fake_api
+import processor as pr
+import snapshot
+import storage
+import synthetic
+
+'''
+Benchmarks for the processor hot paths, run from the repository root:
+
+    python benchmark.py topk --rows 1000000 10000000 50000000
+    python benchmark.py parse --payloads ./recorded
+    python benchmark.py pipeline --days 1 7 30 365 --json pipeline.json
+'''
+
+# Roughly the number of car parks reporting per snapshot
+CARPARKS = 2000
+
+
+'''
+Synthetic merged data set with the columns the rankings use, CARPARKS rows per 15 minute timestamp
+'''
+
+
+def make_frame(rows, carparks=CARPARKS, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = max(1, rows // carparks)
+    rows = timestamps * carparks
+    total_lots = rng.integers(50, 800, carparks)
+    lots_available = (rng.random(rows) * np.tile(total_lots, timestamps)).astype('int64')
+    frame = pd.DataFrame({
+        'timestamp': np.repeat(pd.date_range('2018-02-13', periods=timestamps, freq='15min').values, carparks),
+        'car_park_no': pd.Categorical.from_codes(np.tile(np.arange(carparks), timestamps),
+                                                 ['CP{}'.format(i) for i in range(carparks)]),
+        'total_lots': np.tile(total_lots, timestamps),
+    })
+    frame['%occupied'] = 1 - lots_available / frame['total_lots'].values
+    return frame
+
+
+def groupby_apply_rankings(merged_data):
+    return {
+        'largest': merged_data.groupby(['timestamp']).apply(lambda x: x.nlargest(pr.TOP_K, 'total_lots')).reset_index(
+            drop=True),
+        'underutilized': merged_data.groupby(['timestamp']).apply(
+            lambda x: x.nsmallest(pr.TOP_K, '%occupied')).reset_index(drop=True),
+    }
+
+
+def vectorized_rankings(merged_data):
+    return {
+        'largest': pr.top_k_per_group(merged_data, 'timestamp', 'total_lots', pr.TOP_K),
+        'underutilized': pr.top_k_per_group(merged_data, 'timestamp', '%occupied', pr.TOP_K, largest=False),
+    }
+
+
+def timed(function, *args):
+    started = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - started
+
+
+'''
+Times the groupby().apply(nlargest/nsmallest) rankings against the vectorized top_k_per_group
+and checks both select the same values for every timestamp
+'''
+
+
+def run_topk(row_counts, skip_apply_above=None):
+    results = []
+    for rows in row_counts:
+        frame = make_frame(rows)
+        vectorized, vectorized_seconds = timed(vectorized_rankings, frame)
+        result = {'rows': len(frame), 'vectorized_seconds': vectorized_seconds}
+        if skip_apply_above is None or rows <= skip_apply_above:
+            baseline, apply_seconds = timed(groupby_apply_rankings, frame)
+            for name, column in [('largest', 'total_lots'), ('underutilized', '%occupied')]:
+                assert np.allclose(baseline[name][column].values, vectorized[name][column].values), name
+            result.update(apply_seconds=apply_seconds, speedup=apply_seconds / vectorized_seconds)
+        print(', '.join('{}={:.3f}'.format(key, value) if isinstance(value, float) else '{}={}'.format(key, value)
+                        for key, value in result.items()))
+        results.append(result)
+    return results
+
+
+'''
+The importer's previous normalize: pd.json_normalize of the first item only, string columns
+'''
+
+
+def json_normalize_snapshot(timestamp, response):
+    for t in response['items']:
+        df = pd.DataFrame.from_dict(
+            pd.json_normalize(t['carpark_data'], 'carpark_info', ['carpark_number', 'update_datetime']))
+        df['timestamp'] = timestamp
+        return df
+
+
+'''
+Recorded API payloads (json files as saved by live.py --record), or count generated ones when no directory is given
+'''
+
+
+def load_payloads(directory=None, count=96):
+    if directory:
+        payloads = []
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            with open(path) as f:
+                payloads.append(json.load(f))
+        return payloads
+    carpark_numbers = fake_api.load_carpark_numbers()
+    return [json.loads(json.dumps(fake_api.make_snapshot(str(moment).replace(' ', 'T'), carpark_numbers)))
+            for moment in pd.date_range('2018-02-13', periods=count, freq='15min')]
+
+
+'''
+Times json_normalize_snapshot against snapshot.parse_snapshot over the payloads
+and checks both produce the same rows for single item payloads
+'''
+
+
+def run_parse(directory=None, count=96):
+    payloads = load_payloads(directory, count)
+    timestamps = [payload['items'][0]['timestamp'][:19] for payload in payloads]
+    normalized, normalize_seconds = timed(lambda: [json_normalize_snapshot(timestamp, payload)
+                                                   for timestamp, payload in zip(timestamps, payloads)])
+    parsed, parse_seconds = timed(lambda: [snapshot.parse_snapshot(payload) for payload in payloads])
+    for frame, result, payload in zip(normalized, parsed, payloads):
+        if len(payload['items']) == 1 and not result.skipped:
+            assert frame['carpark_number'].str.strip().tolist() == result.carpark_number
+            assert (pd.to_numeric(frame['total_lots']).values == result.total_lots).all()
+            assert (pd.to_numeric(frame['lots_available']).values == result.lots_available).all()
+    result = {'payloads': len(payloads), 'rows': sum(len(parsed_snapshot) for parsed_snapshot in parsed),
+              'normalize_ms_per_snapshot': normalize_seconds / len(payloads) * 1000,
+              'parse_ms_per_snapshot': parse_seconds / len(payloads) * 1000,
+              'speedup': normalize_seconds / parse_seconds}
+    print(', '.join('{}={:.3f}'.format(key, value) if isinstance(value, float) else '{}={}'.format(key, value)
+                    for key, value in result.items()))
+    return result
+
+
+'''
+Synthetic database of the given size in db_dir, generated on first use and reused afterwards
+'''
+
+
+def synthetic_db(db_dir, start_date, days, seed=0):
+    db_path = os.path.join(db_dir, 'Carpark_{}d_seed{}'.format(days, seed))
+    if not os.path.exists(db_path):
+        synthetic.generate(db_path, start_date, days, seed, build_column_store=True)
+    return db_path
+
+
+# reset is called before each run, so a cache filled by an earlier run or stage is not measured instead of the work
+def measure(function, *args, memory=True, reset=None):
+    if reset:
+        reset()
+    result, seconds = timed(function, *args)
+    stage = {'seconds': seconds}
+    if memory:
+        if reset:
+            reset()
+        # second run under tracemalloc, it slows allocations down so it is kept out of the timing
+        tracemalloc.start()
+        function(*args)
+        stage['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, stage
+
+
+'''
+Times every processor stage over the whole range of synthetic databases of each size:
+loading the data set (SQLite and column store), the rankings, the aggregates, every figure function,
+and the rollup path the dashboard uses. peak_mb is the peak of Python/NumPy allocations during the stage.
+'''
+
+
+def run_pipeline(day_counts, db_dir, start_date='2018-01-01', seed=0, memory=True, workers=pr.PARTITION_WORKERS):
+    results = []
+    pool = pr.get_process_pool(workers)
+    for days in day_counts:
+        db_path = synthetic_db(db_dir, start_date, days, seed)
+        end_date = (datetime.fromisoformat(start_date) + timedelta(days=days)).date().isoformat()
+        pr.result_cache.clear()
+        stages = {}
+        dataset, stages['prepare_data_sqlite'] = measure(pr.prepare_data, start_date, end_date, db_path, False, memory=memory)
+        del dataset
+        dataset, stages['prepare_data_column_store'] = measure(pr.prepare_data, start_date, end_date, db_path,
+                                                               memory=memory)
+        # the rankings are cached per data set, both stages compute them afresh on each run
+        _, stages['rankings'] = measure(pr.get_rankings, dataset, memory=memory, reset=pr._rankings.clear)
+        aggregates, stages['aggregate'] = measure(pr.aggregate, dataset, memory=memory, reset=pr._rankings.clear)
+        # memory of the parent only, each worker holds one shard
+        _, stages['partitioned_aggregates_sqlite'] = measure(pr.partitioned_aggregates, start_date, end_date, db_path,
+                                                             pr.PARTITION_DAYS, False, pool, memory=memory)
+        for function in pr.FIGURES.values():
+            _, stages[function.__name__] = measure(function, aggregates, memory=memory)
+        db = storage.connect(db_path)
+        try:
+            _, stages['load_aggregates_rollups'] = measure(pr.load_aggregates, db, start_date, end_date, memory=memory)
+        finally:
+            db.close()
+        result = {'days': days, 'rows': len(dataset['facts']), 'db_mb': os.path.getsize(db_path) / 1e6,
+                  'stages': stages}
+        del dataset
+        print('days={} rows={} '.format(days, result['rows']) + ', '.join(
+            '{}={:.3f}s'.format(name, stage['seconds']) + (' {:.0f}MB'.format(stage['peak_mb']) if memory else '')
+            for name, stage in stages.items()))
+        results.append(result)
+    return {'environment': environment(), 'workers': workers, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'results': results}
+
+
+'''
+Where the numbers come from, so results of different commits and machines can be told apart
+'''
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Processor benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    topk = subparsers.add_parser('topk', help='per-timestamp top-k rankings')
+    topk.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000, 50000000])
+    topk.add_argument('--skip-apply-above', type=int, help='only time the vectorized version above this row count')
+    topk.add_argument('--json', help='write the results to this file')
+    parse = subparsers.add_parser('parse', help='snapshot parsing, json_normalize against the typed parser')
+    parse.add_argument('--payloads', help='directory of recorded json payloads, generated when omitted')
+    parse.add_argument('--count', type=int, default=96, help='number of generated payloads')
+    parse.add_argument('--json', help='write the results to this file')
+    pipeline = subparsers.add_parser('pipeline', help='processor stages on synthetic databases')
+    pipeline.add_argument('--days', type=int, nargs='+', default=[1, 7, 30])
+    pipeline.add_argument('--db-dir', default='./bench', help='where the synthetic databases are generated and reused')
+    pipeline.add_argument('--start', default='2018-01-01', help='first day of the synthetic data')
+    pipeline.add_argument('--seed', type=int, default=0)
+    pipeline.add_argument('--workers', type=int, default=pr.PARTITION_WORKERS, help='processes of the partitioned run')
+    pipeline.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    pipeline.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    if args.command == 'topk':
+        output = run_topk(args.rows, args.skip_apply_above)
+    elif args.command == 'parse':
+        output = run_parse(args.payloads, args.count)
+    elif args.command == 'pipeline':
+        output = run_pipeline(args.days, args.db_dir, args.start, args.seed, memory=not args.no_memory,
+                              workers=args.workers)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding: utf-8
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process locks (Windows), workers may compute the same entry concurrently
+    fcntl = None
+
+'''
+Server side cache for dashboard results (aggregates and figures).
+Keys include the database data_version, so anything the importer writes invalidates older entries.
+The in-memory tier is an LRU bounded by CARPARK_CACHE_SIZE entries, the optional disk tier
+(CARPARK_CACHE_DIR) holds pickled results that every server worker on the host can read.
+With the disk tier, a missing entry is computed under a file lock, so concurrent requests for the same key
+compute it once across all worker processes, the others wait and read the result.
+'''
+
+CACHE_SIZE = int(os.environ.get('CARPARK_CACHE_SIZE', 128))
+CACHE_DIR = os.environ.get('CARPARK_CACHE_DIR')
+
+MISSING = object()
+
+
+'''
+Date picker values (None, 'YYYY-MM-DD' or full ISO datetimes) to 'YYYY-MM-DD' strings, so equivalent ranges share a key
+'''
+
+
+def normalize_range(start_date, end_date):
+    return tuple('' if value is None else date.fromisoformat(str(value)[:10]).isoformat()
+                 for value in (start_date, end_date))
+
+
+'''
+Data version of a disk cache file ('{version}-{sha1}.pkl' or its .pkl.lock), None for other files
+'''
+
+
+def file_version(name):
+    try:
+        return int(name.split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+class ResultCache:
+
+    def __init__(self, max_entries=CACHE_SIZE, cache_dir=CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    '''
+    Returns the cached value for key or computes it once, concurrent callers asking
+    for the same key (in this process, or in any worker sharing the disk tier) wait for the first computation
+    instead of repeating it
+    '''
+
+    def get_or_compute(self, key, version, compute):
+        value = self.get(key, version)
+        if value is not MISSING:
+            return value
+        with self.key_lock(key, version):
+            value = self.get(key, version)
+            if value is MISSING:
+                with self.file_lock(key, version):
+                    value = self.read_disk(key, version)
+                    if value is MISSING:
+                        value = compute()
+                        self.put(key, version, value)
+                    else:
+                        self.put_memory(key, version, value)
+            return value
+
+    '''
+    True if the entry is cached in memory or on disk, without loading it
+    '''
+
+    def contains(self, key, version):
+        with self.lock:
+            if (key, version) in self.entries:
+                return True
+        return bool(self.cache_dir) and os.path.exists(self.disk_path(key, version))
+
+    def key_lock(self, key, version):
+        with self.lock:
+            return self.key_locks.setdefault((key, version), threading.Lock())
+
+    def get(self, key, version):
+        self.check_version(version)
+        with self.lock:
+            if (key, version) in self.entries:
+                self.entries.move_to_end((key, version))
+                self.hits += 1
+                return self.entries[(key, version)]
+        value = self.read_disk(key, version)
+        with self.lock:
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is not MISSING:
+            self.put_memory(key, version, value)
+        return value
+
+    def put(self, key, version, value):
+        self.put_memory(key, version, value)
+        self.write_disk(key, version, value)
+
+    def put_memory(self, key, version, value):
+        with self.lock:
+            self.entries[(key, version)] = value
+            self.entries.move_to_end((key, version))
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                self.key_locks.pop(evicted, None)
+
+    '''
+    A new data version makes every older entry unreachable, drop them instead of waiting for LRU eviction.
+    Only older versions go: another worker may already be on a newer version than this one.
+    '''
+
+    def check_version(self, version):
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version or (self.version is not None and version < self.version):
+                return
+            self.version = version
+            self.entries = OrderedDict((k, v) for k, v in self.entries.items() if k[1] >= version)
+            self.key_locks = {k: v for k, v in self.key_locks.items() if k[1] >= version}
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(('.pkl', '.lock')) and file_version(name) is not None and \
+                        file_version(name) < version:
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+
+    @contextmanager
+    def file_lock(self, key, version):
+        if not self.cache_dir or fcntl is None:
+            yield
+            return
+        with open(self.disk_path(key, version) + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def disk_path(self, key, version):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, '{}-{}.pkl'.format(version, digest))
+
+    def read_disk(self, key, version):
+        if not self.cache_dir:
+            return MISSING
+        try:
+            with open(self.disk_path(key, version), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+
+    def write_disk(self, key, version, value):
+        if not self.cache_dir:
+            return
+        path = self.disk_path(key, version)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as E:
+            print('Error: ', E)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.key_locks.clear()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process locks (Windows), only one writer process may update the store
+    fcntl = None
+
+'''
+Optional column store next to the SQLite database (<db>.columns/), one directory per day of availability rows
+with one .npy array per column, and a manifest.json listing the partitions:
+
+    {"version": 1, "lot_types": ["C", "H", ...], "days": {"2018-02-13": {"path": "2018-02-13.3", "rows": 207168}}}
+
+Rows of a partition are in primary key order (timestamp, carpark_id, lot_type), lot_type is stored as int8 codes
+into the append-only manifest list. Readers memory-map the arrays, so loads are zero-copy and the OS page cache
+is shared by every dashboard worker. Partitions are never modified in place: a rewritten day goes to a new directory,
+the manifest is replaced atomically and the old directory removed, mappings already open stay valid.
+Writers (the importer, live.py, storage.py compact) are serialized by a file lock next to the store (<db>.columns.lock).
+The store exists once "python storage.py compact" has built it, SnapshotWriter then keeps it up to date.
+Readers check each partition against the day's row count in SQLite and skip stale ones, see load_range.
+'''
+
+STORE_VERSION = 1
+MANIFEST = 'manifest.json'
+SECONDS_PER_DAY = 86400
+
+# Column name -> dtype on disk
+COLUMNS = {
+    'timestamp': 'int64',
+    'carpark_id': 'int32',
+    'lot_type': 'int8',
+    'total_lots': 'int16',
+    'lots_available': 'int16',
+}
+
+_lock = threading.Lock()
+
+
+def store_path(db_path):
+    return db_path + '.columns'
+
+
+'''
+Held while the manifest and partitions are rewritten, by threads of this process and other processes.
+Not reentrant: a process must not take it twice.
+'''
+
+
+@contextmanager
+def store_lock(store):
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(store + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def exists(store):
+    return os.path.exists(os.path.join(store, MANIFEST))
+
+
+def day_name(day):
+    return time.strftime('%Y-%m-%d', time.gmtime(day))
+
+
+def read_manifest(store):
+    try:
+        with open(os.path.join(store, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': STORE_VERSION, 'lot_types': [], 'days': {}}
+
+
+def write_manifest(store, manifest):
+    path = os.path.join(store, MANIFEST)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+'''
+Rewrites the partitions of the given days (epoch seconds of 00:00) from the availability table.
+Days without rows are dropped from the store.
+'''
+
+
+def write_days(db, store, days):
+    with store_lock(store):
+        rewrite_days(db, store, days)
+
+
+def rewrite_days(db, store, days):
+    os.makedirs(store, exist_ok=True)
+    manifest = read_manifest(store)
+    lot_types = manifest['lot_types']
+    removed = []
+    for day in sorted(set(days)):
+        rows = db.execute('''select timestamp, carpark_id, lot_type, total_lots, lots_available
+                             from carpark_availability_15min where timestamp >= ? and timestamp < ?
+                             order by timestamp, carpark_id, lot_type''', (day, day + SECONDS_PER_DAY)).fetchall()
+        name = day_name(day)
+        old = manifest['days'].pop(name, None)
+        if old:
+            removed.append(old['path'])
+        if not rows:
+            continue
+        timestamp, carpark_id, lot_type, total_lots, lots_available = zip(*rows)
+        for value in set(lot_type).difference(lot_types):
+            lot_types.append(value)
+        codes = {value: code for code, value in enumerate(lot_types)}
+        arrays = {
+            'timestamp': timestamp,
+            'carpark_id': carpark_id,
+            'lot_type': [codes[value] for value in lot_type],
+            'total_lots': total_lots,
+            'lots_available': lots_available,
+        }
+        generation = int(old['path'].rsplit('.', 1)[1]) + 1 if old else 0
+        path = '{}.{}'.format(name, generation)
+        os.makedirs(os.path.join(store, path), exist_ok=True)
+        for column, dtype in COLUMNS.items():
+            np.save(os.path.join(store, path, column + '.npy'), np.asarray(arrays[column], dtype=dtype))
+        manifest['days'][name] = {'path': path, 'rows': len(rows)}
+    write_manifest(store, manifest)
+    for path in removed:
+        shutil.rmtree(os.path.join(store, path), ignore_errors=True)
+
+
+'''
+Builds the store from scratch out of the SQLite table, day by day
+'''
+
+
+def compact(db, store):
+    started = time.perf_counter()
+    first, last = db.execute('select min(timestamp), max(timestamp) from carpark_availability_15min').fetchone()
+    with store_lock(store):
+        if os.path.isdir(store):
+            shutil.rmtree(store)
+        os.makedirs(store)
+        days = [] if first is None else range(first - first % SECONDS_PER_DAY, last + 1, SECONDS_PER_DAY)
+        for day in days:
+            rewrite_days(db, store, [day])
+        if not days:
+            write_manifest(store, read_manifest(store))
+        manifest = read_manifest(store)
+    print('Compacted {} rows into {} day partitions in {:.1f}s'.format(
+        sum(day['rows'] for day in manifest['days'].values()), len(manifest['days']), time.perf_counter() - started))
+
+
+'''
+Memory-mapped columns of every partition overlapping [start_epoch, end_epoch), trimmed to the range.
+row_counts maps each day (epoch seconds of 00:00) to its row count in SQLite (storage availability_days).
+Returns the lot type list of the manifest and a list of (day, columns) in day order, columns a dict column -> array
+of read-only views of the mapped files, or None for a day with rows whose partition is missing or does not hold
+row_counts[day] rows (a writer crashed before rewriting it), the caller reads those days from SQLite.
+Raises OSError when a partition disappears under the reader.
+'''
+
+
+def load_range(store, start_epoch, end_epoch, row_counts):
+    manifest = read_manifest(store)
+    parts = []
+    for day in range(start_epoch - start_epoch % SECONDS_PER_DAY, end_epoch, SECONDS_PER_DAY):
+        entry = manifest['days'].get(day_name(day))
+        rows = entry['rows'] if entry else 0
+        if rows != row_counts.get(day, 0):
+            parts.append((day, None))
+            continue
+        if not entry:
+            continue
+        columns = {column: np.load(os.path.join(store, entry['path'], column + '.npy'), mmap_mode='r')
+                   for column in COLUMNS}
+        start, end = np.searchsorted(columns['timestamp'], [start_epoch, end_epoch])
+        if end > start:
+            parts.append((day, {column: values[start:end] for column, values in columns.items()}))
+    return manifest['lot_types'], parts
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+import argparse
+import csv
+import glob
+import json
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import urlparse, parse_qs
+
+'''
+Local stand-in for the api.data.gov.sg carpark-availability endpoint.
+Serves deterministic snapshots for the car parks in the reference csv so importer.py
+can be exercised without hitting the real API, including throttled (429) responses.
+
+    python fake_api.py --port 8000 --failure-rate 0.1
+    python importer.py 2018-02-13 2018-02-14 --url http://127.0.0.1:8000/v1/transport/carpark-availability
+
+Without a date_time parameter the current snapshot is returned, like the real API. With --replay the json
+snapshots recorded by live.py --record are served instead, the next one for every request without date_time.
+'''
+
+REFERENCE_CSV = './data/hdb-carpark-information/hdb-carpark-information.csv'
+
+
+def load_carpark_numbers(path=REFERENCE_CSV):
+    with open(path, newline='') as f:
+        return [row['car_park_no'].strip() for row in csv.DictReader(f)]
+
+
+'''
+Builds a payload in the same shape as the real API for the given date_time,
+seeded by the timestamp so repeated requests return the same snapshot
+'''
+
+
+def make_snapshot(date_time, carpark_numbers):
+    rng = random.Random(date_time)
+    carpark_data = []
+    for number in carpark_numbers:
+        total = random.Random(number).randint(50, 800)
+        carpark_data.append({
+            'carpark_info': [{'total_lots': str(total), 'lot_type': 'C',
+                              'lots_available': str(rng.randint(0, total))}],
+            'carpark_number': number,
+            'update_datetime': date_time,
+        })
+    return {'items': [{'timestamp': date_time + '+08:00', 'carpark_data': carpark_data}]}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+        if server.latency:
+            sleep(server.latency)
+        if server.rng.random() < server.failure_rate:
+            self.send_response(429)
+            self.end_headers()
+            return
+        query = parse_qs(urlparse(self.path).query)
+        if 'date_time' in query:
+            body = json.dumps(make_snapshot(query['date_time'][0], server.carpark_numbers)).encode()
+        elif server.replay:
+            with server.lock:
+                path = server.replay[server.replay_position % len(server.replay)]
+                server.replay_position += 1
+            with open(path, 'rb') as f:
+                body = f.read()
+        else:
+            now = datetime.utcnow() + timedelta(hours=8)
+            body = json.dumps(make_snapshot(now.strftime('%Y-%m-%dT%H:%M:00'), server.carpark_numbers)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+'''
+Creates the server without starting it, call serve_forever() or use start_in_thread()
+'''
+
+
+def make_server(host='127.0.0.1', port=8000, failure_rate=0.0, latency=0.0, carpark_numbers=None, seed=0,
+                replay_dir=None):
+    server = ThreadingHTTPServer((host, port), FakeApiHandler)
+    server.replay = sorted(glob.glob(os.path.join(replay_dir, '*.json'))) if replay_dir else []
+    server.replay_position = 0
+    server.carpark_numbers = carpark_numbers if carpark_numbers is not None else load_carpark_numbers()
+    server.failure_rate = failure_rate
+    server.latency = latency
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.request_count = 0
+    return server
+
+
+def start_in_thread(**kwargs):
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve fake car park availability snapshots')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--replay', help='directory of recorded json snapshots to serve in order')
+    args = parser.parse_args()
+    print('Serving on http://{}:{}/v1/transport/carpark-availability'.format(args.host, args.port))
+    make_server(args.host, args.port, args.failure_rate, args.latency, replay_dir=args.replay).serve_forever()
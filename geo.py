@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+import pandas as pd
+
+import reference
+
+'''
+Spatial helpers for the area utilization map.
+Car park coordinates in the reference csv are SVY21 (metres), they are binned into a square grid in SVY21 space
+and the grid cells are converted to WGS84 polygons for the map.
+'''
+
+# Edge of a grid cell in metres
+GRID_CELL_METRES = 1000
+
+# SVY21 projection parameters (transverse Mercator on WGS84)
+SVY21_A = 6378137.0
+SVY21_F = 1 / 298.257223563
+SVY21_ORIGIN_LAT = 1.366666
+SVY21_ORIGIN_LON = 103.833333
+SVY21_FALSE_NORTHING = 38744.572
+SVY21_FALSE_EASTING = 28001.642
+SVY21_K = 1.0
+
+
+def meridian_distance(lat_radians):
+    e2 = 2 * SVY21_F - SVY21_F ** 2
+    e4, e6 = e2 ** 2, e2 ** 3
+    a0 = 1 - e2 / 4 - 3 * e4 / 64 - 5 * e6 / 256
+    a2 = 3 / 8 * (e2 + e4 / 4 + 15 * e6 / 128)
+    a4 = 15 / 256 * (e4 + 3 * e6 / 4)
+    a6 = 35 * e6 / 3072
+    return SVY21_A * (a0 * lat_radians - a2 * np.sin(2 * lat_radians) + a4 * np.sin(4 * lat_radians)
+                      - a6 * np.sin(6 * lat_radians))
+
+
+'''
+Vectorized SVY21 (easting, northing) to WGS84 (latitude, longitude) in degrees,
+the inverse transverse Mercator series used by the Singapore Land Authority
+'''
+
+
+def svy21_to_wgs84(easting, northing):
+    easting = np.asarray(easting, dtype='float64')
+    northing = np.asarray(northing, dtype='float64')
+    a, f, k = SVY21_A, SVY21_F, SVY21_K
+    b = a * (1 - f)
+    e2 = 2 * f - f ** 2
+    n = (a - b) / (a + b)
+    n2, n3, n4 = n ** 2, n ** 3, n ** 4
+    g = a * (1 - n) * (1 - n2) * (1 + 9 * n2 / 4 + 225 * n4 / 64) * (np.pi / 180)
+
+    m_prime = meridian_distance(np.radians(SVY21_ORIGIN_LAT)) + (northing - SVY21_FALSE_NORTHING) / k
+    sigma = m_prime * np.pi / (180 * g)
+    lat_prime = (sigma + (3 * n / 2 - 27 * n3 / 32) * np.sin(2 * sigma)
+                 + (21 * n2 / 16 - 55 * n4 / 32) * np.sin(4 * sigma)
+                 + (151 * n3 / 96) * np.sin(6 * sigma)
+                 + (1097 * n4 / 512) * np.sin(8 * sigma))
+
+    sin2 = np.sin(lat_prime) ** 2
+    rho = a * (1 - e2) / (1 - e2 * sin2) ** 1.5
+    v = a / np.sqrt(1 - e2 * sin2)
+    psi = v / rho
+    psi2, psi3, psi4 = psi ** 2, psi ** 3, psi ** 4
+    t = np.tan(lat_prime)
+    t2, t4, t6 = t ** 2, t ** 4, t ** 6
+    e_prime = easting - SVY21_FALSE_EASTING
+    x = e_prime / (k * v)
+    x3, x5, x7 = x ** 3, x ** 5, x ** 7
+
+    lat_factor = t / (k * rho)
+    lat = (lat_prime
+           - lat_factor * (e_prime * x / 2)
+           + lat_factor * (e_prime * x3 / 24) * (-4 * psi2 + 9 * psi * (1 - t2) + 12 * t2)
+           - lat_factor * (e_prime * x5 / 720) * (8 * psi4 * (11 - 24 * t2) - 12 * psi3 * (21 - 71 * t2)
+                                                  + 15 * psi2 * (15 - 98 * t2 + 15 * t4)
+                                                  + 180 * psi * (5 * t2 - 3 * t4) + 360 * t4)
+           + lat_factor * (e_prime * x7 / 40320) * (1385 - 3633 * t2 + 4095 * t4 + 1575 * t6))
+
+    sec_lat = 1 / np.cos(lat_prime)
+    lon = (np.radians(SVY21_ORIGIN_LON)
+           + x * sec_lat
+           - (x3 * sec_lat / 6) * (psi + 2 * t2)
+           + (x5 * sec_lat / 120) * (-4 * psi3 * (1 - 6 * t2) + psi2 * (9 - 68 * t2) + 72 * psi * t2 + 24 * t4)
+           - (x7 * sec_lat / 5040) * (61 + 662 * t2 + 1320 * t4 + 720 * t6))
+    return np.degrees(lat), np.degrees(lon)
+
+
+'''
+Assigns every car park of the reference data (indexed by car_park_no) to a grid cell and builds the GeoJSON polygons of the cells.
+Returns a Series car_park_no -> cell id and the GeoJSON FeatureCollection (feature id = cell id).
+'''
+
+
+def build_grid(reference_data, cell_metres=GRID_CELL_METRES):
+    reference_data = reference_data[reference_data['x_coord'].notnull() & reference_data['y_coord'].notnull()]
+    x = reference_data['x_coord'].to_numpy(dtype='float64')
+    y = reference_data['y_coord'].to_numpy(dtype='float64')
+    x0 = np.floor(x.min() / cell_metres) * cell_metres
+    y0 = np.floor(y.min() / cell_metres) * cell_metres
+    column = ((x - x0) // cell_metres).astype('int64')
+    row = ((y - y0) // cell_metres).astype('int64')
+    cell = row * (column.max() + 1) + column
+    cells, first = np.unique(cell, return_index=True)
+
+    # corners of every occupied cell, converted in one call
+    left = x0 + column[first] * cell_metres
+    bottom = y0 + row[first] * cell_metres
+    corner_x = np.stack([left, left + cell_metres, left + cell_metres, left, left], axis=1)
+    corner_y = np.stack([bottom, bottom, bottom + cell_metres, bottom + cell_metres, bottom], axis=1)
+    lat, lon = svy21_to_wgs84(corner_x, corner_y)
+    features = [{'type': 'Feature', 'id': int(cell_id),
+                 'geometry': {'type': 'Polygon', 'coordinates': [np.stack([lon[i], lat[i]], axis=1).tolist()]}}
+                for i, cell_id in enumerate(cells)]
+    cell_of = pd.Series(cell, index=reference_data.index.values)
+    return cell_of, {'type': 'FeatureCollection', 'features': features}
+
+
+'''
+Grid for the current reference csv, rebuilt only when the file content changes
+'''
+
+
+def get_grid(csv_path=reference.REFERENCE_CSV):
+    return reference.get_reference(csv_path).derived('grid', build_grid)
+
+
+'''
+Mean %occupied per grid cell from per car park sums and counts (car_park_no, occupied_sum, row_count)
+'''
+
+
+def occupancy_by_cell(carpark_stats, cell_of):
+    cells = cell_of.reindex(carpark_stats['car_park_no']).to_numpy()
+    known = ~np.isnan(cells)
+    codes, cell_ids = pd.factorize(cells[known].astype('int64'), sort=True)
+    occupied_sum = np.bincount(codes, weights=carpark_stats['occupied_sum'].to_numpy()[known])
+    row_count = np.bincount(codes, weights=carpark_stats['row_count'].to_numpy()[known])
+    carparks = np.bincount(codes)
+    return pd.DataFrame({'cell': cell_ids, '%occupied': occupied_sum / row_count, 'car_parks': carparks})
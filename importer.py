@@ -1,10 +1,20 @@
 #!/usr/bin/env python
 # coding: utf-8
-import requests
-import pandas as pd
-from time import sleep
+import argparse
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-import sqlite3
+from time import monotonic, sleep
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import snapshot
+import storage
 
 '''
 Created by: Pavithra Coimbatore Sainath
@@ -12,13 +22,25 @@ Date: 15th Apr 2021
 
 '''
 
+CAR_PARK_URL = 'https://api.data.gov.sg/v1/transport/carpark-availability'
+
+# api.data.gov.sg throttles clients, these defaults stay well inside its budget
+REQUESTS_PER_MINUTE = 60
+MAX_WORKERS = 4
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+CHECKPOINT_PATH = 'backfill_checkpoint.json'
+# checkpoint is flushed to disk after this many completed timestamps
+CHECKPOINT_EVERY = 20
+
+
 '''
 This function returns the date range for the given start and end dates
 This will be used to generate the list of timestamps for the given dates
 '''
 
-CAR_PARK_URL = 'https://api.data.gov.sg/v1/transport/carpark-availability'
-
 
 def get_date_range(start_date, end_date):
     datelist = [str(i).replace(' ', 'T') for i in pd.date_range(start=start_date, end=end_date, freq="15min")]
@@ -26,76 +48,301 @@ def get_date_range(start_date, end_date):
 
 
 '''
-This function returns the json response for the given url with its parameters
+Token bucket shared by all fetch workers.
+Refills at requests_per_minute / 60 tokens per second and holds at most `burst` tokens,
+so the long-run request rate never exceeds the configured budget.
 '''
 
 
-def get_response(url, param, timeout=60):
-    response = requests.get(url, params=param)
-    if response.status_code != 200:
-        sleep(10)
-        return get_response(url, param)
-    else:
-        res_json = response.json()
-        return res_json
+class TokenBucket:
+
+    def __init__(self, requests_per_minute, burst=1):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            sleep(wait_for)
 
 
 '''
-This function normalizes the data and transforms the data into a dataframe format
+Thread safe counters reported at the end of a backfill
 '''
 
 
-def normalize(timestamp, response):
-    for t in response['items']:
-        df = pd.DataFrame.from_dict(
-            pd.json_normalize(t['carpark_data'], 'carpark_info', ['carpark_number', 'update_datetime']))
-        df['timestamp'] = timestamp
-        return df
+class BackfillStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.snapshots = 0
+        self.rows = 0
+        self.skipped_rows = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self):
+        elapsed = monotonic() - self.started
+        per_minute = self.snapshots / elapsed * 60 if elapsed > 0 else 0.0
+        print('Fetched {} snapshots ({} rows, {} unparsable rows skipped) in {:.1f}s: {:.1f} snapshots/min, '
+              '{} requests, {} retries, {} failures'.format(self.snapshots, self.rows, self.skipped_rows, elapsed,
+                                                            per_minute, self.requests, self.retries, self.failures))
 
 
 '''
-This function used to create database table and insert the data to the database
-The table is created only if is not already available
+HTTP session reused across requests so connections to the API are kept alive
 '''
 
 
-def write_to_db(dataframe):
-    if not dataframe is None:
-        try:
-            db = sqlite3.connect('Carpark_15min')
-            cursor = db.cursor()
-            cursor.execute('''create table if not exists carpark_availability_15min (total_lots varchar(20),lot_type varchar(5),
-                        lots_available varchar(10),carpark_number varchar(20),update_datetime datetime,timestamp datetime, PRIMARY KEY (carpark_number,lot_type,timestamp))''')
+def get_session(pool_size=MAX_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+'''
+Exponential backoff with full jitter, honouring the Retry-After header when the API sends one
+'''
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None and retry_after.isdigit():
+        return min(BACKOFF_CAP, float(retry_after))
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+'''
+This function returns the json response for the given url with its parameters
+Failed requests are retried with backoff up to max_retries times before giving up
+'''
 
-        except Exception as E:
-            print('Error :', E)
-        else:
-            print('table created or updated')
 
+def get_response(url, param, timeout=60, session=None, limiter=None, stats=None, max_retries=MAX_RETRIES):
+    session = session or requests
+    error = None
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        if stats is not None:
+            stats.add(requests=1)
+        retry_after = None
         try:
-            dataframe.to_sql(name='carpark_availability_15min', con=db, if_exists='append', index=False)
-        except Exception as E:
-            print('Error : ', E)
-            db.commit()
-            print('data inserted')
-    else:
-        print('Empty DF')
+            response = session.get(url, params=param, timeout=timeout)
+        except requests.RequestException as E:
+            error = E
+        else:
+            if response.status_code == 200:
+                return response.json()
+            error = 'HTTP {}'.format(response.status_code)
+            retry_after = response.headers.get('Retry-After')
+        if attempt < max_retries:
+            if stats is not None:
+                stats.add(retries=1)
+            sleep(backoff_delay(attempt, retry_after))
+    raise RuntimeError('Giving up on {} after {} attempts: {}'.format(param, max_retries + 1, error))
+
+
+'''
+Records the timestamps a backfill has finished (written, or answered with an empty snapshot)
+in a small json file so a crashed run can restart where it stopped.
+Progress is kept per run key (checkpoint_key: database and date range), so runs over other ranges or databases
+sharing the file neither resume from nor remove each other's progress.
+The file is a journal of json lines {"run": key, "done": [...]}: every CHECKPOINT_EVERY timestamps only the newly
+finished ones are appended, and a run's lines are removed (the file rewritten atomically) once it completes cleanly.
+'''
+
+
+def checkpoint_key(db_path, start_date, end_date):
+    return '{}|{}|{}'.format(os.path.abspath(db_path), start_date, end_date)
+
+
+class Checkpoint:
+
+    def __init__(self, path=CHECKPOINT_PATH, key=''):
+        self.path = path
+        self.key = key
+        self.unsaved = []
+        self.done = set(self.read().get(key, []))
+
+    def read(self):
+        runs = {}
+        if not os.path.exists(self.path):
+            return runs
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # blank, or cut short by a crash while it was appended
+                    continue
+                if 'run' in entry:
+                    runs.setdefault(entry['run'], []).extend(entry['done'])
+                # files of older versions hold one {"runs": {key: [...]}} object,
+                # or a single unkeyed 'done' list whose run is unknown
+                for key, dates in entry.get('runs', {}).items():
+                    runs.setdefault(key, []).extend(dates)
+        return runs
+
+    def write(self, runs):
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            for key, dates in runs.items():
+                f.write(json.dumps({'run': key, 'done': sorted(set(dates))}) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def append(self, dates):
+        with open(self.path, 'ab+') as f:
+            f.seek(0, os.SEEK_END)
+            # a line cut short by a crash is ended first, so it does not swallow this one
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write((json.dumps({'run': self.key, 'done': dates}) + '\n').encode())
+
+    def mark(self, date):
+        self.done.add(date)
+        self.unsaved.append(date)
+        if len(self.unsaved) >= CHECKPOINT_EVERY:
+            self.save()
+
+    def save(self):
+        self.append(self.unsaved)
+        self.unsaved = []
+
+    def clear(self):
+        self.done = set()
+        self.unsaved = []
+        runs = self.read()
+        runs.pop(self.key, None)
+        if runs:
+            self.write(runs)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
 
 
 '''
-Configured 60 seconds sleep as throttling in the api.data.gov.sg imposes rate limiting
+Drops the timestamps the checkpoint of the run has finished, and in incremental mode the ones already
+in the database too, so re-running over an overlapping range only fetches the gap
 '''
 
+
+def get_missing_dates(date_list, db_path=storage.DB_PATH, checkpoint=None, incremental=True):
+    stored = storage.get_existing_timestamps(db_path) if incremental else set()
+    done = checkpoint.done if checkpoint is not None else set()
+    return [date for date in date_list if date not in done and storage.to_epoch(date) not in stored]
+
+
+def mark_committed(checkpoint, dates):
+    if checkpoint is not None:
+        for date in dates:
+            checkpoint.mark(date)
+
+
+'''
+Fetches every timestamp in date_list with a bounded pool of in-flight requests.
+All workers share one session and one token bucket, responses are handed to a single SnapshotWriter
+on the calling thread as they complete, and only committed timestamps are checkpointed.
+'''
+
+
+def backfill(date_list, url=CAR_PARK_URL, requests_per_minute=REQUESTS_PER_MINUTE, max_workers=MAX_WORKERS,
+             max_retries=MAX_RETRIES, db_path=storage.DB_PATH, writer=None, checkpoint=None):
+    stats = BackfillStats()
+    own_writer = writer is None
+    if own_writer:
+        writer = storage.SnapshotWriter(db_path)
+    limiter = TokenBucket(requests_per_minute)
+    session = get_session(max_workers)
+
+    def fetch(date):
+        response_data = get_response(url, {'date_time': date}, session=session, limiter=limiter, stats=stats,
+                                     max_retries=max_retries)
+        return date, snapshot.parse_snapshot(response_data)
+
+    dates = iter(date_list)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            # keep a small queue ahead of the workers without materialising every future up front
+            for date in dates:
+                pending.add(pool.submit(fetch, date))
+                if len(pending) >= max_workers * 2:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    date, parsed = future.result()
+                except Exception as E:
+                    stats.add(failures=1)
+                    print('Error: ', E)
+                    continue
+                committed = writer.write(date, parsed)
+                stats.add(snapshots=1, rows=len(parsed), skipped_rows=parsed.skipped)
+                mark_committed(checkpoint, committed)
+    mark_committed(checkpoint, writer.flush())
+    if own_writer:
+        writer.close()
+    session.close()
+    if checkpoint is not None:
+        # a clean run leaves everything in the database, failures keep the checkpoint for the next attempt
+        if stats.failures:
+            checkpoint.save()
+        else:
+            checkpoint.clear()
+    stats.report()
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Backfill car park availability snapshots into SQLite')
+    parser.add_argument('start_date', nargs='?', help='YYYY-MM-DD, prompted for when omitted')
+    parser.add_argument('end_date', nargs='?', help='YYYY-MM-DD, prompted for when omitted')
+    parser.add_argument('--url', default=CAR_PARK_URL, help='API endpoint, point at fake_api.py for local runs')
+    parser.add_argument('--rpm', type=float, default=REQUESTS_PER_MINUTE, help='request budget per minute')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='concurrent in-flight requests')
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES, help='retries per timestamp before giving up')
+    parser.add_argument('--db', default=storage.DB_PATH, help='SQLite database file')
+    parser.add_argument('--incremental', action='store_true', help='also skip timestamps already in the database')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH,
+                        help='progress file, a crashed run over the same range and database resumes from it')
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    start_dt = input('Enter start date').replace('/', '-')
-    end_dt = input('Enter end date').replace('/', '-')
+    args = parse_args()
+    start_dt = (args.start_date or input('Enter start date')).replace('/', '-')
+    end_dt = (args.end_date or input('Enter end date')).replace('/', '-')
 
     if datetime.strptime(start_dt, '%Y-%m-%d') > datetime.strptime(end_dt, '%Y-%m-%d'):
         print('Please enter a valid start and end date. End date should be larger than the start date.')
     else:
         date_list = get_date_range(start_dt, end_dt)
-        for date in date_list:
-            PARAM = {'date_time': date}
-            response_data = get_response(CAR_PARK_URL, PARAM)
-            write_to_db(normalize(date, response_data))
-            sleep(60)
+        checkpoint = Checkpoint(args.checkpoint, checkpoint_key(args.db, start_dt, end_dt))
+        planned = len(date_list)
+        date_list = get_missing_dates(date_list, db_path=args.db, checkpoint=checkpoint, incremental=args.incremental)
+        if len(date_list) < planned:
+            print('Skipping {} of {} timestamps already ingested'.format(planned - len(date_list), planned))
+        backfill(date_list, url=args.url, requests_per_minute=args.rpm, max_workers=args.workers,
+                 max_retries=args.max_retries, db_path=args.db, checkpoint=checkpoint)
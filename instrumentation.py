@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# coding: utf-8
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from time import perf_counter, time
+
+'''
+Timing spans around the hot paths of the dashboard (data loading, rankings, aggregates, figures,
+callback responses). Every finished span is
+  - added to in-process metrics (duration histogram, rows in/out, bytes), served by /metrics in Prometheus text format
+  - written as one json line to the 'carpark.spans' logger, with the request it belongs to
+A sampling profiler can be switched on per request (X-Profile header, ?profile=1, or the cookie set by /profile?on=1),
+its collapsed stacks are listed by /profiles. CARPARK_INSTRUMENTATION=0 turns the spans off.
+'''
+
+ENABLED = os.environ.get('CARPARK_INSTRUMENTATION', '1') != '0'
+
+LOG = logging.getLogger('carpark.spans')
+
+# Upper bounds of the span duration histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROFILE_INTERVAL = 0.005
+PROFILE_COOKIE = 'carpark_profile'
+# Profiles kept for /profiles
+RECENT_PROFILES = 20
+
+_local = threading.local()
+_request_ids = itertools.count(1)
+
+
+class Span:
+
+    def __init__(self, name, labels, parent=None):
+        self.name = name
+        self.labels = labels
+        self.parent = parent
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes = None
+        self.error = None
+        self.start = perf_counter()
+        self.seconds = None
+        # end of the last finished child span, the 'serialize' span of install() starts there
+        self.children_end = None
+
+    def set(self, rows_in=None, rows_out=None, bytes=None):
+        if rows_in is not None:
+            self.rows_in = int(rows_in)
+        if rows_out is not None:
+            self.rows_out = int(rows_out)
+        if bytes is not None:
+            self.bytes = int(bytes)
+
+    def key(self):
+        return self.name, tuple(sorted(self.labels.items()))
+
+
+'''
+Placeholder handed out while the instrumentation is off, accepts the same calls
+'''
+
+
+class NullSpan:
+
+    def set(self, rows_in=None, rows_out=None, bytes=None):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.gauges = []
+
+    def observe(self, span):
+        with self.lock:
+            series = self.series.get(span.key())
+            if series is None:
+                series = self.series[span.key()] = {'count': 0, 'seconds': 0.0, 'buckets': [0] * len(BUCKETS),
+                                                    'rows_in': 0, 'rows_out': 0, 'bytes': 0, 'errors': 0}
+            series['count'] += 1
+            series['seconds'] += span.seconds
+            for i, bound in enumerate(BUCKETS):
+                if span.seconds <= bound:
+                    series['buckets'][i] += 1
+            for field in ['rows_in', 'rows_out', 'bytes']:
+                if getattr(span, field) is not None:
+                    series[field] += getattr(span, field)
+            if span.error is not None:
+                series['errors'] += 1
+
+    '''
+    Adds a gauge read when /metrics is scraped, read() returns a number or a list of (labels dict, number)
+    '''
+
+    def add_gauge(self, name, help_text, read):
+        self.gauges.append((name, help_text, read))
+
+    def render(self):
+        with self.lock:
+            series = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in self.series.items())
+        lines = ['# HELP carpark_span_seconds Duration of instrumented stages',
+                 '# TYPE carpark_span_seconds histogram']
+        for (name, labels), value in series:
+            for bound, count in zip(BUCKETS, value['buckets']):
+                lines.append('carpark_span_seconds_bucket{} {}'.format(
+                    format_labels(name, labels, ('le', repr(bound))), count))
+            lines.append('carpark_span_seconds_bucket{} {}'.format(format_labels(name, labels, ('le', '+Inf')),
+                                                                   value['count']))
+            lines.append('carpark_span_seconds_sum{} {!r}'.format(format_labels(name, labels), value['seconds']))
+            lines.append('carpark_span_seconds_count{} {}'.format(format_labels(name, labels), value['count']))
+        for field, help_text in [('rows_in', 'Rows received by instrumented stages'),
+                                 ('rows_out', 'Rows produced by instrumented stages'),
+                                 ('bytes', 'Bytes produced by instrumented stages (figure json, responses)'),
+                                 ('errors', 'Instrumented stages that raised')]:
+            lines.append('# HELP carpark_span_{}_total {}'.format(field, help_text))
+            lines.append('# TYPE carpark_span_{}_total counter'.format(field))
+            for (name, labels), value in series:
+                # rows and bytes only for the stages that report them
+                if value[field] or field == 'errors':
+                    lines.append('carpark_span_{}_total{} {}'.format(field, format_labels(name, labels), value[field]))
+        for name, help_text, read in self.gauges:
+            try:
+                values = read()
+            except Exception as E:
+                print('Error: ', E)
+                continue
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in (values if isinstance(values, list) else [({}, values)]):
+                lines.append('{}{} {}'.format(name, format_labels(None, tuple(sorted(labels.items()))), value))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(name, labels, extra=None):
+    pairs = ([('span', name)] if name is not None else []) + list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, escape(value)) for key, value in pairs) + '}'
+
+
+metrics = Metrics()
+
+
+def request_id():
+    return getattr(_local, 'request_id', None)
+
+
+'''
+Times the enclosed block as a span called name, labels should have few distinct values (figure names, data source).
+The yielded span takes rows_in / rows_out / bytes through span.set().
+'''
+
+
+@contextmanager
+def span(name, **labels):
+    if not ENABLED:
+        yield NULL_SPAN
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    current = Span(name, labels, stack[-1] if stack else None)
+    stack.append(current)
+    try:
+        yield current
+    except BaseException as E:
+        current.error = type(E).__name__
+        raise
+    finally:
+        stack.pop()
+        finish(current)
+
+
+def finish(current):
+    end = perf_counter()
+    current.seconds = end - current.start
+    if current.parent is not None:
+        current.parent.children_end = end
+    metrics.observe(current)
+    if LOG.isEnabledFor(logging.INFO):
+        record = {'time': round(time(), 3), 'span': current.name, 'seconds': round(current.seconds, 6),
+                  'request': request_id(), 'parent': current.parent.name if current.parent is not None else None,
+                  'thread': threading.current_thread().name}
+        record.update(current.labels)
+        for field in ['rows_in', 'rows_out', 'bytes', 'error']:
+            if getattr(current, field) is not None:
+                record[field] = getattr(current, field)
+        LOG.info(json.dumps(record))
+
+
+'''
+Sends the span log to path ('-' for stderr), one json object per line
+'''
+
+
+def configure_log(path):
+    handler = logging.StreamHandler(sys.stderr) if path == '-' else logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    LOG.addHandler(handler)
+    LOG.setLevel(logging.INFO)
+    LOG.propagate = False
+    return handler
+
+
+'''
+Samples the stack of one thread every interval seconds from a background thread,
+counts identical stacks in collapsed form (root;...;leaf, as read by flamegraph.pl and speedscope)
+'''
+
+
+class SamplingProfiler(threading.Thread):
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+    def collapsed(self):
+        return '\n'.join('{} {}'.format(stack, count) for stack, count in self.stacks.most_common()) + '\n'
+
+
+recent_profiles = deque(maxlen=RECENT_PROFILES)
+_profile_ids = itertools.count(1)
+
+
+'''
+Hooks the spans and the profiler into the Flask server of the dashboard:
+one 'request' span per request (labelled with the callback output for Dash callbacks), a 'serialize' span
+from the end of the callback to the response with the response size (the figure json for figure callbacks),
+and the /metrics, /profiles and /profile routes
+'''
+
+
+def install(server):
+    from flask import Response, jsonify, make_response, request
+
+    def request_output():
+        if request.path.endswith('_dash-update-component'):
+            body = request.get_json(silent=True) or {}
+            return str(body.get('output', ''))
+        return ''
+
+    @server.before_request
+    def start_request():
+        _local.request_id = next(_request_ids)
+        _local.request_started = perf_counter()
+        _local.profiler = None
+        # '0' switches off like /profile?on=0, any other value switches on
+        switches = [request.headers.get('X-Profile'), request.args.get('profile'), request.cookies.get(PROFILE_COOKIE)]
+        if any(value not in (None, '', '0') for value in switches) \
+                and not request.path.startswith(('/metrics', '/profile')):
+            _local.profiler = SamplingProfiler()
+            _local.profiler.start()
+        if ENABLED:
+            _local.stack = [Span('request', {'endpoint': request.endpoint or '', 'output': request_output()})]
+
+    @server.after_request
+    def finish_request(response):
+        stack = getattr(_local, 'stack', None)
+        if ENABLED and stack:
+            request_span = stack[0]
+            size = None if response.is_streamed else response.calculate_content_length()
+            if request_span.children_end is not None:
+                serialize = Span('serialize', dict(request_span.labels), request_span)
+                serialize.start = request_span.children_end
+                serialize.set(bytes=size)
+                finish(serialize)
+            request_span.set(bytes=size)
+            del stack[:]
+            finish(request_span)
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            recent_profiles.append({'id': next(_profile_ids), 'path': request.path, 'output': request_output(),
+                                    'seconds': round(perf_counter() - _local.request_started, 6),
+                                    'samples': profiler.samples, 'collapsed': profiler.collapsed()})
+            _local.profiler = None
+        return response
+
+    @server.teardown_request
+    def stop_profiler(exception):
+        # after_request is skipped when the request raised
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            _local.profiler = None
+
+    @server.route('/metrics')
+    def metrics_route():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @server.route('/profiles')
+    def profiles_route():
+        return jsonify([{key: value for key, value in profile.items() if key != 'collapsed'}
+                        for profile in reversed(recent_profiles)])
+
+    @server.route('/profiles/<int:profile_id>')
+    def profile_route(profile_id):
+        for profile in recent_profiles:
+            if profile['id'] == profile_id:
+                return Response(profile['collapsed'], mimetype='text/plain')
+        return Response('Unknown profile\n', status=404, mimetype='text/plain')
+
+    @server.route('/profile')
+    def profile_switch():
+        on = request.args.get('on', '1') != '0'
+        response = make_response('Profiling {} for this browser\n'.format('on' if on else 'off'))
+        response.mimetype = 'text/plain'
+        if on:
+            response.set_cookie(PROFILE_COOKIE, '1')
+        else:
+            response.delete_cookie(PROFILE_COOKIE)
+        return response
+
+    return server
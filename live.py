@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# coding: utf-8
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import importer
+import reference
+import snapshot
+import storage
+
+'''
+Live ingest: polls the current availability snapshot on a schedule, appends one snapshot per 15 minute slot
+to the database and keeps every polled snapshot of the last LIVE_HOURS hours in an in-memory ring buffer
+the dashboard's live tab reads without touching SQLite.
+
+    python fake_api.py --replay ./recorded
+    python presenter.py --live-url http://127.0.0.1:8000/v1/transport/carpark-availability
+
+Run on its own (python live.py, as with wsgi.py) it also saves the window to LIVE_FILE after every snapshot,
+the dashboard workers read it from there through get_buffer().
+'''
+
+LIVE_HOURS = 6
+POLL_SECONDS = 60
+# Cadence of the carpark_availability_15min table
+SLOT_SECONDS = 900
+LOT_TYPES = ['C', 'H', 'Y']
+# Window of the buffer shared with other processes, written by python live.py
+LIVE_FILE = os.environ.get('CARPARK_LIVE_FILE', './data/live_buffer.npz')
+
+'''
+Fixed-size ring buffer of snapshots. Counts are NumPy arrays of shape (slots, car parks, lot types),
+-1 marks a car park / lot type missing from a snapshot. Occupancy sums and counts per slot and lot type,
+and per car park and lot type over the whole window, are updated incrementally as snapshots are appended
+and evicted, only car parks passing the business filter and meaningful rows (storage.FILTER_SQL) are counted.
+'''
+
+
+class RingBuffer:
+
+    def __init__(self, hours=LIVE_HOURS, poll_seconds=POLL_SECONDS, carpark_numbers=(), lot_types=LOT_TYPES):
+        self.capacity = max(1, int(hours * 3600 // poll_seconds))
+        self.lock = threading.Lock()
+        self.head = 0
+        self.size = 0
+        self.carpark_numbers = []
+        self.carpark_index = {}
+        self.lot_types = []
+        self.lot_type_index = {}
+        self.allowed = set(reference.get_reference().business_view().index)
+        self.timestamps = np.full(self.capacity, -1, dtype='int64')
+        self.total_lots = np.zeros((self.capacity, 0, 0), dtype='int16')
+        self.lots_available = np.full((self.capacity, 0, 0), -1, dtype='int16')
+        self.included = np.zeros(0, dtype=bool)
+        self.slot_sum = np.zeros((self.capacity, 0))
+        self.slot_count = np.zeros((self.capacity, 0), dtype='int64')
+        self.carpark_sum = np.zeros((0, 0))
+        self.carpark_count = np.zeros((0, 0), dtype='int64')
+        self.register(carpark_numbers if len(carpark_numbers) else reference.get_reference().get().index, lot_types)
+
+    '''
+    Adds car parks and lot types not seen before, growing the arrays along their axis
+    '''
+
+    def register(self, carpark_numbers, lot_types):
+        new_carparks = [number for number in pd.unique(np.asarray(carpark_numbers, dtype=object))
+                        if number not in self.carpark_index]
+        new_lot_types = [lot_type for lot_type in pd.unique(np.asarray(lot_types, dtype=object))
+                         if lot_type not in self.lot_type_index]
+        if not new_carparks and not new_lot_types:
+            return
+        for number in new_carparks:
+            self.carpark_index[number] = len(self.carpark_numbers)
+            self.carpark_numbers.append(number)
+        for lot_type in new_lot_types:
+            self.lot_type_index[lot_type] = len(self.lot_types)
+            self.lot_types.append(lot_type)
+        grow_c, grow_l = len(new_carparks), len(new_lot_types)
+        self.total_lots = np.pad(self.total_lots, ((0, 0), (0, grow_c), (0, grow_l)))
+        self.lots_available = np.pad(self.lots_available, ((0, 0), (0, grow_c), (0, grow_l)), constant_values=-1)
+        self.included = np.r_[self.included, [number in self.allowed for number in new_carparks]].astype(bool)
+        self.slot_sum = np.pad(self.slot_sum, ((0, 0), (0, grow_l)))
+        self.slot_count = np.pad(self.slot_count, ((0, 0), (0, grow_l)))
+        self.carpark_sum = np.pad(self.carpark_sum, ((0, grow_c), (0, grow_l)))
+        self.carpark_count = np.pad(self.carpark_count, ((0, grow_c), (0, grow_l)))
+
+    def occupancy(self, slot):
+        total_lots = self.total_lots[slot]
+        lots_available = self.lots_available[slot]
+        valid = (total_lots > 0) & (lots_available >= 0) & (lots_available < total_lots) & self.included[:, None]
+        occupied = np.where(valid, 1 - lots_available / np.maximum(total_lots, 1), 0.0)
+        return occupied, valid
+
+    '''
+    Appends a parsed snapshot (snapshot.parse_snapshot) taken at epoch
+    '''
+
+    def append(self, epoch, parsed):
+        numbers = parsed.carpark_number
+        lot_types = parsed.lot_type
+        with self.lock:
+            self.register(numbers, lot_types)
+            slot = self.head
+            if self.size == self.capacity:
+                occupied, valid = self.occupancy(slot)
+                self.carpark_sum -= occupied
+                self.carpark_count -= valid
+            rows = pd.Index(self.carpark_numbers).get_indexer(numbers)
+            columns = pd.Index(self.lot_types).get_indexer(lot_types)
+            self.timestamps[slot] = epoch
+            self.total_lots[slot] = 0
+            self.lots_available[slot] = -1
+            self.total_lots[slot, rows, columns] = parsed.total_lots
+            self.lots_available[slot, rows, columns] = parsed.lots_available
+            occupied, valid = self.occupancy(slot)
+            self.slot_sum[slot] = occupied.sum(axis=0)
+            self.slot_count[slot] = valid.sum(axis=0)
+            self.carpark_sum += occupied
+            self.carpark_count += valid
+            self.head = (slot + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    def slots(self):
+        return (np.arange(self.head - self.size, self.head)) % self.capacity
+
+    @property
+    def latest(self):
+        with self.lock:
+            return int(self.timestamps[(self.head - 1) % self.capacity]) if self.size else None
+
+    '''
+    Mean %occupied per snapshot and lot type over the window, oldest first
+    '''
+
+    def trend(self):
+        with self.lock:
+            slots = self.slots()
+            timestamps = self.timestamps[slots]
+            occupied_sum = self.slot_sum[slots]
+            row_count = self.slot_count[slots]
+            lot_types = list(self.lot_types)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            occupied = occupied_sum / row_count
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(np.repeat(timestamps, len(lot_types)), unit='s'),
+            'lot_type': np.tile(lot_types, len(timestamps)),
+            '%occupied': occupied.ravel(),
+            'row_count': row_count.ravel(),
+        }).query('row_count > 0')
+
+    '''
+    Mean %occupied per car park and lot type over the window
+    '''
+
+    def carpark_stats(self):
+        with self.lock:
+            occupied_sum = self.carpark_sum.copy()
+            row_count = self.carpark_count.copy()
+            numbers = list(self.carpark_numbers)
+            lot_types = list(self.lot_types)
+        carpark, lot_type = np.nonzero(row_count)
+        return pd.DataFrame({
+            'car_park_no': np.asarray(numbers, dtype=object)[carpark],
+            'lot_type': np.asarray(lot_types, dtype=object)[lot_type],
+            '%occupied': occupied_sum[carpark, lot_type] / row_count[carpark, lot_type],
+            'row_count': row_count[carpark, lot_type],
+        })
+
+    '''
+    Saves the window (oldest snapshot first) and the per car park sums to path for SharedBuffer,
+    written to a temporary file and renamed so readers never see a partial file
+    '''
+
+    def save(self, path):
+        with self.lock:
+            slots = self.slots()
+            arrays = {'timestamps': self.timestamps[slots], 'slot_sum': self.slot_sum[slots],
+                      'slot_count': self.slot_count[slots], 'carpark_sum': self.carpark_sum.copy(),
+                      'carpark_count': self.carpark_count.copy(),
+                      'carpark_numbers': np.asarray(self.carpark_numbers, dtype=str),
+                      'lot_types': np.asarray(self.lot_types, dtype=str)}
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, path)
+
+
+'''
+Read-only view of the window another process saved with RingBuffer.save(), reloaded when the file changes.
+Answers latest, size, trend() and carpark_stats() like the RingBuffer it was saved from.
+'''
+
+
+class SharedBuffer:
+
+    def __init__(self, path=LIVE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.head = self.size = 0
+        self.capacity = 1
+        self.timestamps = np.zeros(0, dtype='int64')
+        self.slot_sum = self.carpark_sum = np.zeros((0, 0))
+        self.slot_count = self.carpark_count = np.zeros((0, 0), dtype='int64')
+        self.carpark_numbers = []
+        self.lot_types = []
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp == self.stamp:
+            return True
+        with np.load(self.path) as arrays:
+            loaded = {name: arrays[name] for name in arrays.files}
+        with self.lock:
+            self.timestamps = loaded['timestamps']
+            self.slot_sum = loaded['slot_sum']
+            self.slot_count = loaded['slot_count']
+            self.carpark_sum = loaded['carpark_sum']
+            self.carpark_count = loaded['carpark_count']
+            self.carpark_numbers = loaded['carpark_numbers'].tolist()
+            self.lot_types = loaded['lot_types'].tolist()
+            # saved oldest first, so the window is slots 0 .. size - 1
+            self.head = self.size = len(self.timestamps)
+            self.capacity = max(self.size, 1)
+            self.stamp = stamp
+        return True
+
+    slots = RingBuffer.slots
+    latest = RingBuffer.latest
+    trend = RingBuffer.trend
+    carpark_stats = RingBuffer.carpark_stats
+
+
+'''
+Background thread polling url every poll_seconds. Every new snapshot goes into the ring buffer,
+the first snapshot of each 15 minute slot is written to the database under the slot's timestamp.
+Snapshots are optionally saved as json to record_dir, fake_api.py --replay serves them back,
+and the buffer to live_file for the dashboard workers.
+'''
+
+
+class LiveIngest(threading.Thread):
+
+    def __init__(self, url=importer.CAR_PARK_URL, buffer=None, db_path=storage.DB_PATH, poll_seconds=POLL_SECONDS,
+                 record_dir=None, live_file=None):
+        super().__init__(daemon=True)
+        self.url = url
+        self.buffer = buffer if buffer is not None else RingBuffer(poll_seconds=poll_seconds)
+        self.db_path = db_path
+        self.poll_seconds = poll_seconds
+        self.record_dir = record_dir
+        self.live_file = live_file
+        self.session = importer.get_session(1)
+        self.stopped = threading.Event()
+        self.last_epoch = None
+        self.last_slot = None
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+
+    def poll_once(self, writer):
+        response = importer.get_response(self.url, {}, session=self.session, max_retries=2)
+        if not response.get('items') or not response['items'][0].get('carpark_data'):
+            return False
+        timestamp = response['items'][0]['timestamp'][:19]
+        epoch = storage.to_epoch(timestamp)
+        if epoch == self.last_epoch:
+            return False
+        self.last_epoch = epoch
+        if self.record_dir:
+            with open(os.path.join(self.record_dir, timestamp.replace(':', '') + '.json'), 'w') as f:
+                json.dump(response, f)
+        parsed = snapshot.parse_snapshot(response)
+        self.buffer.append(epoch, parsed)
+        if self.live_file:
+            self.buffer.save(self.live_file)
+        slot = epoch - epoch % SLOT_SECONDS
+        if slot != self.last_slot:
+            writer.write(storage.from_epoch(slot), parsed)
+            writer.flush()
+            self.last_slot = slot
+        return True
+
+    def run(self):
+        with storage.SnapshotWriter(self.db_path, batch_size=1) as writer:
+            while not self.stopped.is_set():
+                try:
+                    self.poll_once(writer)
+                except Exception as E:
+                    print('Error: ', E)
+                self.stopped.wait(self.poll_seconds)
+
+    def stop(self):
+        self.stopped.set()
+
+
+_ingest = None
+_shared = None
+
+'''
+Starts the live ingest of this process, the dashboard reads its buffer through get_buffer()
+'''
+
+
+def start(url=importer.CAR_PARK_URL, hours=LIVE_HOURS, poll_seconds=POLL_SECONDS, db_path=storage.DB_PATH,
+          record_dir=None, live_file=None):
+    global _ingest
+    _ingest = LiveIngest(url, RingBuffer(hours, poll_seconds), db_path, poll_seconds, record_dir, live_file)
+    _ingest.start()
+    return _ingest
+
+
+'''
+The buffer of the live ingest of this process, else the window python live.py saves to LIVE_FILE,
+None when neither is running
+'''
+
+
+def get_buffer():
+    global _shared
+    if _ingest is not None:
+        return _ingest.buffer
+    if _shared is None:
+        _shared = SharedBuffer(LIVE_FILE)
+    return _shared if _shared.refresh() else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Poll the current car park availability into the database')
+    parser.add_argument('--url', default=importer.CAR_PARK_URL)
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS)
+    parser.add_argument('--db', default=storage.DB_PATH, help='SQLite database file')
+    parser.add_argument('--record', help='save every polled snapshot as json into this directory')
+    parser.add_argument('--live-file', default=LIVE_FILE, help='save the live window here for the dashboard workers')
+    args = parser.parse_args()
+    ingest = start(args.url, poll_seconds=args.poll_seconds, db_path=args.db, record_dir=args.record,
+                   live_file=args.live_file)
+    try:
+        ingest.join()
+    except KeyboardInterrupt:
+        ingest.stop()
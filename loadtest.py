@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+import argparse
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from time import perf_counter, sleep
+
+import numpy as np
+import requests
+
+'''
+Load test of a running dashboard (presenter.py or wsgi.py behind gunicorn). Every virtual user does what the page
+does after a date range change: the dataset-key callback, polling until the aggregates are ready, then the figure
+callbacks of the first tab. Users are drawn from a small set of date ranges so concurrent identical requests happen.
+Prints p50/p90/p99/max latency per request kind, and of the whole page update (session):
+
+    python loadtest.py --url http://127.0.0.1:8050 --concurrency 16 --users 200 --ranges 5 --json loadtest.json
+'''
+
+FIGURES = ['largest_car_park', 'Most_Underutilized_Car_Park', 'Most_Underutilized_Car_Park_2', 'Utilization_Trend']
+PERCENTILES = [50, 90, 99]
+
+_local = threading.local()
+
+
+def get_session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+'''
+Body of a Dash callback request, outputs as (id, property) pairs, inputs as (id, property, value) triples
+'''
+
+
+def callback_body(outputs, inputs, changed):
+    if len(outputs) == 1:
+        output = '{}.{}'.format(*outputs[0])
+    else:
+        output = '..' + '...'.join('{}.{}'.format(*pair) for pair in outputs) + '..'
+    outputs = [{'id': id_, 'property': prop} for id_, prop in outputs]
+    return {'output': output, 'outputs': outputs[0] if len(outputs) == 1 else outputs,
+            'inputs': [{'id': id_, 'property': prop, 'value': value} for id_, prop, value in inputs],
+            'changedPropIds': ['{}.{}'.format(*pair) for pair in changed], 'state': []}
+
+
+def post(url, body, latencies, kind, timeout):
+    started = perf_counter()
+    response = get_session().post(url + '/_dash-update-component', json=body, timeout=timeout)
+    latencies.append((kind, perf_counter() - started, response.status_code))
+    return response
+
+
+def run_user(url, start_date, end_date, poll_seconds, timeout):
+    latencies = []
+    started = perf_counter()
+    key = {'start_date': start_date, 'end_date': end_date}
+    post(url, callback_body([('dataset-key', 'data')],
+                            [('my-date-picker-range', 'start_date', start_date),
+                             ('my-date-picker-range', 'end_date', end_date)],
+                            [('my-date-picker-range', 'start_date')]), latencies, 'dataset_key', timeout)
+    n_intervals = 0
+    while True:
+        response = post(url, callback_body([('dataset-ready', 'data'), ('job-poll', 'disabled'),
+                                            ('job-status', 'children')],
+                                           [('dataset-key', 'data', key), ('job-poll', 'n_intervals', n_intervals)],
+                                           [('dataset-key', 'data') if n_intervals == 0 else ('job-poll', 'n_intervals')]),
+                        latencies, 'poll', timeout)
+        if response.status_code != 200:
+            break
+        result = response.json().get('response', {})
+        if 'dataset-ready' in result or str(result.get('job-status', {}).get('children', '')).startswith('Error'):
+            break
+        n_intervals += 1
+        sleep(poll_seconds)
+    latencies.append(('ready', perf_counter() - started, 200))
+    for name in FIGURES:
+        inputs = [('dataset-ready', 'data', key), ('tabs', 'value', 'metrics')]
+        if name == 'Utilization_Trend':
+            inputs.append((name, 'relayoutData', None))
+        post(url, callback_body([(name, 'figure')], inputs, [('dataset-ready', 'data')]), latencies, 'figure', timeout)
+    latencies.append(('session', perf_counter() - started, 200))
+    return latencies
+
+
+def date_ranges(start_date, end_date, days, count, rng):
+    first = date.fromisoformat(start_date)
+    last = date.fromisoformat(end_date) - timedelta(days=days)
+    starts = [first + timedelta(days=rng.randint(0, max(0, (last - first).days))) for _ in range(count)]
+    return [(start.isoformat(), (start + timedelta(days=days)).isoformat()) for start in starts]
+
+
+def summarize(latencies):
+    summary = {}
+    for kind in sorted(set(kind for kind, _, _ in latencies)):
+        seconds = np.array([value for k, value, _ in latencies if k == kind])
+        errors = sum(1 for k, _, status in latencies if k == kind and status >= 400)
+        summary[kind] = dict({'requests': len(seconds), 'errors': errors, 'max': float(seconds.max())},
+                             **{'p{}'.format(p): float(np.percentile(seconds, p)) for p in PERCENTILES})
+    return summary
+
+
+def run(url, concurrency, users, start_date, end_date, days=1, ranges=5, poll_seconds=1.0, timeout=300, seed=0):
+    rng = random.Random(seed)
+    choices = date_ranges(start_date, end_date, days, ranges, rng)
+    sessions = [rng.choice(choices) for _ in range(users)]
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda session: run_user(url, session[0], session[1], poll_seconds, timeout),
+                                sessions))
+    elapsed = perf_counter() - started
+    latencies = [latency for result in results for latency in result]
+    return {'url': url, 'concurrency': concurrency, 'users': users, 'ranges': choices, 'seconds': elapsed,
+            'requests_per_second': sum(1 for kind, _, _ in latencies if kind not in ['ready', 'session']) / elapsed,
+            'latency': summarize(latencies)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test a running dashboard')
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--concurrency', type=int, default=8, help='users running at the same time')
+    parser.add_argument('--users', type=int, default=50, help='page updates in total')
+    parser.add_argument('--start', default='2018-02-13', help='first day the ranges are drawn from')
+    parser.add_argument('--end', default='2018-02-14', help='day after the last day the ranges are drawn from')
+    parser.add_argument('--days', type=int, default=1, help='length of each date range')
+    parser.add_argument('--ranges', type=int, default=5, help='distinct date ranges the users pick from')
+    parser.add_argument('--poll-seconds', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    output = run(args.url, args.concurrency, args.users, args.start, args.end, args.days, args.ranges,
+                 args.poll_seconds, seed=args.seed)
+    for kind, stats in output['latency'].items():
+        print('{:<12} n={:<6} errors={:<4} '.format(kind, stats['requests'], stats['errors']) + ' '.join(
+            '{}={:.3f}s'.format(name, stats[name]) for name in ['p50', 'p90', 'p99', 'max']))
+    print('{:.1f} requests/s over {:.1f}s'.format(output['requests_per_second'], output['seconds']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
@@ -1,12 +1,20 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import argparse
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from datetime import date
+import dash_table
+from datetime import timedelta
 import dash_bootstrap_components as dbc
+from dash.exceptions import PreventUpdate
+import cache
+import instrumentation
+import live
 import processor as pr
+import storage
 
 '''
 Created by: Pavithra Coimbatore Sainath
@@ -16,224 +24,556 @@ Date: 15th Apr 2021
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.config.suppress_callback_exceptions = False
+# Timing spans per request, /metrics, /profiles and the per-request profiler switch (instrumentation.py)
+instrumentation.install(app.server)
+
+# How often the live tab re-reads the ring buffer
+LIVE_REFRESH_SECONDS = 15
+# How often the page asks whether the aggregates of the selected range are ready
+JOB_POLL_SECONDS = 1
+
+# Generating Layout of the Dashboard, evaluated on every page load so the date picker covers the data ingested so far
+
+
+def serve_layout():
+    first_day, last_day = pr.get_date_bounds()
+    return html.Div(
+        [
+            html.H3("SG Car Park Utilization Study", style={"textAlign": "center", "margin": "2px", "padding": "2px", "width": "100%", "color":"white", "background-color": "#007bff" }),
+            html.Br(),
+            html.H5("Select Dates"),
+            dcc.DatePickerRange(
+                id="my-date-picker-range",
+                min_date_allowed=first_day,
+                max_date_allowed=last_day + timedelta(days=1),
+                start_date=first_day,
+                end_date=first_day + timedelta(days=1),
+            ),
+            dcc.Store(id="dataset-key"),
+            dcc.Store(id="dataset-ready"),
+            dcc.Interval(id="job-poll", interval=JOB_POLL_SECONDS * 1000, disabled=True),
+            html.Div(id="job-status"),
+            html.Br(),
+            html.Br(),
+            dcc.Tabs(
+                id="tabs",
+                value="metrics",
+                children=[
+                    dcc.Tab(
+                        label="Car Park Metrics",
+                        value="metrics",
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.Div(
+                                        children=[
+                                            html.H5("Most Underutilized Car Park"),
+                                            html.Span(
+                                                "Question 1", className="btn btn-primary"
+                                            ),
+                                            dcc.Loading(
+                                                id="loading-2",
+                                                type="circle",
+                                                children=[
+                                                    html.Div(
+                                                        [
+                                                            dcc.Graph(
+                                                                id="Most_Underutilized_Car_Park"
+                                                            )
+                                                        ]
+                                                    )
+                                                ],
+                                            ),
+                                        ],
+                                        style={
+                                            "height": "50%",
+                                            "width": "50%",
+                                            "float": "left",
+                                        },
+                                    ),
+                                    html.Div(
+                                        children=[
+                                            html.H5("Largest Car Park"),
+                                            html.Span(
+                                                "Question 2", className="btn btn-primary"
+                                            ),
+                                            dcc.Loading(
+                                                id="loading-1",
+                                                type="circle",
+                                                children=[
+                                                    html.Div(
+                                                        [dcc.Graph(id="largest_car_park")]
+                                                    )
+                                                ],
+                                            ),
+                                        ],
+                                        style={
+                                            "height": "50%",
+                                            "width": "50%",
+                                            "float": "left",
+                                        },
+                                    ),
+                                    html.Div(
+                                        children=[
+                                            html.H5("Most Underutilized Car Park"),
+                                            dcc.Loading(
+                                                id="loading-3",
+                                                type="circle",
+                                                children=[
+                                                    html.Div(
+                                                        [
+                                                            dcc.Graph(
+                                                                id="Most_Underutilized_Car_Park_2"
+                                                            )
+                                                        ]
+                                                    )
+                                                ],
+                                            ),
+                                        ],
+                                        style={
+                                            "height": "50%",
+                                            "width": "50%",
+                                            "float": "left",
+                                        },
+                                    ),
+                                    html.Div(
+                                        children=[
+                                            html.H5("Car Park Utilization Trend"),
+                                            dcc.Loading(
+                                                id="loading-4",
+                                                type="circle",
+                                                children=[
+                                                    html.Div(
+                                                        [dcc.Graph(id="Utilization_Trend")]
+                                                    )
+                                                ],
+                                            ),
+                                        ],
+                                        style={
+                                            "height": "50%",
+                                            "width": "50%",
+                                            "float": "left",
+                                        },
+                                    ),
+                                ],
+                                style={"height": "100%", "margin": "0", "padding": "0", "border": "1px"},
+                            )
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Lot Type based Occupancy",
+                        value="lot-type",
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.H5("Lot Type Occupancy by Frequency"),
+                                    dcc.Loading(
+                                        id="loading-5",
+                                        type="circle",
+                                        children=[
+                                            html.Div(
+                                                children=[
+                                                    dcc.Graph(id="Utilization_by_Lot_Type")
+                                                ],
+                                                style={
+                                                    "height": "50%",
+                                                    "width": "50%",
+                                                    "float": "left",
+                                                },
+                                            )
+                                        ],
+                                    ),
+                                    html.H5("Lot Type Occupancy by Frequency and Car Park Type"),
+                                    dcc.Loading(
+                                        id="loading-6",
+                                        type="circle",
+                                        children=[
+                                            html.Div(
+                                                children=[
+                                                    dcc.Graph(id="Utilization_by_lt_cp")
+                                                ],
+                                                style={
+                                                    "height": "50%",
+                                                    "width": "50%",
+                                                    "float": "right",
+                                                },
+                                            )
+                                        ],
+                                    ),
+                                ],
+                                style={"height": "100%", "margin": "0", "padding": "0", "border": "1px"},
+                            )
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Car Park Utilization by Area",
+                        value="area",
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.H5("Car Park Utilization by area"),
+                                    dcc.Loading(
+                                        id="loading-7",
+                                        type="circle",
+                                        children=[html.Div([dcc.Graph(id="Utilization_by_Area")])],
+                                    ),
+                                ]
+                            )
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Car Park Profiles",
+                        value="profiles",
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.Div(id="profile-status"),
+                                    html.Div(
+                                        children=[
+                                            html.H5("Car Parks over the Selected Dates"),
+                                            dcc.RadioItems(
+                                                id="top-order",
+                                                options=[{"label": "Least utilized", "value": "least"},
+                                                         {"label": "Most utilized", "value": "most"}],
+                                                value="least",
+                                            ),
+                                            dash_table.DataTable(
+                                                id="top-table",
+                                                columns=[{"name": col, "id": col}
+                                                         for col in ["car_park_no", "%occupied", "row_count"]],
+                                            ),
+                                        ],
+                                        style={"width": "30%", "float": "left"},
+                                    ),
+                                    html.Div(
+                                        children=[
+                                            html.H5("Occupancy Profile"),
+                                            dcc.Input(id="profile-carpark", type="text", placeholder="Car park number",
+                                                      debounce=True),
+                                            dcc.Dropdown(
+                                                id="profile-lot-type",
+                                                options=[{"label": lot_type, "value": lot_type}
+                                                         for lot_type in live.LOT_TYPES],
+                                                value="C",
+                                                clearable=False,
+                                            ),
+                                            dcc.Graph(id="Carpark_Profile"),
+                                        ],
+                                        style={"width": "70%", "float": "left"},
+                                    ),
+                                    html.H5("Unusual Occupancy in the Selected Dates"),
+                                    dash_table.DataTable(
+                                        id="anomaly-table",
+                                        columns=[{"name": col, "id": col}
+                                                 for col in ["timestamp", "car_park_no", "lot_type", "%occupied",
+                                                             "profile_mean", "z"]],
+                                        page_size=pr.SAMPLE_PAGE_SIZE,
+                                    ),
+                                ]
+                            )
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Data Set Samples",
+                        value="samples",
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.H5("Data Overview"),
+                                    dash_table.DataTable(
+                                        id="sample-table",
+                                        columns=[{"name": col, "id": col} for col in pr.ALL_COLUMNS],
+                                        page_current=0,
+                                        page_size=pr.SAMPLE_PAGE_SIZE,
+                                        page_action="custom",
+                                        style_table={"overflowX": "auto"},
+                                    ),
+                                ]
+                            )
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Live",
+                        value="live",
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.H5("Live Occupancy"),
+                                    html.Div(id="live-status"),
+                                    dcc.Interval(id="live-interval", interval=LIVE_REFRESH_SECONDS * 1000),
+                                    html.Div(
+                                        children=[dcc.Graph(id="live_trend")],
+                                        style={"height": "50%", "width": "50%", "float": "left"},
+                                    ),
+                                    html.Div(
+                                        children=[dcc.Graph(id="live_underutilized")],
+                                        style={"height": "50%", "width": "50%", "float": "left"},
+                                    ),
+                                ]
+                            )
+                        ],
+                    ),
+                ]
+            ),
+        ]
+    )
 
-# Generating Layout of the Dashboard
-app.layout = html.Div(
-    [
-        html.H3("SG Car Park Utilization Study", style={"textAlign": "center", "margin": "2px", "padding": "2px", "width": "100%", "color":"white", "background-color": "#007bff" }),
-        html.Br(),
-        html.H5("Select Dates"),
-        dcc.DatePickerRange(
-            id="my-date-picker-range",
-            min_date_allowed=date(2018, 2, 13),
-            max_date_allowed=date(2018, 2, 23),
-            start_date=date(2018, 2, 13),
-            end_date=date(2018, 2, 14),
-        ),
-        html.Br(),
-        html.Br(),
-        dcc.Tabs(
-            [
-                dcc.Tab(
-                    label="Car Park Metrics",
-                    children=[
-                        html.Div(
-                            children=[
-                                html.Div(
-                                    children=[
-                                        html.H5("Most Underutilized Car Park"),
-                                        html.Span(
-                                            "Question 1", className="btn btn-primary"
-                                        ),
-                                        dcc.Loading(
-                                            id="loading-2",
-                                            type="circle",
-                                            children=[
-                                                html.Div(
-                                                    [
-                                                        dcc.Graph(
-                                                            id="Most_Underutilized_Car_Park"
-                                                        )
-                                                    ]
-                                                )
-                                            ],
-                                        ),
-                                    ],
-                                    style={
-                                        "height": "50%",
-                                        "width": "50%",
-                                        "float": "left",
-                                    },
-                                ),
-                                html.Div(
-                                    children=[
-                                        html.H5("Largest Car Park"),
-                                        html.Span(
-                                            "Question 2", className="btn btn-primary"
-                                        ),
-                                        dcc.Loading(
-                                            id="loading-1",
-                                            type="circle",
-                                            children=[
-                                                html.Div(
-                                                    [dcc.Graph(id="largest_car_park")]
-                                                )
-                                            ],
-                                        ),
-                                    ],
-                                    style={
-                                        "height": "50%",
-                                        "width": "50%",
-                                        "float": "left",
-                                    },
-                                ),
-                                html.Div(
-                                    children=[
-                                        html.H5("Most Underutilized Car Park"),
-                                        dcc.Loading(
-                                            id="loading-3",
-                                            type="circle",
-                                            children=[
-                                                html.Div(
-                                                    [
-                                                        dcc.Graph(
-                                                            id="Most_Underutilized_Car_Park_2"
-                                                        )
-                                                    ]
-                                                )
-                                            ],
-                                        ),
-                                    ],
-                                    style={
-                                        "height": "50%",
-                                        "width": "50%",
-                                        "float": "left",
-                                    },
-                                ),
-                                html.Div(
-                                    children=[
-                                        html.H5("Car Park Utilization Trend"),
-                                        dcc.Loading(
-                                            id="loading-4",
-                                            type="circle",
-                                            children=[
-                                                html.Div(
-                                                    [dcc.Graph(id="Utilization_Trend")]
-                                                )
-                                            ],
-                                        ),
-                                    ],
-                                    style={
-                                        "height": "50%",
-                                        "width": "50%",
-                                        "float": "left",
-                                    },
-                                ),
-                            ],
-                            style={"height": "100%", "margin": "0", "padding": "0", "border": "1px"},
-                        )
-                    ],
-                ),
-                dcc.Tab(
-                    label="Lot Type based Occupancy",
-                    children=[
-                        html.Div(
-                            children=[
-                                html.H5("Lot Type Occupancy by Frequency"),
-                                dcc.Loading(
-                                    id="loading-5",
-                                    type="circle",
-                                    children=[
-                                        html.Div(
-                                            children=[
-                                                dcc.Graph(id="Utilization_by_Lot_Type")
-                                            ],
-                                            style={
-                                                "height": "50%",
-                                                "width": "50%",
-                                                "float": "left",
-                                            },
-                                        )
-                                    ],
-                                ),
-                                html.H5("Lot Type Occupancy by Frequency and Car Park Type"),
-                                dcc.Loading(
-                                    id="loading-6",
-                                    type="circle",
-                                    children=[
-                                        html.Div(
-                                            children=[
-                                                dcc.Graph(id="Utilization_by_lt_cp")
-                                            ],
-                                            style={
-                                                "height": "50%",
-                                                "width": "50%",
-                                                "float": "right",
-                                            },
-                                        )
-                                    ],
-                                ),
-                            ],
-                            style={"height": "100%", "margin": "0", "padding": "0", "border": "1px"},
-                        )
-                    ],
-                ),
-                dcc.Tab(
-                    label="Car Park Utilization by Area",
-                    children=[
-                        html.Div(
-                            children=[
-                                html.H5("Car Park Utilization by area"),
-                                html.Img(
-                                    src=app.get_asset_url("car_park_choropleth.png"),
-                                    style={"height": "100%", "width": "100%"},
-                                ),
-                            ]
-                        )
-                    ],
-                ),
-                dcc.Tab(
-                    label="Data Set Samples",
-                    children=[
-                        html.Div(children=[html.H5("Data Overview"), pr.generate_table()])
-                    ],
-                ),
-            ]
-        ),
-    ]
-)
+
+app.layout = serve_layout
+
+
+# Tab each figure is shown on, figures are only built once their tab is opened
+FIGURE_TABS = {
+    'largest_car_park': 'metrics',
+    'Most_Underutilized_Car_Park': 'metrics',
+    'Most_Underutilized_Car_Park_2': 'metrics',
+    'Utilization_Trend': 'metrics',
+    'Utilization_by_Lot_Type': 'lot-type',
+    'Utilization_by_lt_cp': 'lot-type',
+    'Utilization_by_Area': 'area',
+}
+
+
+'''
+The date range is turned into a cache key once and the aggregates for it start computing in a background job,
+the request returns immediately
+'''
 
 
 @app.callback(
-    [dash.dependencies.Output('largest_car_park', 'figure'),
-     dash.dependencies.Output('Most_Underutilized_Car_Park', 'figure'),
-     dash.dependencies.Output('Most_Underutilized_Car_Park_2', 'figure'),
-     dash.dependencies.Output('Utilization_Trend', 'figure'),
-     dash.dependencies.Output('Utilization_by_Lot_Type', 'figure'),
-     dash.dependencies.Output('Utilization_by_lt_cp', 'figure')],
+    dash.dependencies.Output('dataset-key', 'data'),
     [dash.dependencies.Input('my-date-picker-range', 'start_date'),
      dash.dependencies.Input('my-date-picker-range', 'end_date')])
-def update_output(start_date, end_date):
-    start_date_string = ""
-    end_date_string = ""
-    if start_date is not None:
-        start_date_object = date.fromisoformat(start_date)
-        start_date_string = start_date_object.strftime('%Y-%m-%d')
-    if end_date is not None:
-        end_date_object = date.fromisoformat(end_date)
-        end_date_string = end_date_object.strftime('%Y-%m-%d')
-    merged_data = pr.prepare_data(start_date_string, end_date_string)
-    fig0 = pr.largest_carpark(merged_data)
-    fig1 = pr.most_underutilized_car_park(merged_data)
-    fig2 = pr.most_underutilized_car_park_occupancy(merged_data)
-    fig3 = pr.most_utilized_lt(merged_data)
-    fig4 = pr.most_utilized_cp_lt(merged_data)
-    fig5 = pr.utilization_trend(merged_data)
-    return [fig0, fig1, fig2, fig5, fig3, fig4]
+def update_dataset_key(start_date, end_date):
+    if start_date is None or end_date is None:
+        raise PreventUpdate
+    start_date, end_date = cache.normalize_range(start_date, end_date)
+    pr.warm_aggregates(start_date, end_date)
+    return {'start_date': start_date, 'end_date': end_date}
+
+
+'''
+Polls the background job until the aggregates are cached, then publishes the key in dataset-ready,
+which the figure callbacks below listen to. The job is resubmitted when this worker process has none running
+for the range (another worker took the date range change), the cache coalesces the computation.
+'''
+
+
+@app.callback(
+    [dash.dependencies.Output('dataset-ready', 'data'),
+     dash.dependencies.Output('job-poll', 'disabled'),
+     dash.dependencies.Output('job-status', 'children')],
+    [dash.dependencies.Input('dataset-key', 'data'),
+     dash.dependencies.Input('job-poll', 'n_intervals')])
+def poll_aggregates(dataset_key, n_intervals):
+    if dataset_key is None:
+        raise PreventUpdate
+    if pr.aggregates_ready(dataset_key['start_date'], dataset_key['end_date']):
+        return dataset_key, True, ''
+    job = pr.warm_aggregates(dataset_key['start_date'], dataset_key['end_date'])
+    if job.done() and job.exception() is not None:
+        return dash.no_update, True, 'Error: {}'.format(job.exception())
+    return dash.no_update, False, 'Computing {} to {}...'.format(dataset_key['start_date'], dataset_key['end_date'])
+
+
+'''
+One callback per figure, so each graph renders as soon as its own figure is ready
+and the browser requests them concurrently
+'''
+
+
+def register_figure_callback(name, tab):
+    @app.callback(
+        dash.dependencies.Output(name, 'figure'),
+        [dash.dependencies.Input('dataset-ready', 'data'),
+         dash.dependencies.Input('tabs', 'value')])
+    def update_figure(dataset_key, active_tab):
+        if dataset_key is None or active_tab != tab:
+            raise PreventUpdate
+        with instrumentation.span('callback', output=name):
+            return pr.figure(name, dataset_key['start_date'], dataset_key['end_date'])
+
+
+for figure_name, figure_tab in FIGURE_TABS.items():
+    if figure_name not in pr.ZOOM_FIGURES:
+        register_figure_callback(figure_name, figure_tab)
+
+
+'''
+x axis window of a zoom from the graph's relayoutData, 'reset' when the axes were reset, None for other relayouts
+'''
+
+
+def zoom_window(relayout_data):
+    relayout_data = relayout_data or {}
+    if relayout_data.get('xaxis.autorange'):
+        return 'reset'
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'][:2])
+    return None
+
+
+'''
+Zoomable figures are redrawn for the visible window when the user zooms, so the detail of a long range
+is only sent for the part on screen. A new date range or tab shows the whole range again.
+'''
+
+
+def register_zoom_callback(name, tab):
+    @app.callback(
+        dash.dependencies.Output(name, 'figure'),
+        [dash.dependencies.Input('dataset-ready', 'data'),
+         dash.dependencies.Input('tabs', 'value'),
+         dash.dependencies.Input(name, 'relayoutData')])
+    def update_zoom_figure(dataset_key, active_tab, relayout_data):
+        if dataset_key is None or active_tab != tab:
+            raise PreventUpdate
+        triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+        window = None
+        if triggered == ['{}.relayoutData'.format(name)]:
+            window = zoom_window(relayout_data)
+            if window is None:
+                raise PreventUpdate
+            if window == 'reset':
+                window = None
+        with instrumentation.span('callback', output=name):
+            return pr.figure(name, dataset_key['start_date'], dataset_key['end_date'], window)
+
+
+for figure_name in pr.ZOOM_FIGURES:
+    register_zoom_callback(figure_name, FIGURE_TABS[figure_name])
+
+
+'''
+The sample table is only filled once its tab is opened, one page at a time from the server
+'''
+
+
+@app.callback(
+    [dash.dependencies.Output('sample-table', 'data'),
+     dash.dependencies.Output('sample-table', 'page_count')],
+    [dash.dependencies.Input('tabs', 'value'),
+     dash.dependencies.Input('sample-table', 'page_current'),
+     dash.dependencies.Input('sample-table', 'page_size')])
+def update_sample_table(active_tab, page_current, page_size):
+    if active_tab != 'samples':
+        raise PreventUpdate
+    records, total = pr.get_sample_page(page_current or 0, page_size)
+    return records, max(1, -(-total // page_size))
+
+
+'''
+Profiles tab: ranking and unusual rows of the selected dates, and the occupancy profile of the car park
+clicked in the ranking (or typed in), all read from the rollups
+'''
+
+ROLLUPS_MISSING = 'The profiles need up to date rollups, run "python storage.py rebuild-rollups"'
+
+
+def records(frame):
+    frame = frame.round(3)
+    if 'timestamp' in frame:
+        frame['timestamp'] = frame['timestamp'].dt.strftime('%Y-%m-%d %H:%M')
+    return frame.to_dict('records')
+
+
+@app.callback(
+    [dash.dependencies.Output('top-table', 'data'),
+     dash.dependencies.Output('profile-status', 'children')],
+    [dash.dependencies.Input('dataset-ready', 'data'),
+     dash.dependencies.Input('tabs', 'value'),
+     dash.dependencies.Input('top-order', 'value')])
+def update_top_carparks(dataset_key, active_tab, order):
+    if dataset_key is None or active_tab != 'profiles':
+        raise PreventUpdate
+    top = pr.get_top_carparks(dataset_key['start_date'], dataset_key['end_date'], least=order == 'least')
+    if top is None:
+        return [], ROLLUPS_MISSING
+    return records(top), ''
+
+
+@app.callback(
+    dash.dependencies.Output('profile-carpark', 'value'),
+    [dash.dependencies.Input('top-table', 'active_cell'),
+     dash.dependencies.Input('top-table', 'data')],
+    [dash.dependencies.State('profile-carpark', 'value')])
+def select_profile_carpark(active_cell, data, current):
+    if not data:
+        raise PreventUpdate
+    if active_cell is not None and active_cell['row'] < len(data):
+        return data[active_cell['row']]['car_park_no']
+    if not current:
+        return data[0]['car_park_no']
+    raise PreventUpdate
+
+
+@app.callback(
+    dash.dependencies.Output('Carpark_Profile', 'figure'),
+    [dash.dependencies.Input('profile-carpark', 'value'),
+     dash.dependencies.Input('profile-lot-type', 'value'),
+     dash.dependencies.Input('tabs', 'value')])
+def update_profile(car_park_no, lot_type, active_tab):
+    if not car_park_no or active_tab != 'profiles':
+        raise PreventUpdate
+    fig = pr.get_profile_figure(car_park_no.strip().upper(), lot_type)
+    if fig is None:
+        raise PreventUpdate
+    return fig
+
+
+@app.callback(
+    dash.dependencies.Output('anomaly-table', 'data'),
+    [dash.dependencies.Input('dataset-ready', 'data'),
+     dash.dependencies.Input('tabs', 'value')])
+def update_anomalies(dataset_key, active_tab):
+    if dataset_key is None or active_tab != 'profiles':
+        raise PreventUpdate
+    rows = pr.get_anomalies(dataset_key['start_date'], dataset_key['end_date'])
+    return [] if rows is None else records(rows)
+
+
+'''
+The live tab is redrawn from the in-memory ring buffer of the live ingest, only when a new snapshot arrived
+'''
+
+live_figures = {}
+
+
+@app.callback(
+    [dash.dependencies.Output('live_trend', 'figure'),
+     dash.dependencies.Output('live_underutilized', 'figure'),
+     dash.dependencies.Output('live-status', 'children')],
+    [dash.dependencies.Input('live-interval', 'n_intervals'),
+     dash.dependencies.Input('tabs', 'value')])
+def update_live(n_intervals, active_tab):
+    if active_tab != 'live':
+        raise PreventUpdate
+    buffer = live.get_buffer()
+    if buffer is None:
+        return dash.no_update, dash.no_update, 'Live ingest is not running, start the dashboard with --live-url or run live.py'
+    latest = buffer.latest
+    if latest is None:
+        return dash.no_update, dash.no_update, 'Waiting for the first snapshot'
+    if live_figures.get('latest') != latest:
+        live_figures.update(latest=latest, trend=pr.live_trend(buffer), underutilized=pr.live_underutilized(buffer))
+    return live_figures['trend'], live_figures['underutilized'], 'Last snapshot {}, {} snapshots in the last {} hours'.format(
+        storage.from_epoch(latest).replace('T', ' '), buffer.size, live.LIVE_HOURS)
 
 
 # Main
 
 
 if __name__ == '__main__':
-    app.run_server(debug=False, host="0.0.0.0")
+    parser = argparse.ArgumentParser(description='SG car park utilization dashboard')
+    parser.add_argument('--live-url', help='poll this availability endpoint and show it on the Live tab')
+    parser.add_argument('--poll-seconds', type=float, default=live.POLL_SECONDS)
+    parser.add_argument('--record', help='save every polled snapshot as json into this directory')
+    parser.add_argument('--span-log', help="write every timing span as a json line to this file ('-' for stderr)")
+    args = parser.parse_args()
+    if args.span_log:
+        instrumentation.configure_log(args.span_log)
+    if args.live_url:
+        live.start(args.live_url, poll_seconds=args.poll_seconds, record_dir=args.record)
+    app.run_server(debug=False, host="0.0.0.0", threaded=True)
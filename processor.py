@@ -1,12 +1,25 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import sqlite3
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
 
-import dash_html_components as html
 import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+
+import cache
+import columnar
+import geo
+import instrumentation
+import profiles
+import reference
+import storage
 
 '''
 Created by: Pavithra Coimbatore Sainath
@@ -18,26 +31,48 @@ Date: 15th Apr 2021
 DATA_GEN_START_DATE = "2018-02-13"
 DATA_GEN_END_DATE = "2018-02-14"
 
+# Number of car parks ranked per timestamp
+TOP_K = storage.TOP_K
+
+# SQL expression for every column of the merged data set, in the order the merge used to produce them
+COLUMN_SQL = {
+    'car_park_no': 'r.car_park_no',
+    'address': 'r.address',
+    'x_coord': 'r.x_coord',
+    'y_coord': 'r.y_coord',
+    'car_park_type': 'r.car_park_type',
+    'type_of_parking_system': 'r.type_of_parking_system',
+    'short_term_parking': 'r.short_term_parking',
+    'free_parking': 'r.free_parking',
+    'night_parking': 'r.night_parking',
+    'car_park_decks': 'r.car_park_decks',
+    'gantry_height': 'r.gantry_height',
+    'car_park_basement': 'r.car_park_basement',
+    'total_lots': 'a.total_lots',
+    'lot_type': 'a.lot_type',
+    'lots_available': 'a.lots_available',
+    'carpark_number': 'c.carpark_number',
+    'update_datetime': 'a.update_datetime',
+    'timestamp': 'a.timestamp',
+    '%occupied': storage.OCCUPIED_SQL,
+}
+ALL_COLUMNS = list(COLUMN_SQL)
+
 '''
-This function returns the data from sqlite Database. 
-Sqlite Database will be populated by DataImport.py through API scrapping.
+Builds the query for the merged data set.
+1. Rows with total lots 0, or available lots not below total lots, are not meaningful and are dropped (storage.FILTER_SQL).
+2. Only car parks passing the business filter are kept, the join with the reference data is an inner join
+   since the old left merge dropped car parks without availability rows anyway.
+3. The range covers start_date 00:00 up to (excluding) end_date 00:00, on the clustered timestamp key.
 '''
 
 
-def get_data(start_date, end_date):
-    try:
-        db = sqlite3.connect('./data/Carpark_15min')
-        car_park_avail_data = pd.read_sql_query(
-            "SELECT * from carpark_availability_15min where timestamp between ? and ?", db,
-            params=(start_date, end_date))
-
-        # Read carpark reference data from a csv file
-        carpark_ref_data = pd.read_csv('./data/hdb-carpark-information/hdb-carpark-information.csv')
-        return car_park_avail_data, carpark_ref_data
-    except Exception as E:
-        print('Error: ', E)
-    else:
-        db.close()
+def build_query(columns):
+    return """select {} from carpark_availability_15min a
+        join carpark c on c.carpark_id = a.carpark_id
+        join carpark_reference r on r.car_park_no = c.carpark_number
+        where a.timestamp >= ? and a.timestamp < ? and {}""".format(
+        ', '.join('{} as "{}"'.format(COLUMN_SQL[column], column) for column in columns), storage.FILTER_SQL)
 
 
 '''
@@ -50,42 +85,393 @@ def convert_million_to_thousands(values):
     return [str(num / 1000) + 'k' for num in values]
 
 
+# Rows read from SQLite per chunk while building the compact data set
+DATASET_CHUNK_ROWS = 100000
+
+FACT_SQL = """select a.timestamp, a.carpark_id, a.lot_type, a.total_lots, a.lots_available
+        from carpark_availability_15min a
+        join carpark c on c.carpark_id = a.carpark_id
+        join carpark_reference r on r.car_park_no = c.carpark_number
+        where a.timestamp >= ? and a.timestamp < ? and {}""".format(storage.FILTER_SQL)
+
+CARPARKS_SQL = '''select c.carpark_id as carpark, {}, {} as business
+        from carpark c join carpark_reference r on r.car_park_no = c.carpark_number'''.format(
+    ', '.join('r.' + column for column in storage.REFERENCE_COLUMNS), storage.REFERENCE_FILTER_SQL)
+
+'''
+Dimension table of the compact data set: one row per car park, indexed by its carpark_id code,
+with the reference attributes (repeated values as categoricals) and whether it passes the business filter.
+Read from the carpark_reference table FACT_SQL joins, so both always agree on the car parks and their types.
+'''
+
+
+def load_carparks(db):
+    carparks = pd.read_sql_query(CARPARKS_SQL, db, index_col='carpark')
+    for column in reference.CATEGORY_COLUMNS:
+        carparks[column] = carparks[column].astype('category')
+    carparks['x_coord'] = carparks['x_coord'].astype('float32')
+    carparks['y_coord'] = carparks['y_coord'].astype('float32')
+    carparks['business'] = carparks['business'].astype(bool)
+    return carparks
+
+
+'''
+Fact rows of one chunk in their compact dtypes
+'''
+
+
+def compact_facts(chunk, carparks):
+    carpark = chunk['carpark_id'].to_numpy(dtype='int32')
+    positions = carparks.index.get_indexer(carpark)
+    if (positions < 0).any():
+        raise ValueError('Car parks {} are not in the car park table'.format(sorted(set(carpark[positions < 0]))))
+    total_lots = chunk['total_lots'].to_numpy(dtype='int16')
+    lots_available = chunk['lots_available'].to_numpy(dtype='int16')
+    car_park_type = carparks['car_park_type']
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(chunk['timestamp'].to_numpy(), unit='s'),
+        'carpark': carpark,
+        'lot_type': chunk['lot_type'].astype('category'),
+        'car_park_type': pd.Categorical.from_codes(
+            car_park_type.cat.codes.to_numpy()[positions], car_park_type.cat.categories),
+        'total_lots': total_lots,
+        'lots_available': lots_available,
+        '%occupied': (1 - lots_available / total_lots).astype('float32'),
+    })
+
+
+'''
+Fact chunks of the range read from SQLite with the filter applied in SQL (FACT_SQL)
+'''
+
+
+def sqlite_chunks(db, carparks, start_epoch, end_epoch):
+    return [compact_facts(chunk, carparks) for chunk in pd.read_sql_query(
+        FACT_SQL, db, params=(start_epoch, end_epoch), chunksize=DATASET_CHUNK_ROWS)]
+
+
+'''
+Fact chunks of the range read from the memory-mapped column store: only the rows passing the filter
+(storage.FILTER_SQL, the reference part evaluated once per car park by load_carparks) are copied out of the
+mapped partitions. Days whose partition is missing or stale (columnar.load_range) are read from SQLite.
+'''
+
+
+def column_store_chunks(db, store, carparks, start_epoch, end_epoch):
+    allowed = carparks.index[carparks['business'].to_numpy()]
+    lookup = np.zeros(db.execute('select ifnull(max(carpark_id), 0) + 1 from carpark').fetchone()[0], dtype=bool)
+    lookup[allowed] = True
+    row_counts = dict(db.execute('select day, row_count from availability_days where day >= ? and day < ?',
+                                 (start_epoch - start_epoch % columnar.SECONDS_PER_DAY, end_epoch)))
+    lot_types, parts = columnar.load_range(store, start_epoch, end_epoch, row_counts)
+    chunks = []
+    for day, part in parts:
+        if part is None:
+            chunks.extend(sqlite_chunks(db, carparks, max(day, start_epoch),
+                                        min(day + columnar.SECONDS_PER_DAY, end_epoch)))
+            continue
+        carpark_id = part['carpark_id']
+        keep = (part['total_lots'] > 0) & (part['lots_available'] < part['total_lots'])
+        keep &= lookup[carpark_id]
+        chunks.append(compact_facts(pd.DataFrame({
+            'timestamp': part['timestamp'][keep],
+            'carpark_id': carpark_id[keep],
+            'lot_type': pd.Categorical.from_codes(part['lot_type'][keep], lot_types),
+            'total_lots': part['total_lots'][keep],
+            'lots_available': part['lots_available'][keep],
+        }, copy=False), carparks))
+    return chunks
+
+
+'''
+Loads the merged data set for the range in a compact form:
+  carparks: dimension table (load_carparks)
+  facts: one row per (timestamp, carpark, lot_type), datetime64 timestamp, int32 carpark code,
+         categorical lot_type and car_park_type, int16 lot counts and float32 %occupied
+The rows come from the column store when the database has one (python storage.py compact), falling back to SQLite
+for its missing or stale days, otherwise from SQLite with the filter applied in SQL (FACT_SQL), converted chunk by
+chunk so the wide frame of strings never exists.
+The data set is shared (cached rankings), consumers must not modify it.
+'''
+
+
+def prepare_data(start_date, end_date, db_path=storage.DB_PATH, column_store=True):
+    start_epoch, end_epoch = storage.to_epoch(start_date), storage.to_epoch(end_date)
+    store = columnar.store_path(db_path)
+    with instrumentation.span('prepare_data') as prepare_span:
+        db = storage.connect_reader(db_path)
+        try:
+            # one read transaction, a reference reload committed meanwhile must not split the car parks and the facts
+            db.execute('BEGIN')
+            with instrumentation.span('load_carparks') as span:
+                carparks = load_carparks(db)
+                span.set(rows_out=len(carparks))
+            chunks = None
+            if column_store and columnar.exists(store):
+                try:
+                    with instrumentation.span('read_facts', source='column_store') as span:
+                        chunks = column_store_chunks(db, store, carparks, start_epoch, end_epoch)
+                        span.set(rows_out=sum(len(chunk) for chunk in chunks))
+                except OSError as E:
+                    print('Error: ', E)
+            if chunks is None:
+                with instrumentation.span('read_facts', source='sqlite') as span:
+                    chunks = sqlite_chunks(db, carparks, start_epoch, end_epoch)
+                    span.set(rows_out=sum(len(chunk) for chunk in chunks))
+        finally:
+            db.close()
+        with instrumentation.span('concat_facts') as span:
+            if chunks:
+                facts = pd.concat(chunks, ignore_index=True)
+                facts['lot_type'] = facts['lot_type'].astype('category')
+            else:
+                facts = compact_facts(pd.DataFrame({column: [] for column in storage.COLUMNS}), carparks)
+            span.set(rows_in=len(facts), rows_out=len(facts))
+        prepare_span.set(rows_out=len(facts))
+    return {'facts': facts, 'carparks': carparks}
+
+
+'''
+Vectorized replacement for groupby(group_column).apply(lambda x: x.nlargest/nsmallest(k, value_column)).
+Rows are laid out as one padded row per group, np.partition finds each group's k-th value in linear time,
+and ties on the k-th value are resolved by row order like nlargest(keep='first').
+Only the selected group * k rows are sorted, the result is ordered by group and rank as groupby().apply returns it.
+'''
+
+
+def top_k_per_group(data, group_column, value_column, k, largest=True):
+    if data[value_column].isnull().any():
+        data = data[data[value_column].notnull()]
+    groups = sort_key(data[group_column])
+    values = data[value_column].to_numpy(dtype='float64')
+    if largest:
+        values = -values
+    # rows come out of SQL ordered by timestamp, only sort when they are not grouped already
+    order = None
+    if len(groups) and (np.diff(groups) < 0).any():
+        order = np.argsort(groups, kind='stable')
+        groups, values = groups[order], values[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else np.array([], dtype=int)
+    sizes = np.diff(np.r_[starts, len(groups)])
+    if not len(starts):
+        return data.iloc[[]].reset_index(drop=True)
+    group_index = np.repeat(np.arange(len(starts)), sizes)
+    position = np.arange(len(groups)) - np.repeat(starts, sizes)
+    padded = np.full((len(starts), sizes.max()), np.inf)
+    padded[group_index, position] = values
+    valid = np.arange(padded.shape[1]) < sizes[:, None]
+    kk = min(k, padded.shape[1])
+    threshold = np.partition(padded, kk - 1, axis=1)[:, kk - 1:kk]
+    better = padded < threshold
+    tied = (padded == threshold) & valid
+    need = kk - better.sum(axis=1, keepdims=True)
+    take = better | (tied & (np.cumsum(tied, axis=1) <= need))
+    selected_group, selected_position = np.nonzero(take)
+    # order the selection by group, then value, then original row order
+    rank = np.lexsort((selected_position, padded[selected_group, selected_position], selected_group))
+    rows = starts[selected_group[rank]] + selected_position[rank]
+    if order is not None:
+        rows = order[rows]
+    return data.iloc[rows].reset_index(drop=True)
+
+
+def sort_key(column):
+    if column.dtype.kind == 'M':
+        return column.values.view('int64')
+    if column.dtype.kind == 'O' or str(column.dtype) == 'category':
+        return pd.factorize(column, sort=True)[0]
+    return column.to_numpy()
+
+
+'''
+%occupied of the fact rows in float64, computed from the lot counts exactly as the rollups compute it,
+so rankings and sums match the rollup path; the stored float32 column is precise enough only for display
+'''
+
+
+def occupancy(facts):
+    return 1 - facts['lots_available'] / facts['total_lots'].astype('float64')
+
+
+_rankings = {}
+
+'''
+Per-timestamp top TOP_K rankings (RANKING_COLUMNS) shared by the figure functions.
+Computed once per prepared data set and dropped when the data set is garbage collected.
+'''
+
+RANKING_COLUMNS = ['timestamp', 'car_park_no', 'total_lots', '%occupied']
+
+
+def get_rankings(dataset):
+    facts = dataset['facts']
+    key = id(facts)
+    if key not in _rankings:
+        car_park_no = dataset['carparks']['car_park_no']
+        ranked_data = pd.DataFrame({'timestamp': facts['timestamp'], 'carpark': facts['carpark'],
+                                    'total_lots': facts['total_lots'], '%occupied': occupancy(facts)})
+        rankings = {}
+        for name, column, largest in [('largest', 'total_lots', True), ('underutilized', '%occupied', False)]:
+            with instrumentation.span('ranking', ranking=name) as span:
+                ranked = top_k_per_group(ranked_data, 'timestamp', column, TOP_K, largest=largest)
+                rankings[name] = pd.DataFrame({
+                    'timestamp': ranked['timestamp'],
+                    'car_park_no': car_park_no.reindex(ranked['carpark']).to_numpy(),
+                    'total_lots': ranked['total_lots'].astype('int64'),
+                    '%occupied': ranked['%occupied'],
+                })
+                span.set(rows_in=len(ranked_data), rows_out=len(ranked))
+        _rankings[key] = rankings
+        weakref.finalize(facts, _rankings.pop, key, None)
+    return _rankings[key]
+
+
+'''
+Aggregates the figures are drawn from, small and independent of the number of rows:
+  largest / underutilized: per-timestamp top TOP_K rows (timestamp, car_park_no, total_lots, %occupied)
+  lot_stats: %occupied sum and row count per (timestamp, lot_type, car_park_type)
+  carpark_stats: %occupied sum and row count per car_park_no over the range
+aggregate() builds them from a prepared data set, without copying or modifying it,
+load_aggregates() reads the same shape from the rollup tables.
+'''
+
+
+def aggregate(dataset):
+    facts = dataset['facts']
+    rankings = get_rankings(dataset)
+    with instrumentation.span('aggregate') as span:
+        aggregates = aggregate_stats(dataset)
+        span.set(rows_in=len(facts), rows_out=len(aggregates['lot_stats']) + len(aggregates['carpark_stats']))
+    aggregates.update(rankings)
+    return aggregates
+
+
+def aggregate_stats(dataset):
+    facts = dataset['facts']
+    occupied = occupancy(facts)
+    lot_stats = occupied.groupby([facts['timestamp'], facts['lot_type'], facts['car_park_type']],
+                                 observed=True).agg(['sum', 'count'])
+    lot_stats = lot_stats.reset_index().rename(columns={'sum': 'occupied_sum', 'count': 'row_count'})
+    for column in ['lot_type', 'car_park_type']:
+        lot_stats[column] = lot_stats[column].astype('object')
+    carpark_stats = occupied.groupby(facts['carpark'].to_numpy()).agg(['sum', 'count'])
+    carpark_stats = pd.DataFrame({
+        'car_park_no': dataset['carparks']['car_park_no'].reindex(carpark_stats.index).to_numpy(),
+        'occupied_sum': carpark_stats['sum'].to_numpy(),
+        'row_count': carpark_stats['count'].to_numpy(),
+    })
+    return {
+        'lot_stats': lot_stats,
+        'carpark_stats': carpark_stats,
+    }
+
+
+def load_aggregates(db, start_date, end_date):
+    with instrumentation.span('load_aggregates', source='rollups') as span:
+        aggregates = read_rollups(db, start_date, end_date)
+        span.set(rows_out=sum(len(value) for value in aggregates.values()))
+    return aggregates
+
+
+def read_rollups(db, start_date, end_date):
+    params = (storage.to_epoch(start_date), storage.to_epoch(end_date))
+    lot_stats = pd.read_sql_query(
+        "SELECT timestamp, lot_type, car_park_type, occupied_sum, row_count from rollup_lot_stats "
+        "where timestamp >= ? and timestamp < ?", db, params=params)
+    lot_stats['timestamp'] = pd.to_datetime(lot_stats['timestamp'], unit='s')
+    carpark_stats = pd.read_sql_query(
+        "SELECT c.carpark_number as car_park_no, sum(d.occupied_sum) as occupied_sum, sum(d.row_count) as row_count "
+        "from rollup_carpark_day d join carpark c on c.carpark_id = d.carpark_id "
+        "where d.day >= ? and d.day < ? group by c.carpark_number", db, params=params)
+    aggregates = {'lot_stats': lot_stats, 'carpark_stats': carpark_stats}
+    for ranking in storage.RANKINGS:
+        ranked = pd.read_sql_query(
+            'SELECT timestamp, car_park_no, total_lots, occupied as "%occupied" from rollup_rankings '
+            'where ranking = ? and timestamp >= ? and timestamp < ? order by timestamp, rank', db,
+            params=(ranking,) + params)
+        ranked['timestamp'] = pd.to_datetime(ranked['timestamp'], unit='s')
+        aggregates[ranking] = ranked
+    return aggregates
+
+
 '''
-1. Filter data with 'Electronic car park system' and 'Whole day parking' as per business needs.
-2. Merge the car park availability data with car park reference data.
-3. Remove null values and do basic preprocessing
+Aggregates for the date range, answered from the rollups when they are up to date,
+otherwise computed from the raw rows
+'''
+
+
+def get_aggregates(start_date, end_date):
+    db = storage.connect_reader()
+    try:
+        if storage.rollups_ready(db):
+            return load_aggregates(db, start_date, end_date)
+    finally:
+        db.close()
+    if len(shard_ranges(start_date, end_date, PARTITION_DAYS)) >= PARTITION_MIN_SHARDS:
+        return partitioned_aggregates(start_date, end_date)
+    return aggregate(prepare_data(start_date, end_date))
+
 
 '''
+Partitioned execution for long ranges without rollups: the range is split into shards of PARTITION_DAYS days,
+a process pool reads, cleans and aggregates every shard on its own (peak memory of one shard per worker),
+and the partial aggregates are merged. The aggregates merge exactly: shards never share a timestamp, so the
+lot stats and per-timestamp rankings of the shards are disjoint, the car park sums and counts add up.
+'''
+
+PARTITION_WORKERS = int(os.environ.get('CARPARK_WORKERS', os.cpu_count() or 1))
+PARTITION_DAYS = int(os.environ.get('CARPARK_PARTITION_DAYS', 1))
+# Ranges shorter than this many shards are aggregated in the calling thread
+PARTITION_MIN_SHARDS = 4
+
 
+def shard_ranges(start_date, end_date, shard_days=PARTITION_DAYS):
+    start, end = (date.fromisoformat(str(value)[:10]) for value in (start_date, end_date))
+    shards = []
+    while start < end:
+        shard_end = min(start + timedelta(days=shard_days), end)
+        shards.append((start.isoformat(), shard_end.isoformat()))
+        start = shard_end
+    return shards
 
-def prepare_data(start_date, end_date):
-    carpark_availability_data, carpark_ref_data = get_data(start_date, end_date)
-    carpark_availability_data['total_lots'] = carpark_availability_data['total_lots'].astype(int)
-    carpark_availability_data['lots_available'] = carpark_availability_data['lots_available'].astype(int)
 
-    # eliminate the records with total lots 0, as it is not meaningful to have total lots value 0
-    carpark_availability_data = carpark_availability_data[carpark_availability_data['total_lots'] > 0]
+def shard_aggregates(start_date, end_date, db_path=storage.DB_PATH, column_store=True):
+    return aggregate(prepare_data(start_date, end_date, db_path, column_store))
 
-    # Available lots cannot be greater than total lots, hence remove those records
-    carpark_availability_data = carpark_availability_data[
-        carpark_availability_data['lots_available'] < carpark_availability_data['total_lots']]
-    carpark_availability_data['carpark_number'] = carpark_availability_data['carpark_number'].str.strip()
-    carpark_ref_data['car_park_no'] = carpark_ref_data['car_park_no'].str.strip()
 
-    # Data filtered based on business model
-    carpark_ref_data = carpark_ref_data[(carpark_ref_data['short_term_parking'] == 'WHOLE DAY') & (
-                carpark_ref_data['type_of_parking_system'] == 'ELECTRONIC PARKING')]
+def merge_aggregates(partials):
+    merged = {name: pd.concat([partial[name] for partial in partials], ignore_index=True)
+              for name in ['lot_stats', 'largest', 'underutilized']}
+    carpark_stats = pd.concat([partial['carpark_stats'] for partial in partials], ignore_index=True)
+    merged['carpark_stats'] = carpark_stats.groupby('car_park_no', as_index=False)[['occupied_sum', 'row_count']].sum()
+    return merged
 
-    # join two tables based on car park number column
-    merged_data = pd.merge(left=carpark_ref_data, right=carpark_availability_data, how='left', left_on='car_park_no',
-                           right_on='carpark_number')
 
-    # Total lots cannot be null for a carpark, remove null values
-    merged_data = merged_data[merged_data['total_lots'].notnull()]
-    merged_data['total_lots'] = merged_data['total_lots'].astype('int')
-    merged_data['%occupied'] = 1 - (merged_data['lots_available'] / merged_data['total_lots'])
-    merged_data.car_park_decks = merged_data.car_park_decks.apply(str)
-    return merged_data
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers=PARTITION_WORKERS):
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawned workers, forking the threaded dashboard server could copy locks held by other threads
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+def partitioned_aggregates(start_date, end_date, db_path=storage.DB_PATH, shard_days=PARTITION_DAYS,
+                           column_store=True, pool=None):
+    shards = shard_ranges(start_date, end_date, shard_days)
+    if not shards:
+        return aggregate(prepare_data(start_date, end_date, db_path, column_store))
+    pool = pool if pool is not None else get_process_pool()
+    with instrumentation.span('partitioned_aggregates') as span:
+        partials = list(pool.map(shard_aggregates, [shard[0] for shard in shards], [shard[1] for shard in shards],
+                                 [db_path] * len(shards), [column_store] * len(shards)))
+        aggregates = merge_aggregates(partials)
+        span.set(rows_in=len(shards), rows_out=sum(len(value) for value in aggregates.values()))
+    return aggregates
 
 
 '''
@@ -94,12 +480,10 @@ Plot in bar graph
 '''
 
 
-def largest_carpark(merged_data):
+def largest_carpark(aggregates):
     # Largest carpark data
-    largest_cp_data = merged_data.groupby(['timestamp']).apply(lambda x: x.nlargest(5, 'total_lots')).reset_index(
-        drop=True)
-    total_lot_data = largest_cp_data.groupby('car_park_no').mean()
-    total_lot_data = total_lot_data.reset_index()
+    largest_cp_data = aggregates['largest']
+    total_lot_data = largest_cp_data.groupby('car_park_no', as_index=False)['total_lots'].mean()
     total_lot_data = total_lot_data.sort_values('total_lots', ascending=False)
     fig = px.bar(total_lot_data, x="car_park_no", y="total_lots", color="total_lots", color_continuous_scale='Blues')
     fig.update_layout(plot_bgcolor="#FFFFFF", xaxis_title="Car Park Number", yaxis_title="Total Lots")
@@ -113,8 +497,8 @@ Plot in bar graph
 '''
 
 
-def most_underutilized_car_park(merged_data):
-    occ_data = merged_data.groupby(['timestamp']).apply(lambda x: x.nsmallest(5, '%occupied')).reset_index(drop=True)
+def most_underutilized_car_park(aggregates):
+    occ_data = aggregates['underutilized']
     cp_count = occ_data['car_park_no'].value_counts()
     cp_count = cp_count[:10, ]
     fig_1 = px.bar(cp_count, x=cp_count.index, y=cp_count.values,color_discrete_sequence=px.colors.qualitative.Dark24)
@@ -129,12 +513,12 @@ Plot in bar graph
 '''
 
 
-def most_underutilized_car_park_occupancy(merged_data):
-    occ_data = merged_data.groupby(['timestamp']).apply(lambda x: x.nsmallest(5, '%occupied')).reset_index(drop=True)
+def most_underutilized_car_park_occupancy(aggregates):
+    occ_data = aggregates['underutilized']
     filter_v = dict(occ_data['car_park_no'].value_counts().nlargest(10))
     under_ut_data = occ_data[occ_data['car_park_no'].isin(list(filter_v.keys()))]
-    under_ut_data['counts'] = under_ut_data['car_park_no'].map(under_ut_data['car_park_no'].value_counts())
-    under_ut_data = under_ut_data.groupby(['car_park_no']).mean()
+    grouped = under_ut_data.groupby('car_park_no')
+    under_ut_data = pd.DataFrame({'%occupied': grouped['%occupied'].mean(), 'counts': grouped.size()})
     under_ut_data = under_ut_data.sort_values('%occupied', ascending=False)
 
     fig_2 = px.bar(under_ut_data, x=under_ut_data.index, y=under_ut_data['%occupied'], color="counts",
@@ -144,16 +528,25 @@ def most_underutilized_car_park_occupancy(merged_data):
     return fig_2
 
 
+'''
+Mean %occupied and number of rows per group, from the summed lot stats
+'''
+
+
+def occupancy_by(lot_stats, columns):
+    totals = lot_stats.groupby(columns)[['occupied_sum', 'row_count']].sum()
+    return pd.DataFrame({'%occupied': totals['occupied_sum'] / totals['row_count'], 'counts': totals['row_count']})
+
+
 '''
 Find the most frequently used car park Lot Type  by Occupancy
 Plot in bar graph
 '''
 
 
-def most_utilized_lt(merged_data):
+def most_utilized_lt(aggregates):
     # Most utilized lot type and car park type
-    merged_data['counts'] = merged_data['lot_type'].map(merged_data['lot_type'].value_counts())
-    ut_data = merged_data.groupby('lot_type').mean()
+    ut_data = occupancy_by(aggregates['lot_stats'], 'lot_type')
     ut_data = ut_data.sort_values('%occupied', ascending=False)
     fig_3 = px.bar(ut_data, x=ut_data.index, y='%occupied', color="counts", color_continuous_scale='Blues')
     fig_3.update_layout(plot_bgcolor="#FFFFFF", xaxis_title="Lot Type")
@@ -167,10 +560,9 @@ Plot in grouped bar graph
 '''
 
 
-def most_utilized_cp_lt(merged_data):
+def most_utilized_cp_lt(aggregates):
     # Most utilized lot type and car park type
-    merged_data['counts'] = merged_data['lot_type'].map(merged_data['lot_type'].value_counts())
-    ut_cp_data = merged_data.groupby(['lot_type', 'car_park_type']).mean()
+    ut_cp_data = occupancy_by(aggregates['lot_stats'], ['lot_type', 'car_park_type'])
     ut_cp_data = ut_cp_data.reset_index()
     ut_cp_data = ut_cp_data.sort_values('%occupied', ascending=False)
     fig_4 = px.bar(ut_cp_data, x='car_park_type', y='%occupied', color='lot_type', barmode="group",
@@ -180,37 +572,348 @@ def most_utilized_cp_lt(merged_data):
     return fig_4
 
 
+# Bucket sizes of the trend, finest first, and the most points a trend figure carries
+TREND_BUCKETS = [('15T', '15 minute window'), ('30T', '30 minute window'), ('1H', 'hourly window'),
+                 ('1D', 'daily window')]
+TREND_POINT_BUDGET = int(os.environ.get('CARPARK_TREND_POINTS', 1000))
+# 'bucket': mean per adaptive bucket, 'lttb': the 15 minute series thinned by largest-triangle-three-buckets
+TREND_DOWNSAMPLE = os.environ.get('CARPARK_TREND_DOWNSAMPLE', 'bucket')
+
+'''
+Finest bucket keeping the span of the index within the point budget
+'''
+
+
+def trend_bucket(index, budget=TREND_POINT_BUDGET):
+    if len(index) == 0:
+        return TREND_BUCKETS[0]
+    span = index.max() - index.min()
+    for rule, label in TREND_BUCKETS:
+        if span / pd.Timedelta(rule) < budget:
+            return rule, label
+    return TREND_BUCKETS[-1]
+
+
+'''
+Largest-triangle-three-buckets: keeps threshold points of the series (first and last included), picking in every
+bucket the point forming the largest triangle with the point kept before it and the mean of the next bucket,
+so peaks and troughs survive the thinning
+'''
+
+
+def lttb(series, threshold):
+    if threshold >= len(series) or threshold < 3:
+        return series
+    x = series.index.asi8.astype('float64')
+    y = series.to_numpy(dtype='float64')
+    edges = np.linspace(1, len(series) - 1, threshold - 1).astype('int64')
+    keep = np.zeros(threshold, dtype='int64')
+    keep[-1] = len(series) - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else len(series)
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        keep[i + 1] = previous
+    return series.iloc[keep]
+
+
 '''
-To explore the utilization trend of the car park availability data with 30 minute window
+Mean %occupied over time for the trend figure, at most TREND_POINT_BUDGET points whatever the range:
+optionally limited to a zoom window (start, end), then bucketed (bucket size from the span, TREND_BUCKETS)
+or thinned by LTTB. Returns the series and a label of its resolution.
+'''
+
+
+def trend_series(lot_stats, window=None, method=TREND_DOWNSAMPLE):
+    t_data = lot_stats.groupby('timestamp')[['occupied_sum', 'row_count']].sum()
+    if window is not None:
+        t_data = t_data.loc[window[0]:window[1]]
+    if method == 'lttb':
+        mean = (t_data['occupied_sum'] / t_data['row_count'].replace(0, np.nan)).dropna()
+        return lttb(mean, TREND_POINT_BUDGET), 'LTTB, at most {} points'.format(TREND_POINT_BUDGET)
+    rule, label = trend_bucket(t_data.index)
+    t_data = t_data.resample(rule).sum()
+    mean = t_data['occupied_sum'] / t_data['row_count'].replace(0, np.nan)
+    if len(mean) > TREND_POINT_BUDGET:
+        # longer than TREND_POINT_BUDGET days
+        mean = lttb(mean.dropna(), TREND_POINT_BUDGET)
+        label += ', LTTB'
+    return mean, label
+
+
+'''
+To explore the utilization trend of the car park availability data, bucket size adapted to the range
+(or the zoom window) so the figure stays within the point budget
 Plot in line graph
 '''
 
 
-def utilization_trend(merged_data):
-    # Utilization trend 30 minute window
-    t_data = merged_data.copy()
-    t_data.index = pd.to_datetime(t_data.timestamp)
-    t_data = t_data["%occupied"].resample("30T").apply([np.mean])
-    fig_5 = px.line(t_data, x=t_data.index, y="mean", title="Utilization Trend - 30 minute window",color_discrete_sequence=px.colors.qualitative.Dark24)
+def utilization_trend(aggregates, window=None):
+    mean, label = trend_series(aggregates['lot_stats'], window)
+    t_data = pd.DataFrame({'mean': mean})
+    fig_5 = px.line(t_data, x=t_data.index, y="mean", title="Utilization Trend - {}".format(label),color_discrete_sequence=px.colors.qualitative.Dark24)
     fig_5.update_layout(plot_bgcolor="#FFFFFF", xaxis_title="Date", yaxis_title="Mean Occupancy")
     return fig_5
 
 
+'''
+Car Park Utilization by Area
+Mean %occupied per grid cell for the selected range, plotted as a choropleth map
+'''
+
+
+def area_utilization(aggregates):
+    cell_of, grid = geo.get_grid()
+    cell_data = geo.occupancy_by_cell(aggregates['carpark_stats'], cell_of)
+    cells = set(cell_data['cell'])
+    grid = {'type': 'FeatureCollection', 'features': [feature for feature in grid['features'] if feature['id'] in cells]}
+    fig_6 = px.choropleth_mapbox(cell_data, geojson=grid, locations='cell', color='%occupied',
+                                 hover_data=['car_parks'], color_continuous_scale='Blues', range_color=(0, 1),
+                                 mapbox_style='carto-positron', center={'lat': 1.35, 'lon': 103.82}, zoom=10.3,
+                                 opacity=0.7)
+    fig_6.update_layout(margin={'r': 0, 't': 0, 'l': 0, 'b': 0}, height=600)
+    fig_6.update_traces(marker_line_width=0)
+    return fig_6
+
+
+'''
+Live view: mean %occupied per lot type for every snapshot in the live ring buffer
+'''
+
+
+def live_trend(buffer):
+    t_data = buffer.trend()
+    fig_7 = px.line(t_data, x='timestamp', y='%occupied', color='lot_type',
+                    color_discrete_sequence=px.colors.qualitative.Dark24)
+    fig_7.update_layout(plot_bgcolor="#FFFFFF", xaxis_title="Time", yaxis_title="Mean Occupancy")
+    return fig_7
+
+
+'''
+Live view: least occupied car parks (car lots) over the live window
+'''
+
+
+def live_underutilized(buffer):
+    cp_data = buffer.carpark_stats()
+    cp_data = cp_data[cp_data['lot_type'] == 'C'].nsmallest(10, '%occupied')
+    fig_8 = px.bar(cp_data, x='car_park_no', y='%occupied', color='%occupied', color_continuous_scale='Blues')
+    fig_8.update_layout(plot_bgcolor="#FFFFFF", xaxis_title="Car Park Number", yaxis_title="%occupied")
+    fig_8.update_traces(marker_line_width=0)
+    return fig_8
+
+
+'''
+Occupancy profile of one car park and lot type: mean %occupied by day of week and hour of day,
+the hover shows the percentiles and the number of rows behind each cell
+'''
+
+
+def profile_heatmap(summary, car_park_no, lot_type):
+    columns = ['p{}'.format(int(q * 100)) for q in profiles.PERCENTILES] + ['row_count']
+    customdata = np.dstack([profiles.profile_matrix(summary, column).to_numpy() for column in columns])
+    hover = '%{y} %{x}:00<br>mean %{z:.2f}<br>' + '<br>'.join(
+        '{} %{{customdata[{}]:.2f}}'.format(column, i) for i, column in enumerate(columns[:-1])) + \
+        '<br>rows %{{customdata[{}]}}<extra></extra>'.format(len(columns) - 1)
+    fig_9 = go.Figure(go.Heatmap(z=profiles.profile_matrix(summary).to_numpy(), x=list(range(24)), y=profiles.DAYS,
+                                 customdata=customdata, hovertemplate=hover, colorscale='Blues', zmin=0, zmax=1))
+    fig_9.update_layout(plot_bgcolor="#FFFFFF", title="{} {} lots".format(car_park_no, lot_type),
+                        xaxis_title="Hour of Day", yaxis_title="Day of Week", yaxis_autorange='reversed')
+    return fig_9
+
+
+# Figure builders by the id of the graph they fill in the dashboard
+FIGURES = {
+    'largest_car_park': largest_carpark,
+    'Most_Underutilized_Car_Park': most_underutilized_car_park,
+    'Most_Underutilized_Car_Park_2': most_underutilized_car_park_occupancy,
+    'Utilization_Trend': utilization_trend,
+    'Utilization_by_Lot_Type': most_utilized_lt,
+    'Utilization_by_lt_cp': most_utilized_cp_lt,
+    'Utilization_by_Area': area_utilization,
+}
+
+result_cache = cache.ResultCache()
+
+'''
+Cached entry points used by the dashboard, keyed on the normalized date range and the data version
+'''
+
+
+def cached_aggregates(start_date, end_date):
+    start_date, end_date = cache.normalize_range(start_date, end_date)
+    return result_cache.get_or_compute(('aggregates', start_date, end_date), storage.get_data_version(),
+                                       lambda: get_aggregates(start_date, end_date))
+
+
+'''
+Background jobs: the aggregates of a range are computed in warm_pool threads, never in the HTTP request,
+one job per range and data version in this process (the cache's file lock coalesces the jobs of other workers).
+The dashboard polls aggregates_ready() until they are cached. A failed job is kept, and its error returned to the
+pollers, until the data version changes; a finished job is only resubmitted when its result was evicted.
+'''
+
+warm_pool = ThreadPoolExecutor(max_workers=2)
+warm_jobs = {}
+warm_jobs_lock = threading.Lock()
+
+
+def warm_aggregates(start_date, end_date):
+    start_date, end_date = cache.normalize_range(start_date, end_date)
+    key = (start_date, end_date, storage.get_data_version())
+    with warm_jobs_lock:
+        job = warm_jobs.get(key)
+        if job is not None and job.done() and job.exception() is not None:
+            return job
+        if job is None or (job.done() and not aggregates_ready(start_date, end_date)):
+            # finished jobs are dropped, failed ones once their data version is outdated
+            for done in [k for k, v in warm_jobs.items()
+                         if v.done() and (v.exception() is None or k[2] != key[2])]:
+                del warm_jobs[done]
+            job = warm_jobs[key] = warm_pool.submit(cached_aggregates, start_date, end_date)
+        return job
+
+
+def aggregates_ready(start_date, end_date):
+    start_date, end_date = cache.normalize_range(start_date, end_date)
+    return result_cache.contains(('aggregates', start_date, end_date), storage.get_data_version())
+
+
+'''
+Figure for the date range, figures in ZOOM_FIGURES also take a zoom window (start, end) and are redrawn
+from the cached aggregates of the range for just that window
+'''
+
+ZOOM_FIGURES = {'Utilization_Trend'}
+
+
+def figure(name, start_date, end_date, window=None):
+    start_date, end_date = cache.normalize_range(start_date, end_date)
+    window = normalize_window(window)
+    return result_cache.get_or_compute(('figure', name, start_date, end_date, window), storage.get_data_version(),
+                                       lambda: build_figure(name, cached_aggregates(start_date, end_date), window))
+
+
+'''
+Zoom window to whole 15 minute slots ('YYYY-MM-DD HH:MM:SS' strings), so nearby zooms share a cache entry
+'''
+
+
+def normalize_window(window):
+    if window is None:
+        return None
+    start, end = sorted(pd.Timestamp(value) for value in window)
+    return str(start.floor('15T')), str(end.ceil('15T'))
+
+
+def build_figure(name, aggregates, window=None):
+    with instrumentation.span('figure', figure=name) as span:
+        fig = FIGURES[name](aggregates, window) if window is not None else FIGURES[name](aggregates)
+        span.set(rows_in=sum(len(value) for value in aggregates.values()), rows_out=figure_points(fig))
+    return fig
+
+
+'''
+Number of points drawn by a figure (x values, or locations of map traces)
+'''
+
+
+def figure_points(fig):
+    points = 0
+    for trace in fig.data:
+        values = getattr(trace, 'x', None)
+        if values is None:
+            values = getattr(trace, 'locations', None)
+        points += len(values) if values is not None else 0
+    return points
+
+
+instrumentation.metrics.add_gauge('carpark_cache_entries', 'Entries in the in-memory result cache',
+                                  lambda: len(result_cache.entries))
+instrumentation.metrics.add_gauge('carpark_cache_hits', 'Result cache hits since start', lambda: result_cache.hits)
+instrumentation.metrics.add_gauge('carpark_cache_misses', 'Result cache misses since start',
+                                  lambda: result_cache.misses)
+
+
+'''
+First and last day with data, as dates for the date picker (the sample dates when the database is empty)
+'''
+
+
+def get_date_bounds():
+    db = storage.connect_reader()
+    try:
+        first, last = db.execute('select min(timestamp), max(timestamp) from carpark_availability_15min').fetchone()
+    finally:
+        db.close()
+    if first is None:
+        return date.fromisoformat(DATA_GEN_START_DATE), date.fromisoformat(DATA_GEN_END_DATE)
+    return date.fromisoformat(storage.from_epoch(first)[:10]), date.fromisoformat(storage.from_epoch(last)[:10])
+
+
+'''
+Profile queries for the dashboard (profiles.py), answered from the rollups. None while the rollups are not
+up to date (python storage.py rebuild-rollups).
+'''
+
+
+def profile_query(key, query):
+    def run():
+        db = storage.connect_reader()
+        try:
+            if not storage.rollups_ready(db):
+                return None
+            with instrumentation.span('profile_query', query=key[0]) as span:
+                result = query(db)
+                span.set(rows_out=len(result))
+                return result
+        finally:
+            db.close()
+    return result_cache.get_or_compute(key, storage.get_data_version(), run)
+
+
+def get_top_carparks(start_date, end_date, least=True, n=profiles.TOP_N):
+    start_date, end_date = cache.normalize_range(start_date, end_date)
+    return profile_query(('top_carparks', start_date, end_date, least, n),
+                         lambda db: profiles.top_carparks(db, start_date, end_date, n, least))
+
+
+def get_anomalies(start_date, end_date):
+    start_date, end_date = cache.normalize_range(start_date, end_date)
+    return profile_query(('anomalies', start_date, end_date), lambda db: profiles.anomalies(db, start_date, end_date))
+
+
+def get_profile_figure(car_park_no, lot_type):
+    summary = profile_query(('profile', car_park_no, lot_type), lambda db: profiles.profile(db, car_park_no, lot_type))
+    return None if summary is None else profile_heatmap(summary, car_park_no, lot_type)
+
+
 '''
 Fetch the data for overview
-Plot in a Table
-'''
-
-
-def generate_table(max_rows=100):
-    dataframe = prepare_data(DATA_GEN_START_DATE, DATA_GEN_END_DATE)
-    return html.Table([
-        html.Thead(
-            html.Tr([html.Th(col) for col in dataframe.columns])
-        ),
-        html.Tbody([
-            html.Tr([
-                html.Td(dataframe.iloc[i][col]) for col in dataframe.columns
-            ]) for i in range(min(len(dataframe), max_rows))
-        ])
-    ], style={'border': '1px', "width": "100%", "overflow": "scroll"})
\ No newline at end of file
+One page of the merged data set for the sample table, read with LIMIT/OFFSET in clustered key order,
+returns the page as records and the total number of rows in the range
+'''
+
+SAMPLE_PAGE_SIZE = 25
+
+
+def get_sample_page(page_current, page_size=SAMPLE_PAGE_SIZE, start_date=DATA_GEN_START_DATE,
+                    end_date=DATA_GEN_END_DATE):
+    params = (storage.to_epoch(start_date), storage.to_epoch(end_date))
+    db = storage.connect_reader()
+    try:
+        total = result_cache.get_or_compute(
+            ('sample_rows', start_date, end_date), storage.get_data_version(),
+            lambda: db.execute('select count(*) from ({})'.format(build_query(['timestamp'])), params).fetchone()[0])
+        page = pd.read_sql_query(
+            build_query(ALL_COLUMNS) + ' order by a.timestamp, a.carpark_id, a.lot_type limit ? offset ?', db,
+            params=params + (page_size, page_current * page_size))
+    finally:
+        db.close()
+    for column in ['timestamp', 'update_datetime']:
+        page[column] = pd.to_datetime(page[column], unit='s').dt.strftime('%Y-%m-%d %H:%M:%S')
+    return page.to_dict('records'), total
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+import pandas as pd
+
+import storage
+
+'''
+Occupancy profiles of every (car park, lot type): %occupied by day of week and hour of day, from the
+rollup_profiles rollup the importer maintains (count, sum, sum of squares and a histogram per cell).
+Means, standard deviations and percentiles (interpolated within the histogram bins) come from the rollup alone:
+  profile(): one car park's 7 x 24 profile, a primary key prefix lookup
+  top_carparks(): most / least utilized car parks over a date range, from rollup_carpark_day
+  anomalies(): rows of a date range whose %occupied is more than ANOMALY_Z standard deviations
+               from the profile of their car park, lot type, day and hour, flagged by the importer in rollup_anomalies
+'''
+
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+PERCENTILES = [0.1, 0.5, 0.9]
+TOP_N = 10
+ANOMALY_LIMIT = 100
+
+'''
+Percentiles q (0-1) of each row of a (rows, bins) histogram over [0, 1], linear within the bin holding them
+'''
+
+
+def histogram_percentiles(histogram, percentiles=PERCENTILES):
+    histogram = np.asarray(histogram, dtype='float64')
+    rows, bins = histogram.shape
+    cumulative = np.cumsum(histogram, axis=1)
+    total = cumulative[:, -1]
+    result = np.full((rows, len(percentiles)), np.nan)
+    index = np.arange(rows)
+    for j, q in enumerate(percentiles):
+        target = q * total
+        position = np.minimum((cumulative < target[:, None]).sum(axis=1), bins - 1)
+        before = np.where(position > 0, cumulative[index, np.maximum(position - 1, 0)], 0)
+        in_bin = histogram[index, position]
+        fraction = np.divide(target - before, in_bin, out=np.zeros(rows), where=in_bin > 0)
+        result[:, j] = (position + fraction) / bins
+    result[total == 0] = np.nan
+    return result
+
+
+def summarize(cells):
+    count = cells['row_count'].to_numpy(dtype='float64')
+    mean = cells['occupied_sum'].to_numpy() / count
+    summary = pd.DataFrame({
+        'dow': cells['dow'].to_numpy(),
+        'hour': cells['hour'].to_numpy(),
+        'mean': mean,
+        'std': np.sqrt(np.maximum(cells['occupied_sq_sum'].to_numpy() / count - mean ** 2, 0)),
+        'row_count': cells['row_count'].to_numpy(),
+    })
+    values = histogram_percentiles(cells[storage.PROFILE_BIN_COLUMNS].to_numpy())
+    for j, q in enumerate(PERCENTILES):
+        summary['p{}'.format(int(q * 100))] = values[:, j]
+    return summary
+
+
+def profile(db, car_park_no, lot_type='C'):
+    cells = pd.read_sql_query(
+        'select p.* from rollup_profiles p join carpark c on c.carpark_id = p.carpark_id '
+        'where c.carpark_number = ? and p.lot_type = ? order by p.dow, p.hour', db, params=(car_park_no, lot_type))
+    return summarize(cells)
+
+
+'''
+A profile column as a 7 x 24 matrix, days of week by hour of day
+'''
+
+
+def profile_matrix(summary, value='mean'):
+    return summary.pivot(index='dow', columns='hour', values=value).reindex(index=range(7), columns=range(24))
+
+
+def top_carparks(db, start_date, end_date, n=TOP_N, least=True):
+    return pd.read_sql_query(
+        'select c.carpark_number as car_park_no, sum(d.occupied_sum) / sum(d.row_count) as "%occupied", '
+        'sum(d.row_count) as row_count from rollup_carpark_day d join carpark c on c.carpark_id = d.carpark_id '
+        'where d.day >= ? and d.day < ? group by d.carpark_id order by 2 {}, 1 limit ?'.format(
+            'asc' if least else 'desc'), db,
+        params=(storage.to_epoch(start_date), storage.to_epoch(end_date), n))
+
+
+ANOMALIES_SQL = '''select a.timestamp, c.carpark_number as car_park_no, a.lot_type, a.occupied, a.mean, a.variance
+        from rollup_anomalies a join carpark c on c.carpark_id = a.carpark_id
+        where a.timestamp >= ? and a.timestamp < ? and (a.occupied - a.mean) * (a.occupied - a.mean) > ? * a.variance
+        order by (a.occupied - a.mean) * (a.occupied - a.mean) / a.variance desc, a.timestamp, a.carpark_id, a.lot_type
+        limit ?'''
+
+
+'''
+Only rows flagged at ingest are found, a threshold below storage.ANOMALY_Z returns the same rows as ANOMALY_Z
+'''
+
+
+def anomalies(db, start_date, end_date, threshold=storage.ANOMALY_Z, limit=ANOMALY_LIMIT):
+    rows = pd.read_sql_query(ANOMALIES_SQL, db,
+                             params=(storage.to_epoch(start_date), storage.to_epoch(end_date), threshold ** 2, limit))
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(rows['timestamp'], unit='s'),
+        'car_park_no': rows['car_park_no'],
+        'lot_type': rows['lot_type'],
+        '%occupied': rows['occupied'],
+        'profile_mean': rows['mean'],
+        'z': (rows['occupied'] - rows['mean']) / np.sqrt(rows['variance']),
+    })
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+import hashlib
+import os
+import threading
+
+import pandas as pd
+
+'''
+In-memory copy of the hdb-carpark-information.csv reference data, parsed and normalized once per file content.
+The file is stat'ed on every access and only re-hashed when its mtime or size changed, a touched file
+with the same content keeps the parsed data. Filtered views and values derived from the data (the area grid)
+are cached until the content changes.
+'''
+
+REFERENCE_CSV = './data/hdb-carpark-information/hdb-carpark-information.csv'
+
+COLUMNS = ['car_park_no', 'address', 'x_coord', 'y_coord', 'car_park_type', 'type_of_parking_system',
+           'short_term_parking', 'free_parking', 'night_parking', 'car_park_decks', 'gantry_height',
+           'car_park_basement']
+
+# Attributes repeated by many car parks, kept as categoricals
+CATEGORY_COLUMNS = ['car_park_type', 'type_of_parking_system', 'short_term_parking', 'free_parking', 'night_parking',
+                    'car_park_basement']
+
+# Business filter of the dashboard
+SHORT_TERM_PARKING = 'WHOLE DAY'
+TYPE_OF_PARKING_SYSTEM = 'ELECTRONIC PARKING'
+BUSINESS_FILTER = {'short_term_parking': SHORT_TERM_PARKING, 'type_of_parking_system': TYPE_OF_PARKING_SYSTEM}
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+'''
+Reads the csv: car_park_no stripped and used as the index, car_park_decks kept as text,
+repeated attributes as categoricals
+'''
+
+
+def parse(csv_path):
+    reference = pd.read_csv(csv_path, dtype={'car_park_decks': str})
+    reference['car_park_no'] = reference['car_park_no'].str.strip()
+    reference = reference[COLUMNS].drop_duplicates('car_park_no', keep='last').set_index('car_park_no')
+    for column in CATEGORY_COLUMNS:
+        reference[column] = reference[column].astype('category')
+    return reference
+
+
+class ReferenceData:
+
+    def __init__(self, csv_path=REFERENCE_CSV):
+        self.csv_path = csv_path
+        self.lock = threading.Lock()
+        self.stat = None
+        self.digest = None
+        self.frame = None
+        self.views = {}
+        self.derived_values = {}
+
+    '''
+    Reloads the data when the file content changed, returns True if it did
+    '''
+
+    def refresh(self):
+        stat = os.stat(self.csv_path)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if stat == self.stat:
+            return False
+        with self.lock:
+            if stat == self.stat:
+                return False
+            digest = file_hash(self.csv_path)
+            changed = digest != self.digest
+            if changed:
+                self.frame = parse(self.csv_path)
+                self.digest = digest
+                self.views = {}
+                self.derived_values = {}
+            self.stat = stat
+            return changed
+
+    @property
+    def version(self):
+        self.refresh()
+        return self.digest
+
+    def get(self):
+        self.refresh()
+        return self.frame
+
+    '''
+    Car parks matching every filter, column=value or column=[values], e.g.
+    view(type_of_parking_system='COUPON PARKING') or view(night_parking='YES', **BUSINESS_FILTER)
+    '''
+
+    def view(self, **filters):
+        frame = self.get()
+        key = (self.digest, tuple(sorted((column, value if isinstance(value, str) else tuple(value))
+                                         for column, value in filters.items())))
+        if key not in self.views:
+            mask = pd.Series(True, index=frame.index)
+            for column, value in filters.items():
+                mask &= frame[column].isin([value] if isinstance(value, str) else value)
+            self.views[key] = frame[mask.values]
+        return self.views[key]
+
+    def business_view(self):
+        return self.view(**BUSINESS_FILTER)
+
+    '''
+    Value computed by build(frame) once per file content
+    '''
+
+    def derived(self, name, build):
+        frame = self.get()
+        key = (self.digest, name)
+        if key not in self.derived_values:
+            self.derived_values[key] = build(frame)
+        return self.derived_values[key]
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_reference(csv_path=REFERENCE_CSV):
+    with _managers_lock:
+        if csv_path not in _managers:
+            _managers[csv_path] = ReferenceData(csv_path)
+        return _managers[csv_path]
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# coding: utf-8
+import calendar
+from datetime import datetime
+
+import numpy as np
+
+'''
+Parser for carpark-availability API responses. Walks every item of the decoded json straight into preallocated
+typed columns, without the intermediate DataFrames of pd.json_normalize, and hands them to SnapshotWriter.
+Rows with missing or non-numeric lot counts are dropped and counted in Snapshot.skipped.
+'''
+
+# update_datetime of a car park that did not report one
+MISSING_EPOCH = -1
+
+
+class Snapshot:
+
+    def __init__(self, carpark_number, lot_type, total_lots, lots_available, update_datetime, items=1, skipped=0):
+        self.carpark_number = carpark_number
+        self.lot_type = lot_type
+        self.total_lots = total_lots
+        self.lots_available = lots_available
+        self.update_datetime = update_datetime
+        self.items = items
+        self.skipped = skipped
+
+    def __len__(self):
+        return len(self.carpark_number)
+
+
+'''
+ISO date time (the API sends +08:00 offsets) to epoch seconds of its Singapore wall-clock time, like storage.to_epoch
+'''
+
+
+def to_epoch(value):
+    try:
+        return calendar.timegm(datetime.fromisoformat(value[:19]).timetuple())
+    except (TypeError, ValueError):
+        return MISSING_EPOCH
+
+
+def parse_snapshot(response):
+    items = response.get('items') or []
+    carparks = [carpark for item in items for carpark in item.get('carpark_data') or []]
+    rows = sum(len(carpark.get('carpark_info') or []) for carpark in carparks)
+    carpark_number = [None] * rows
+    lot_type = [None] * rows
+    total_lots = np.empty(rows, dtype='int32')
+    lots_available = np.empty(rows, dtype='int32')
+    update_datetime = np.empty(rows, dtype='int64')
+    valid = np.ones(rows, dtype=bool)
+    # car parks refreshed together share their update_datetime, each distinct value is parsed once
+    epochs = {}
+    row = 0
+    for carpark in carparks:
+        number = carpark['carpark_number'].strip()
+        stamp = carpark.get('update_datetime')
+        epoch = epochs.get(stamp)
+        if epoch is None:
+            epoch = epochs[stamp] = to_epoch(stamp)
+        for info in carpark.get('carpark_info') or []:
+            carpark_number[row] = number
+            lot_type[row] = (info.get('lot_type') or '').strip()
+            update_datetime[row] = epoch
+            try:
+                total_lots[row] = int(info['total_lots'])
+                lots_available[row] = int(info['lots_available'])
+            except (KeyError, TypeError, ValueError, OverflowError):
+                valid[row] = False
+            row += 1
+    skipped = rows - int(valid.sum())
+    if skipped:
+        keep = np.flatnonzero(valid)
+        carpark_number = [carpark_number[i] for i in keep]
+        lot_type = [lot_type[i] for i in keep]
+        total_lots, lots_available, update_datetime = total_lots[keep], lots_available[keep], update_datetime[keep]
+    return Snapshot(carpark_number, lot_type, total_lots, lots_available, update_datetime, len(items), skipped)
@@ -0,0 +1,644 @@
+#!/usr/bin/env python
+# coding: utf-8
+import argparse
+import calendar
+import os
+import sqlite3
+from datetime import datetime
+from itertools import repeat
+
+import columnar
+import reference
+
+'''
+SQLite access shared by the importer and the processor.
+The database is kept in WAL mode so the dashboard can keep reading while the importer writes.
+'''
+
+DB_PATH = './data/Carpark_15min'
+REFERENCE_CSV = reference.REFERENCE_CSV
+
+# Snapshots buffered by SnapshotWriter before they are committed in one transaction
+SNAPSHOTS_PER_TRANSACTION = 16
+
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA busy_timeout=10000',
+]
+
+'''
+Schema version 2 (PRAGMA user_version).
+Counts are INTEGER, timestamp and update_datetime are integer epoch seconds of the Singapore
+wall-clock time (no timezone shift, 2018-02-13T00:00:00 -> 1518480000) and carpark_number strings
+are replaced by a small integer key into the carpark lookup table.
+The availability table is clustered on (timestamp, carpark_id, lot_type) so date range scans read contiguous pages.
+Version 0 is the original varchar table written by earlier importers, see migrate().
+'''
+
+SCHEMA_VERSION = 2
+
+SCHEMA = [
+    '''create table if not exists carpark (carpark_id INTEGER PRIMARY KEY, carpark_number TEXT NOT NULL UNIQUE)''',
+    '''create table if not exists carpark_availability_15min (timestamp INTEGER NOT NULL,
+            carpark_id INTEGER NOT NULL, lot_type TEXT NOT NULL, total_lots INTEGER NOT NULL,
+            lots_available INTEGER NOT NULL, update_datetime INTEGER,
+            PRIMARY KEY (timestamp, carpark_id, lot_type)) WITHOUT ROWID''',
+    '''create index if not exists carpark_availability_carpark on carpark_availability_15min (carpark_id, timestamp)''',
+    '''create table if not exists meta (key TEXT PRIMARY KEY, value TEXT)''',
+    '''create table if not exists availability_days (day INTEGER PRIMARY KEY, row_count INTEGER NOT NULL)''',
+]
+
+'''
+availability_days holds the number of availability rows per day (epoch seconds of 00:00), added to in the
+transaction that inserts them. Column store partitions record the rows they were built from, a partition
+with another count is stale and its day is read from SQLite instead (processor.prepare_data).
+Databases written before the table existed get it filled by rebuild-rollups or compact.
+'''
+
+DAY_ROWS_SQL = '''insert into availability_days (day, row_count)
+        select timestamp - timestamp % 86400, count(*) from {source} where true group by 1
+        on conflict (day) do update set row_count = row_count + excluded.row_count'''
+
+
+def count_days(db):
+    db.execute('delete from availability_days')
+    db.execute(DAY_ROWS_SQL.format(source='carpark_availability_15min'))
+
+'''
+Copy of the hdb-carpark-information.csv reference data, so filters and joins run inside SQLite.
+car_park_no is stored stripped, car_park_decks as text.
+'''
+
+REFERENCE_COLUMNS = reference.COLUMNS
+
+REFERENCE_SCHEMA = '''create table if not exists carpark_reference (car_park_no TEXT PRIMARY KEY, address TEXT,
+            x_coord REAL, y_coord REAL, car_park_type TEXT, type_of_parking_system TEXT, short_term_parking TEXT,
+            free_parking TEXT, night_parking TEXT, car_park_decks TEXT, gantry_height REAL, car_park_basement TEXT)'''
+
+COLUMNS = ['timestamp', 'carpark_id', 'lot_type', 'total_lots', 'lots_available', 'update_datetime']
+
+# Batches are staged in a temp table first so only rows that are really new reach the rollups
+STAGING_SCHEMA = '''create temp table if not exists staging (timestamp INTEGER NOT NULL, carpark_id INTEGER NOT NULL,
+            lot_type TEXT NOT NULL, total_lots INTEGER NOT NULL, lots_available INTEGER NOT NULL,
+            update_datetime INTEGER, PRIMARY KEY (timestamp, carpark_id, lot_type)) WITHOUT ROWID'''
+
+INSERT_SQL = 'insert or ignore into staging ({}) values ({})'.format(','.join(COLUMNS), ','.join('?' * len(COLUMNS)))
+
+# Business filter applied to the reference data
+SHORT_TERM_PARKING = reference.SHORT_TERM_PARKING
+TYPE_OF_PARKING_SYSTEM = reference.TYPE_OF_PARKING_SYSTEM
+
+'''
+Rows the dashboard uses, shared by the processor query and the rollups: total lots 0, or available lots
+not below total lots, are not meaningful, and only car parks passing the business filter are kept.
+Expects the availability rows aliased as a, the carpark table as c and carpark_reference as r.
+'''
+
+ROW_FILTER_SQL = 'a.total_lots > 0 and a.lots_available < a.total_lots'
+REFERENCE_FILTER_SQL = "r.short_term_parking = '{}' and r.type_of_parking_system = '{}'".format(
+    SHORT_TERM_PARKING, TYPE_OF_PARKING_SYSTEM)
+FILTER_SQL = '{} and {}'.format(ROW_FILTER_SQL, REFERENCE_FILTER_SQL)
+
+OCCUPIED_SQL = '1.0 - cast(a.lots_available as real) / a.total_lots'
+
+# Number of car parks ranked per timestamp in rollup_rankings
+TOP_K = 5
+
+'''
+Rollups maintained by SnapshotWriter as snapshots land, so the dashboard can answer from them
+in time proportional to the number of timestamps instead of the number of rows.
+rollup_lot_stats holds %occupied sums and row counts per (timestamp, lot_type, car_park_type), the lot type,
+car park type and 30 minute trend figures are sums over it. rollup_rankings holds the per-timestamp top TOP_K
+largest and least occupied car parks. rollup_carpark_day holds %occupied sums and row counts per car park and day
+for the area map and the range rankings of profiles.py. rollup_profiles holds, per (car park, lot type, day of week,
+hour), the count, sum and sum of squares of %occupied and a PROFILE_BINS bin histogram of it (profiles.py).
+rollup_anomalies holds the rows more than ANOMALY_Z standard deviations from their profile cell, flagged as they
+land against the profile at that time (rebuild-rollups flags every row again against the final profiles).
+meta 'rollups' holds ROLLUPS_VERSION while they match the raw table, adding a rollup bumps it
+so databases built by an older importer fall back to the raw rows until they are rebuilt.
+'''
+
+ROLLUPS_VERSION = 4
+
+# Histogram bins of %occupied in rollup_profiles, h0 counts [0, 1/PROFILE_BINS) ... the last bin includes 1
+PROFILE_BINS = 20
+PROFILE_BIN_COLUMNS = ['h{}'.format(i) for i in range(PROFILE_BINS)]
+
+ANOMALY_Z = 3.0
+# Profile cells with fewer rows are not used to flag anomalies, a row of a cell of n rows
+# is at most (n - 1) / sqrt(n) standard deviations from its mean, so z > 3 needs 11 rows or more
+MIN_PROFILE_ROWS = 12
+# Floor of the standard deviation, nearly constant cells would flag every small change
+MIN_STD = 0.02
+
+ROLLUP_SCHEMA = [
+    '''create table if not exists rollup_lot_stats (timestamp INTEGER NOT NULL, lot_type TEXT NOT NULL,
+            car_park_type TEXT NOT NULL, occupied_sum REAL NOT NULL, row_count INTEGER NOT NULL,
+            PRIMARY KEY (timestamp, lot_type, car_park_type)) WITHOUT ROWID''',
+    '''create table if not exists rollup_rankings (timestamp INTEGER NOT NULL, ranking TEXT NOT NULL,
+            rank INTEGER NOT NULL, car_park_no TEXT NOT NULL, total_lots INTEGER NOT NULL, occupied REAL NOT NULL,
+            PRIMARY KEY (timestamp, ranking, rank)) WITHOUT ROWID''',
+    '''create table if not exists rollup_carpark_day (day INTEGER NOT NULL, carpark_id INTEGER NOT NULL,
+            occupied_sum REAL NOT NULL, row_count INTEGER NOT NULL, PRIMARY KEY (day, carpark_id)) WITHOUT ROWID''',
+    '''create table if not exists rollup_profiles (carpark_id INTEGER NOT NULL, lot_type TEXT NOT NULL,
+            dow INTEGER NOT NULL, hour INTEGER NOT NULL, row_count INTEGER NOT NULL, occupied_sum REAL NOT NULL,
+            occupied_sq_sum REAL NOT NULL, {},
+            PRIMARY KEY (carpark_id, lot_type, dow, hour)) WITHOUT ROWID'''.format(
+        ', '.join('{} INTEGER NOT NULL'.format(column) for column in PROFILE_BIN_COLUMNS)),
+    '''create table if not exists rollup_anomalies (timestamp INTEGER NOT NULL, carpark_id INTEGER NOT NULL,
+            lot_type TEXT NOT NULL, occupied REAL NOT NULL, mean REAL NOT NULL, variance REAL NOT NULL,
+            PRIMARY KEY (timestamp, carpark_id, lot_type)) WITHOUT ROWID''',
+]
+
+LOT_STATS_SQL = '''insert into rollup_lot_stats (timestamp, lot_type, car_park_type, occupied_sum, row_count)
+        select a.timestamp, a.lot_type, r.car_park_type, sum({occupied}), count(*)
+        from {source} a
+        join carpark c on c.carpark_id = a.carpark_id
+        join carpark_reference r on r.car_park_no = c.carpark_number
+        where {filter}
+        group by a.timestamp, a.lot_type, r.car_park_type
+        on conflict (timestamp, lot_type, car_park_type) do update
+        set occupied_sum = occupied_sum + excluded.occupied_sum, row_count = row_count + excluded.row_count'''
+
+CARPARK_DAY_SQL = '''insert into rollup_carpark_day (day, carpark_id, occupied_sum, row_count)
+        select a.timestamp - a.timestamp % 86400, a.carpark_id, sum({occupied}), count(*)
+        from {source} a
+        join carpark c on c.carpark_id = a.carpark_id
+        join carpark_reference r on r.car_park_no = c.carpark_number
+        where {filter}
+        group by a.timestamp - a.timestamp % 86400, a.carpark_id
+        on conflict (day, carpark_id) do update
+        set occupied_sum = occupied_sum + excluded.occupied_sum, row_count = row_count + excluded.row_count'''
+
+# dow 0 is Monday, epoch day 0 (1970-01-01) was a Thursday
+PROFILES_SQL = '''insert into rollup_profiles (carpark_id, lot_type, dow, hour, row_count, occupied_sum, occupied_sq_sum,
+            {columns})
+        select carpark_id, lot_type, dow, hour, count(*), sum(occupied), sum(occupied * occupied), {bins} from (
+            select a.carpark_id, a.lot_type, (a.timestamp / 86400 + 3) % 7 as dow, a.timestamp % 86400 / 3600 as hour,
+                   {{occupied}} as occupied, min(max(cast(({{occupied}}) * {count} as integer), 0), {last}) as bin
+            from {{source}} a
+            join carpark c on c.carpark_id = a.carpark_id
+            join carpark_reference r on r.car_park_no = c.carpark_number
+            where {{filter}})
+        group by carpark_id, lot_type, dow, hour
+        on conflict (carpark_id, lot_type, dow, hour) do update
+        set row_count = row_count + excluded.row_count, occupied_sum = occupied_sum + excluded.occupied_sum,
+            occupied_sq_sum = occupied_sq_sum + excluded.occupied_sq_sum, {updates}'''.format(
+    columns=', '.join(PROFILE_BIN_COLUMNS),
+    bins=', '.join('sum(bin = {})'.format(i) for i in range(PROFILE_BINS)),
+    count=PROFILE_BINS, last=PROFILE_BINS - 1,
+    updates=', '.join('{0} = {0} + excluded.{0}'.format(column) for column in PROFILE_BIN_COLUMNS))
+
+# Rollups that only ever add the sums and counts of new rows
+ADDITIVE_ROLLUPS = [LOT_STATS_SQL, CARPARK_DAY_SQL, PROFILES_SQL]
+
+# runs after PROFILES_SQL, the rows are compared with the profiles they were just added to
+ANOMALIES_SQL = '''insert or replace into rollup_anomalies (timestamp, carpark_id, lot_type, occupied, mean, variance)
+        select timestamp, carpark_id, lot_type, occupied, mean, variance from (
+            select a.timestamp, a.carpark_id, a.lot_type, {{occupied}} as occupied,
+                   p.occupied_sum / p.row_count as mean,
+                   max(p.occupied_sq_sum / p.row_count - (p.occupied_sum / p.row_count) * (p.occupied_sum / p.row_count),
+                       {min_variance}) as variance
+            from {{source}} a
+            join carpark c on c.carpark_id = a.carpark_id
+            join carpark_reference r on r.car_park_no = c.carpark_number
+            join rollup_profiles p on p.carpark_id = a.carpark_id and p.lot_type = a.lot_type
+                 and p.dow = (a.timestamp / 86400 + 3) % 7 and p.hour = a.timestamp % 86400 / 3600
+            where {{filter}} and p.row_count >= {min_rows})
+        where (occupied - mean) * (occupied - mean) > {z_squared} * variance'''.format(
+    min_variance=MIN_STD ** 2, min_rows=MIN_PROFILE_ROWS, z_squared=ANOMALY_Z ** 2)
+
+# ties are broken by (carpark_id, lot_type), the order rows are read from the clustered key
+RANKINGS_SQL = '''insert or replace into rollup_rankings (timestamp, ranking, rank, car_park_no, total_lots, occupied)
+        select timestamp, '{ranking}', rank, car_park_no, total_lots, occupied from (
+            select a.timestamp, r.car_park_no, a.total_lots, {occupied} as occupied,
+                   row_number() over (partition by a.timestamp order by {order}, a.carpark_id, a.lot_type) as rank
+            from carpark_availability_15min a
+            join carpark c on c.carpark_id = a.carpark_id
+            join carpark_reference r on r.car_park_no = c.carpark_number
+            where {filter} {timestamps})
+        where rank <= {k}'''
+
+RANKINGS = {'largest': 'a.total_lots desc', 'underutilized': OCCUPIED_SQL + ' asc'}
+
+
+'''
+ISO date or datetime string (as used by the API and get_date_range) to epoch seconds of the wall-clock time.
+Any UTC offset is dropped, the API reports Singapore time.
+'''
+
+
+def to_epoch(value):
+    moment = datetime.fromisoformat(str(value)[:19])
+    return calendar.timegm(moment.timetuple())
+
+
+def from_epoch(value):
+    return datetime.utcfromtimestamp(value).isoformat()
+
+
+'''
+Opens a connection with the tuned pragmas applied.
+Transactions are managed explicitly (isolation_level=None) so a batch is one BEGIN/COMMIT.
+'''
+
+
+def connect(db_path=DB_PATH):
+    db = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    return db
+
+
+def table_exists(db, name):
+    return db.execute("select 1 from sqlite_master where type='table' and name=?", (name,)).fetchone() is not None
+
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+'''
+Creates any missing tables and indexes, safe to call on every connection.
+Raises if the file still holds the legacy varchar table, which has to be migrated first.
+'''
+
+
+def create_schema(db):
+    version = schema_version(db)
+    if version != SCHEMA_VERSION and table_exists(db, 'carpark_availability_15min'):
+        raise RuntimeError('Database has schema version {}, run "python storage.py migrate" first'.format(version))
+    for statement in SCHEMA + ROLLUP_SCHEMA:
+        db.execute(statement)
+    if version != SCHEMA_VERSION:
+        # writing the pragma takes the write lock, only done once per file
+        db.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+
+
+# Tables a database has once create_schema and load_reference ran on it
+TABLES = ['carpark', 'carpark_availability_15min', 'meta', 'availability_days', 'carpark_reference', 'rollup_lot_stats', 'rollup_rankings',
+          'rollup_carpark_day', 'rollup_profiles', 'rollup_anomalies']
+
+
+def schema_ready(db):
+    existing = set(row[0] for row in db.execute("select name from sqlite_master where type='table'"))
+    return schema_version(db) == SCHEMA_VERSION and existing.issuperset(TABLES)
+
+
+'''
+Connection for the dashboard's read paths. It does not write when the schema is in place, so reads never queue
+behind the importer's transactions (only a new or outdated file gets its tables and reference data once).
+Reference csv changes are loaded by the importer, live.py and the storage.py commands, not by readers.
+'''
+
+
+def connect_reader(db_path=DB_PATH):
+    db = connect(db_path)
+    try:
+        if not schema_ready(db):
+            create_schema(db)
+            load_reference(db)
+    except Exception:
+        db.close()
+        raise
+    return db
+
+
+def get_meta(db, key):
+    row = db.execute('select value from meta where key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(db, key, value):
+    db.execute('insert or replace into meta (key, value) values (?, ?)', (key, str(value)))
+
+
+'''
+Counter bumped in every transaction that changes what the dashboard would show,
+used to key and invalidate cached results
+'''
+
+
+def bump_data_version(db):
+    set_meta(db, 'data_version', int(get_meta(db, 'data_version') or 0) + 1)
+
+
+def get_data_version(db_path=DB_PATH):
+    db = sqlite3.connect(db_path)
+    try:
+        return int(get_meta(db, 'data_version') or 0)
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        db.close()
+
+
+'''
+Loads the reference csv into carpark_reference when the table is missing or the file content changed
+since the last load (content hash of the parsed copy kept by reference.py)
+'''
+
+
+def load_reference(db, csv_path=REFERENCE_CSV):
+    reference_data = reference.get_reference(csv_path)
+    digest = reference_data.version
+    stale = table_exists(db, 'carpark_reference')
+    if stale and get_meta(db, 'reference_hash') == digest:
+        return False
+    if stale and get_meta(db, 'reference_hash') is None and \
+            get_meta(db, 'reference_mtime') == str(os.path.getmtime(csv_path)):
+        # loaded by an older version that only recorded the file mtime
+        set_meta(db, 'reference_hash', digest)
+        return False
+    rows = reference_data.get().reset_index()[REFERENCE_COLUMNS]
+    rows = rows.astype(object).where(rows.notnull(), None)
+    db.execute('BEGIN')
+    try:
+        db.execute('drop table if exists carpark_reference')
+        db.execute(REFERENCE_SCHEMA)
+        db.executemany('insert or replace into carpark_reference values ({})'.format(','.join('?' * len(REFERENCE_COLUMNS))),
+                       rows.itertuples(index=False, name=None))
+        set_meta(db, 'reference_hash', digest)
+        bump_data_version(db)
+        if stale and rollups_ready(db):
+            # car park types and the business filter may have changed under the rollups
+            set_meta(db, 'rollups', 'stale')
+            print('Reference data changed, run "python storage.py rebuild-rollups"')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+    return True
+
+
+def has_rows(db):
+    return db.execute('select 1 from carpark_availability_15min limit 1').fetchone() is not None
+
+
+def rollups_ready(db):
+    return get_meta(db, 'rollups') == str(ROLLUPS_VERSION)
+
+
+def mark_rollups_ready(db):
+    set_meta(db, 'rollups', ROLLUPS_VERSION)
+
+
+'''
+Adds the rows in `source` (the staging table during ingestion) to the rollups.
+Lot stats are additive, rankings are recomputed for every timestamp present in source.
+'''
+
+
+def update_rollups(db, source='staging'):
+    for statement in ADDITIVE_ROLLUPS + [ANOMALIES_SQL]:
+        db.execute(statement.format(source=source, occupied=OCCUPIED_SQL, filter=FILTER_SQL))
+    timestamps = 'and a.timestamp in (select distinct timestamp from {})'.format(source)
+    for ranking, order in RANKINGS.items():
+        db.execute('delete from rollup_rankings where ranking = ? and timestamp in '
+                   '(select distinct timestamp from {})'.format(source), (ranking,))
+        db.execute(RANKINGS_SQL.format(ranking=ranking, order=order, occupied=OCCUPIED_SQL, filter=FILTER_SQL,
+                                       timestamps=timestamps, k=TOP_K))
+
+
+'''
+Regenerates every rollup and availability_days from the raw table, needed after a migration or a reference data change
+'''
+
+
+def rebuild_rollups(db_path=DB_PATH):
+    db = connect(db_path)
+    create_schema(db)
+    load_reference(db)
+    db.execute('BEGIN')
+    try:
+        for table in ['rollup_lot_stats', 'rollup_rankings', 'rollup_carpark_day', 'rollup_profiles',
+                      'rollup_anomalies']:
+            db.execute('delete from {}'.format(table))
+        for statement in ADDITIVE_ROLLUPS + [ANOMALIES_SQL]:
+            db.execute(statement.format(source='carpark_availability_15min', occupied=OCCUPIED_SQL, filter=FILTER_SQL))
+        for ranking, order in RANKINGS.items():
+            db.execute(RANKINGS_SQL.format(ranking=ranking, order=order, occupied=OCCUPIED_SQL, filter=FILTER_SQL,
+                                           timestamps='', k=TOP_K))
+        count_days(db)
+        mark_rollups_ready(db)
+        bump_data_version(db)
+    except Exception:
+        db.execute('ROLLBACK')
+        db.close()
+        raise
+    db.execute('COMMIT')
+    buckets = db.execute('select count(distinct timestamp) from rollup_lot_stats').fetchone()[0]
+    db.close()
+    print('Rebuilt rollups for {} timestamps'.format(buckets))
+
+
+'''
+Returns the distinct timestamps (epoch seconds) already stored, empty when the table does not exist yet
+'''
+
+
+def get_existing_timestamps(db_path=DB_PATH):
+    db = sqlite3.connect(db_path)
+    try:
+        return {row[0] for row in db.execute('select distinct timestamp from carpark_availability_15min')}
+    except sqlite3.OperationalError:
+        return set()
+    finally:
+        db.close()
+
+
+'''
+Persistent writer holding a single connection for a whole ingestion run.
+Snapshots are buffered and inserted with one prepared executemany per transaction,
+duplicate (carpark_number, lot_type, timestamp) rows are ignored instead of aborting the batch.
+write() takes a parsed snapshot (snapshot.parse_snapshot, typed columns) and resolves carpark numbers to ids,
+registering new car parks as they appear.
+Rows are staged in a temp table, rows already stored are dropped, and the rest is inserted and added to the rollups
+in the same transaction.
+write() and flush() return the timestamps that were committed, so callers can checkpoint them.
+When the column store of the database exists (columnar.py) the days a flush touched are rewritten after the commit,
+and data_version is bumped once more when they are in place: results a reader cached from the old partitions
+between the two are left under the first version. A day left stale by a crash in between is read from SQLite
+(availability_days) until a later flush or compact rewrites it.
+'''
+
+
+class SnapshotWriter:
+
+    def __init__(self, db_path=DB_PATH, batch_size=SNAPSHOTS_PER_TRANSACTION):
+        self.db = connect(db_path)
+        create_schema(self.db)
+        self.db.execute(STAGING_SCHEMA)
+        load_reference(self.db)
+        if not has_rows(self.db):
+            mark_rollups_ready(self.db)
+        elif not rollups_ready(self.db):
+            print('Rollups are not up to date, run "python storage.py rebuild-rollups" after this import')
+        self.batch_size = batch_size
+        self.carpark_ids = dict(self.db.execute('select carpark_number, carpark_id from carpark'))
+        self.column_store = columnar.store_path(db_path)
+        self.rows = []
+        self.timestamps = []
+        self.inserted = 0
+
+    def write(self, timestamp, snapshot):
+        if snapshot is not None and len(snapshot):
+            self.rows.extend(self.to_rows(timestamp, snapshot))
+        self.timestamps.append(timestamp)
+        if len(self.timestamps) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def to_rows(self, timestamp, snapshot):
+        self.register_carparks(set(snapshot.carpark_number))
+        carpark_ids = self.carpark_ids
+        update_datetime = [None if epoch < 0 else epoch for epoch in snapshot.update_datetime.tolist()]
+        return zip(repeat(to_epoch(timestamp)), [carpark_ids[number] for number in snapshot.carpark_number],
+                   snapshot.lot_type, snapshot.total_lots.tolist(), snapshot.lots_available.tolist(), update_datetime)
+
+    def register_carparks(self, numbers):
+        new_numbers = [number for number in numbers if number not in self.carpark_ids]
+        if new_numbers:
+            self.db.execute('BEGIN')
+            self.db.executemany('insert or ignore into carpark (carpark_number) values (?)',
+                                [(number,) for number in new_numbers])
+            self.db.execute('COMMIT')
+            self.carpark_ids = dict(self.db.execute('select carpark_number, carpark_id from carpark'))
+
+    def flush(self):
+        if not self.timestamps:
+            return []
+        committed = self.timestamps
+        # IMMEDIATE: staging reads the table before writing, another writer process would make the upgrade fail
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.executemany(INSERT_SQL, self.rows)
+            self.db.execute('''delete from staging where exists (select 1 from carpark_availability_15min a
+                               where a.timestamp = staging.timestamp and a.carpark_id = staging.carpark_id
+                               and a.lot_type = staging.lot_type)''')
+            inserted = self.db.execute('insert into carpark_availability_15min select * from staging').rowcount
+            # checked on every flush, the store may have been built by storage.py compact since this writer started
+            days = [row[0] for row in self.db.execute('select distinct timestamp - timestamp % {} from staging'.format(
+                columnar.SECONDS_PER_DAY))] if inserted and columnar.exists(self.column_store) else []
+            if inserted:
+                self.db.execute(DAY_ROWS_SQL.format(source='staging'))
+                update_rollups(self.db)
+                bump_data_version(self.db)
+            self.inserted += inserted
+            self.db.execute('delete from staging')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        if days:
+            columnar.write_days(self.db, self.column_store, days)
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                bump_data_version(self.db)
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+        self.rows = []
+        self.timestamps = []
+        return committed
+
+    def close(self):
+        try:
+            self.flush()
+            self.db.execute('PRAGMA optimize')
+        finally:
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+'''
+One-shot migration of a version 0 database (varchar counts, ISO string timestamps, carpark_number per row)
+to the typed schema. The legacy table is copied in primary key order, dropped, and the file vacuumed.
+'''
+
+
+def migrate(db_path=DB_PATH):
+    size_before = os.path.getsize(db_path)
+    db = connect(db_path)
+    if schema_version(db) == SCHEMA_VERSION:
+        print('Database is already at schema version', SCHEMA_VERSION)
+        db.close()
+        return
+    db.execute('BEGIN')
+    try:
+        db.execute('alter table carpark_availability_15min rename to carpark_availability_15min_v1')
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.execute('''insert or ignore into carpark (carpark_number)
+                      select distinct trim(carpark_number) from carpark_availability_15min_v1 order by 1''')
+        db.execute('''insert or ignore into carpark_availability_15min
+                      select cast(strftime('%s', v.timestamp) as integer), c.carpark_id, trim(v.lot_type),
+                             cast(v.total_lots as integer), cast(v.lots_available as integer),
+                             cast(strftime('%s', substr(v.update_datetime, 1, 19)) as integer)
+                      from carpark_availability_15min_v1 v
+                      join carpark c on c.carpark_number = trim(v.carpark_number)
+                      order by 1, 2, 3''')
+        db.execute('drop table carpark_availability_15min_v1')
+        db.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+    except Exception:
+        db.execute('ROLLBACK')
+        db.close()
+        raise
+    db.execute('COMMIT')
+    rows = db.execute('select count(*) from carpark_availability_15min').fetchone()[0]
+    db.execute('VACUUM')
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    db.close()
+    print('Migrated {} rows, {:.1f} MB -> {:.1f} MB'.format(rows, size_before / 1e6, os.path.getsize(db_path) / 1e6))
+    rebuild_rollups(db_path)
+
+
+'''
+Builds the column store (columnar.py) of the database from the availability table, after recounting
+availability_days, which also repairs stale partitions
+'''
+
+
+def compact(db_path=DB_PATH):
+    db = connect(db_path)
+    try:
+        create_schema(db)
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            count_days(db)
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        columnar.compact(db, columnar.store_path(db_path))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Car park database maintenance')
+    parser.add_argument('command', choices=['migrate', 'rebuild-rollups', 'compact', 'load-reference'])
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database file')
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        migrate(args.db)
+    elif args.command == 'rebuild-rollups':
+        rebuild_rollups(args.db)
+    elif args.command == 'compact':
+        compact(args.db)
+    elif args.command == 'load-reference':
+        db = connect(args.db)
+        try:
+            create_schema(db)
+            load_reference(db)
+        finally:
+            db.close()
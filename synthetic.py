@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+import argparse
+import json
+import os
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import columnar
+import reference
+import storage
+
+'''
+Synthetic carpark_availability_15min databases for benchmarks and hardware sizing,
+built from the car parks of the bundled reference csv at any scale:
+
+    python synthetic.py --db ./bench/Carpark_30d --start 2018-02-01 --days 30
+    python synthetic.py --db ./bench/Carpark_365d --start 2018-01-01 --days 365 --columnar
+
+Every car park reports car lots (C), some also heavy vehicle (H) and motorcycle (Y) lots. Occupancy follows a daily
+cycle peaking at night for residential car parks and in the afternoon for commercial ones (weaker on weekends),
+with a per car park level, a per day offset and noise. A small fraction of rows carries the data errors the
+processor filters out (total lots 0, more lots available than total). Rows are written day by day through the
+staging table so the rollups are maintained like a real ingest.
+'''
+
+SNAPSHOTS_PER_DAY = 96
+# Fraction of car parks with heavy vehicle / motorcycle lots
+HEAVY_VEHICLE_SHARE = 0.15
+MOTORCYCLE_SHARE = 0.25
+COMMERCIAL_SHARE = 0.3
+ZERO_LOTS_RATE = 0.0005
+OVERFULL_RATE = 0.001
+MISSING_UPDATE_RATE = 0.005
+
+'''
+Fixed attributes of every (car park, lot type) series, in (carpark_id, lot_type) order
+'''
+
+
+def make_series(carpark_ids, rng):
+    carparks = len(carpark_ids)
+    lot_types = [np.full(carparks, 'C', dtype=object)]
+    ids = [np.asarray(carpark_ids)]
+    total_lots = [rng.integers(50, 800, carparks)]
+    for lot_type, share, low, high in [('H', HEAVY_VEHICLE_SHARE, 5, 40), ('Y', MOTORCYCLE_SHARE, 10, 100)]:
+        has = rng.random(carparks) < share
+        ids.append(np.asarray(carpark_ids)[has])
+        lot_types.append(np.full(has.sum(), lot_type, dtype=object))
+        total_lots.append(rng.integers(low, high, has.sum()))
+    series = pd.DataFrame({'carpark_id': np.concatenate(ids), 'lot_type': np.concatenate(lot_types),
+                           'total_lots': np.concatenate(total_lots)})
+    series = series.sort_values(['carpark_id', 'lot_type']).reset_index(drop=True)
+    commercial = pd.Series(rng.random(carparks) < COMMERCIAL_SHARE, index=carpark_ids)
+    series['commercial'] = commercial.reindex(series['carpark_id']).values
+    series['level'] = rng.uniform(0.3, 0.7, len(series))
+    series['amplitude'] = rng.uniform(0.1, 0.35, len(series))
+    return series
+
+
+'''
+Rows of one day (epoch of 00:00) as (timestamp, carpark_id, lot_type, total_lots, lots_available, update_datetime)
+tuples in primary key order
+'''
+
+
+def make_day(day, series, rng):
+    timestamps = day + np.arange(SNAPSHOTS_PER_DAY) * (86400 // SNAPSHOTS_PER_DAY)
+    hours = (timestamps % 86400) / 3600.0
+    weekend = pd.Timestamp(day, unit='s').dayofweek >= 5
+    commercial = series['commercial'].to_numpy()
+    peak = np.where(commercial, 14.0, 2.0)
+    amplitude = series['amplitude'].to_numpy() * np.where(commercial & weekend, 0.5, 1.0)
+    occupied = (series['level'].to_numpy() + rng.normal(0, 0.05, len(series))
+                + amplitude * np.cos(2 * np.pi * (hours[:, None] - peak) / 24)
+                + rng.normal(0, 0.03, (len(timestamps), len(series))))
+    total_lots = np.broadcast_to(series['total_lots'].to_numpy(), occupied.shape).copy()
+    lots_available = np.rint(total_lots * (1 - np.clip(occupied, 0, 1))).astype('int64')
+    errors = rng.random(occupied.shape)
+    zero = errors < ZERO_LOTS_RATE
+    total_lots[zero] = 0
+    lots_available[zero] = 0
+    overfull = (errors >= ZERO_LOTS_RATE) & (errors < ZERO_LOTS_RATE + OVERFULL_RATE)
+    lots_available[overfull] = total_lots[overfull] + rng.integers(1, 20, overfull.sum())
+    update_datetime = (timestamps[:, None] - rng.integers(0, 600, occupied.shape)).astype(object)
+    update_datetime[rng.random(occupied.shape) < MISSING_UPDATE_RATE] = None
+    rows = occupied.size
+    snapshots = len(timestamps)
+    return zip(np.repeat(timestamps, len(series)).tolist(),
+               np.tile(series['carpark_id'].to_numpy(), snapshots).tolist(),
+               np.tile(series['lot_type'].to_numpy(), snapshots).tolist(),
+               total_lots.ravel().tolist(), lots_available.ravel().tolist(), update_datetime.ravel().tolist()), rows
+
+
+'''
+Builds a new database of `days` days from start_date, refuses to touch an existing file
+'''
+
+
+def generate(db_path, start_date, days, seed=0, csv_path=reference.REFERENCE_CSV, build_column_store=False):
+    if os.path.exists(db_path):
+        raise RuntimeError('{} already exists, synthetic databases are only generated into new files'.format(db_path))
+    started = perf_counter()
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    db = storage.connect(db_path)
+    try:
+        storage.create_schema(db)
+        db.execute(storage.STAGING_SCHEMA)
+        storage.load_reference(db, csv_path)
+        db.execute('BEGIN')
+        db.executemany('insert or ignore into carpark (carpark_number) values (?)',
+                       [(number,) for number in reference.get_reference(csv_path).get().index])
+        db.execute('COMMIT')
+        series = make_series([row[0] for row in db.execute('select carpark_id from carpark order by carpark_id')], rng)
+        first_day = storage.to_epoch(start_date)
+        first_day -= first_day % 86400
+        total = 0
+        for day in range(first_day, first_day + days * 86400, 86400):
+            rows, count = make_day(day, series, rng)
+            db.execute('BEGIN')
+            db.executemany(storage.INSERT_SQL, rows)
+            db.execute('insert into carpark_availability_15min select * from staging')
+            db.execute(storage.DAY_ROWS_SQL.format(source='staging'))
+            storage.update_rollups(db)
+            db.execute('delete from staging')
+            db.execute('COMMIT')
+            total += count
+        storage.mark_rollups_ready(db)
+        storage.bump_data_version(db)
+        storage.set_meta(db, 'synthetic', json.dumps({'start_date': start_date, 'days': days, 'seed': seed}))
+        if build_column_store:
+            columnar.compact(db, columnar.store_path(db_path))
+        db.execute('PRAGMA optimize')
+    finally:
+        db.close()
+    print('Generated {} rows ({} series, {} days) in {:.1f}s, {:.1f} MB'.format(
+        total, len(series), days, perf_counter() - started, os.path.getsize(db_path) / 1e6))
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic car park availability database')
+    parser.add_argument('--db', required=True, help='new SQLite database file')
+    parser.add_argument('--start', default='2018-01-01', help='first day, YYYY-MM-DD')
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--columnar', action='store_true', help='also build the column store (columnar.py)')
+    args = parser.parse_args()
+    generate(args.db, args.start, args.days, args.seed, build_column_store=args.columnar)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_api  # noqa: E402
+
+'''
+The modules read the reference csv relative to the working directory, as when run from the repository root
+'''
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+
+'''
+fake_api.py servers on a free port, started by the test with start_api(**make_server kwargs) -> (server, url)
+and shut down afterwards. They serve the first 100 car parks of the reference csv unless told otherwise.
+'''
+
+
+@pytest.fixture
+def start_api():
+    servers = []
+
+    def start(**kwargs):
+        kwargs.setdefault('carpark_numbers', fake_api.load_carpark_numbers()[:100])
+        server = fake_api.start_in_thread(port=0, **kwargs)
+        servers.append(server)
+        return server, 'http://127.0.0.1:{}/v1/transport/carpark-availability'.format(server.server_address[1])
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+import pytest
+
+import columnar
+import fake_api
+import importer
+import processor as pr
+import snapshot
+import storage
+
+# crosses midnight, so the store has two day partitions
+DATES = importer.get_date_range('2018-02-13T22:00', '2018-02-14T02:00')
+
+
+def write(writer, dates, numbers):
+    for date in dates:
+        writer.write(date, snapshot.parse_snapshot(fake_api.make_snapshot(date, numbers)))
+
+
+def facts(db_path, column_store):
+    data = pr.prepare_data('2018-02-13', '2018-02-15', db_path=db_path, column_store=column_store)['facts']
+    keys = ['timestamp', 'carpark', 'lot_type']
+    return data.astype({'lot_type': str, 'car_park_type': str}).sort_values(keys).reset_index(drop=True)
+
+
+def assert_same_facts(db_path):
+    expected = facts(db_path, False)
+    result = facts(db_path, True)
+    assert len(expected) > 0
+    assert result.equals(expected)
+
+
+def partitions(db_path):
+    return columnar.read_manifest(columnar.store_path(db_path))['days']
+
+
+def test_column_store_matches_sqlite(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'carpark.db')
+    numbers = fake_api.load_carpark_numbers()
+    with storage.SnapshotWriter(db_path, batch_size=2) as writer:
+        write(writer, DATES[:4], numbers)
+        assert not columnar.exists(columnar.store_path(db_path))
+        # built while the writer is open, its later flushes keep the store up to date
+        storage.compact(db_path)
+        write(writer, DATES[4:12], numbers)
+        assert_same_facts(db_path)
+        assert sorted(partitions(db_path)) == ['2018-02-13', '2018-02-14']
+
+        # the writer stops between the commit and the partition rewrite
+        def crash(*args):
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr(columnar, 'write_days', crash)
+        with pytest.raises(KeyboardInterrupt):
+            write(writer, DATES[12:14], numbers)
+        monkeypatch.undo()
+        stale = partitions(db_path)['2018-02-14']['rows']
+        assert_same_facts(db_path)
+
+    storage.compact(db_path)
+    assert partitions(db_path)['2018-02-14']['rows'] > stale
+    assert_same_facts(db_path)
+
+
+def test_days_missing_from_the_store_are_read_from_sqlite(tmp_path):
+    db_path = str(tmp_path / 'carpark.db')
+    with storage.SnapshotWriter(db_path) as writer:
+        write(writer, DATES, fake_api.load_carpark_numbers())
+    storage.compact(db_path)
+    store = columnar.store_path(db_path)
+    manifest = columnar.read_manifest(store)
+    del manifest['days']['2018-02-13']
+    columnar.write_manifest(store, manifest)
+    assert_same_facts(db_path)
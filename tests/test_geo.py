@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+
+import geo
+
+
+def test_svy21_origin():
+    lat, lon = geo.svy21_to_wgs84(geo.SVY21_FALSE_EASTING, geo.SVY21_FALSE_NORTHING)
+    assert np.isclose(lat, geo.SVY21_ORIGIN_LAT, atol=1e-8)
+    assert np.isclose(lon, geo.SVY21_ORIGIN_LON, atol=1e-8)
+
+
+def test_svy21_known_point():
+    # 1.294919 N, 103.773674 E is SVY21 N 30811.2643, E 21362.1579
+    lat, lon = geo.svy21_to_wgs84(21362.157905182374, 30811.26429645264)
+    assert np.isclose(lat, 1.2949192688485278, atol=1e-7)
+    assert np.isclose(lon, 103.77367436885834, atol=1e-7)
+
+
+def test_svy21_is_vectorized():
+    easting = np.array([geo.SVY21_FALSE_EASTING, 21362.157905182374])
+    northing = np.array([geo.SVY21_FALSE_NORTHING, 30811.26429645264])
+    lat, lon = geo.svy21_to_wgs84(easting, northing)
+    assert lat.shape == lon.shape == (2,)
+    assert np.allclose(lat, [geo.SVY21_ORIGIN_LAT, 1.2949192688485278], atol=1e-7)
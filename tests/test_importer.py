@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+import json
+import os
+
+import pytest
+
+import importer
+import storage
+
+START, END = '2018-02-13T00:00', '2018-02-13T02:00'
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(importer, 'BACKOFF_BASE', 0.001)
+
+
+def backfill(dates, url, db_path, checkpoint=None, max_retries=20):
+    return importer.backfill(dates, url=url, requests_per_minute=60000, max_workers=4, max_retries=max_retries,
+                             db_path=db_path, checkpoint=checkpoint)
+
+
+def stored(db_path):
+    return storage.get_existing_timestamps(db_path)
+
+
+def test_backfill_retries_throttled_requests(start_api, tmp_path):
+    server, url = start_api(failure_rate=0.3, seed=1)
+    db_path = str(tmp_path / 'carpark.db')
+    dates = importer.get_date_range(START, END)
+    checkpoint = importer.Checkpoint(str(tmp_path / 'checkpoint.json'), importer.checkpoint_key(db_path, START, END))
+    stats = backfill(dates, url, db_path, checkpoint)
+    assert stats.failures == 0
+    assert stats.snapshots == len(dates)
+    assert stats.retries > 0
+    assert stats.requests == server.request_count
+    assert stored(db_path) == {storage.to_epoch(date) for date in dates}
+    # a clean run removes its checkpoint
+    assert not os.path.exists(checkpoint.path)
+
+
+def test_backfill_failures_keep_the_checkpoint(start_api, tmp_path):
+    server, url = start_api(failure_rate=1.0)
+    db_path = str(tmp_path / 'carpark.db')
+    dates = importer.get_date_range(START, END)
+    checkpoint = importer.Checkpoint(str(tmp_path / 'checkpoint.json'), 'run')
+    stats = backfill(dates, url, db_path, checkpoint, max_retries=1)
+    assert stats.failures == len(dates)
+    assert stats.snapshots == 0
+    assert server.request_count == 2 * len(dates)
+    assert stored(db_path) == set()
+    with open(checkpoint.path) as f:
+        assert [json.loads(line) for line in f] == [{'run': 'run', 'done': []}]
+
+
+def test_checkpoint_resumes_its_own_run(start_api, tmp_path):
+    server, url = start_api()
+    db_path = str(tmp_path / 'carpark.db')
+    path = str(tmp_path / 'checkpoint.json')
+    dates = importer.get_date_range(START, END)
+    crashed = importer.Checkpoint(path, importer.checkpoint_key(db_path, START, END))
+    for date in dates[:5]:
+        crashed.mark(date)
+    crashed.save()
+    other = importer.Checkpoint(path, importer.checkpoint_key(db_path, '2018-03-01', '2018-03-02'))
+    other.mark(dates[5])
+    other.save()
+
+    resumed = importer.Checkpoint(path, crashed.key)
+    remaining = importer.get_missing_dates(dates, db_path=db_path, checkpoint=resumed, incremental=False)
+    assert remaining == dates[5:]
+    backfill(remaining, url, db_path, resumed)
+    assert server.request_count == len(dates) - 5
+    # the clean finish only drops this run's entry
+    assert importer.Checkpoint(path, crashed.key).done == set()
+    assert importer.Checkpoint(path, other.key).done == {dates[5]}
+
+
+def test_checkpoint_appends_new_timestamps_only(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    with open(path, 'w') as f:
+        # file of the previous format, then a line cut short by a crash
+        f.write(json.dumps({'runs': {'old': ['2018-01-01T00:00:00']}}) + '\n{"run": "crashed", "do')
+    every = importer.CHECKPOINT_EVERY
+    dates = importer.get_date_range('2018-02-13T00:00', '2018-02-14T00:00')[:2 * every + 1]
+    checkpoint = importer.Checkpoint(path, 'run')
+    for date in dates:
+        checkpoint.mark(date)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)['done'] for line in lines[2:]] == [dates[:every], dates[every:2 * every]]
+    checkpoint.save()
+    assert importer.Checkpoint(path, 'run').done == set(dates)
+    assert importer.Checkpoint(path, 'old').done == {'2018-01-01T00:00:00'}
+    checkpoint.clear()
+    assert importer.Checkpoint(path, 'run').read() == {'old': ['2018-01-01T00:00:00']}
+
+
+def test_incremental_skips_stored_timestamps(start_api, tmp_path):
+    server, url = start_api()
+    db_path = str(tmp_path / 'carpark.db')
+    first = importer.get_date_range(START, END)
+    backfill(first, url, db_path)
+    overlapping = importer.get_date_range('2018-02-13T01:00', '2018-02-13T03:00')
+    missing = importer.get_missing_dates(overlapping, db_path=db_path)
+    assert missing == [date for date in overlapping if date not in first]
+    backfill(missing, url, db_path)
+    assert server.request_count == len(set(first + overlapping))
+    assert stored(db_path) == {storage.to_epoch(date) for date in first + overlapping}
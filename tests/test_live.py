@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# coding: utf-8
+import json
+
+import pandas as pd
+
+import fake_api
+import live
+import storage
+
+TIMES = ['2018-02-24T10:00:00', '2018-02-24T10:05:00', '2018-02-24T10:10:00', '2018-02-24T10:15:00',
+         '2018-02-24T10:20:00', '2018-02-24T10:40:00']
+
+
+def test_live_ingest_of_replayed_snapshots(start_api, tmp_path):
+    numbers = fake_api.load_carpark_numbers()[:50]
+    recorded = tmp_path / 'recorded'
+    recorded.mkdir()
+    for timestamp in TIMES:
+        with open(str(recorded / (timestamp.replace(':', '') + '.json')), 'w') as f:
+            json.dump(fake_api.make_snapshot(timestamp, numbers), f)
+    server, url = start_api(carpark_numbers=numbers, replay_dir=str(recorded))
+    db_path = str(tmp_path / 'carpark.db')
+    live_file = str(tmp_path / 'live_buffer.npz')
+    # room for 3 snapshots, the oldest ones are evicted
+    buffer = live.RingBuffer(hours=0.25, poll_seconds=300, carpark_numbers=numbers)
+    ingest = live.LiveIngest(url, buffer, db_path, poll_seconds=300, live_file=live_file)
+    with storage.SnapshotWriter(db_path, batch_size=1) as writer:
+        assert all(ingest.poll_once(writer) for _ in TIMES)
+
+    assert buffer.size == 3
+    assert buffer.latest == storage.to_epoch(TIMES[-1])
+    assert list(buffer.trend()['timestamp'].unique()) == list(pd.to_datetime(TIMES[-3:]))
+    # the first snapshot of each 15 minute slot is stored under the slot's timestamp
+    assert storage.get_existing_timestamps(db_path) == {storage.to_epoch(timestamp) for timestamp in [
+        '2018-02-24T10:00:00', '2018-02-24T10:15:00', '2018-02-24T10:30:00']}
+
+    shared = live.SharedBuffer(live_file)
+    assert shared.refresh()
+    assert shared.latest == buffer.latest
+    assert shared.size == buffer.size
+    pd.testing.assert_frame_equal(shared.trend().reset_index(drop=True), buffer.trend().reset_index(drop=True))
+    pd.testing.assert_frame_equal(shared.carpark_stats(), buffer.carpark_stats())
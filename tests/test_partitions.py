@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import fake_api
+import importer
+import processor as pr
+import snapshot
+import storage
+
+START, END = '2018-02-12', '2018-02-15'
+
+
+@pytest.fixture(scope='module')
+def three_days(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp('partitions') / 'carpark.db')
+    numbers = fake_api.load_carpark_numbers()[:300]
+    with storage.SnapshotWriter(db_path) as writer:
+        for date in importer.get_date_range('2018-02-12T21:00', '2018-02-14T03:00')[::2]:
+            writer.write(date, snapshot.parse_snapshot(fake_api.make_snapshot(date, numbers)))
+    storage.compact(db_path)
+    return db_path
+
+
+@pytest.fixture(scope='module')
+def pool():
+    # the dashboard's pool is spawned too, the shards run in fresh interpreters
+    pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+    yield pool
+    pool.shutdown()
+
+
+def test_shard_ranges():
+    assert pr.shard_ranges('2018-02-12', '2018-02-15', 2) == [('2018-02-12', '2018-02-14'),
+                                                              ('2018-02-14', '2018-02-15')]
+    assert pr.shard_ranges('2018-02-12', '2018-02-12') == []
+
+
+@pytest.mark.parametrize('column_store', [False, True])
+def test_partitioned_aggregates_match_whole_range(three_days, pool, column_store):
+    expected = pr.aggregate(pr.prepare_data(START, END, three_days, column_store))
+    result = pr.partitioned_aggregates(START, END, three_days, 1, column_store, pool)
+
+    keys = ['timestamp', 'lot_type', 'car_park_type']
+    expected_stats = expected['lot_stats'].sort_values(keys).reset_index(drop=True)
+    result_stats = result['lot_stats'].sort_values(keys).reset_index(drop=True)
+    assert expected_stats['timestamp'].dt.date.nunique() == 3
+    assert (result_stats[keys] == expected_stats[keys]).all().all()
+    assert (result_stats['row_count'] == expected_stats['row_count']).all()
+    assert np.allclose(result_stats['occupied_sum'], expected_stats['occupied_sum'])
+
+    expected_stats = expected['carpark_stats'].sort_values('car_park_no').reset_index(drop=True)
+    result_stats = result['carpark_stats'].sort_values('car_park_no').reset_index(drop=True)
+    assert (result_stats['car_park_no'] == expected_stats['car_park_no']).all()
+    assert (result_stats['row_count'] == expected_stats['row_count']).all()
+    assert np.allclose(result_stats['occupied_sum'], expected_stats['occupied_sum'])
+
+    for ranking in storage.RANKINGS:
+        expected_ranking = expected[ranking].reset_index(drop=True)
+        result_ranking = result[ranking].reset_index(drop=True)
+        assert len(result_ranking) == len(expected_ranking) > 0
+        columns = ['timestamp', 'car_park_no', 'total_lots']
+        assert (result_ranking[columns] == expected_ranking[columns]).all().all()
+        assert np.allclose(result_ranking['%occupied'], expected_ranking['%occupied'])
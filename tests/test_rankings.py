@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+import pandas as pd
+import pytest
+
+import processor as pr
+
+
+@pytest.mark.parametrize('largest', [True, False])
+@pytest.mark.parametrize('group_kind', ['object', 'datetime'])
+def test_top_k_per_group_matches_groupby_apply(largest, group_kind):
+    rng = np.random.RandomState(0)
+    groups = rng.randint(0, 20, 2000)
+    data = pd.DataFrame({
+        'group': ['g{:02d}'.format(g) for g in groups] if group_kind == 'object'
+        else pd.Timestamp('2018-02-13') + pd.to_timedelta(groups * 15, unit='min'),
+        # few distinct values, so ties on the k-th value are common
+        'value': rng.randint(0, 10, 2000).astype('float64'),
+        'row': np.arange(2000),
+    })
+    data.loc[rng.rand(2000) < 0.05, 'value'] = np.nan
+    pick = (lambda x: x.nlargest(5, 'value')) if largest else (lambda x: x.nsmallest(5, 'value'))
+    expected = data.groupby('group', group_keys=False).apply(pick).reset_index(drop=True)
+    result = pr.top_k_per_group(data, 'group', 'value', 5, largest=largest)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_top_k_per_group_small_groups_and_empty():
+    data = pd.DataFrame({'group': ['a', 'b', 'b', 'c', 'c', 'c'], 'value': [1.0, 2, 3, 4, 5, 6]})
+    result = pr.top_k_per_group(data, 'group', 'value', 2)
+    assert result['value'].tolist() == [1.0, 3, 2, 6, 5]
+    assert pr.top_k_per_group(data.iloc[:0], 'group', 'value', 2).empty
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+import pytest
+
+import fake_api
+import importer
+import processor as pr
+import snapshot
+import storage
+
+
+@pytest.fixture(scope='module')
+def ingested(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp('rollups') / 'carpark.db')
+    numbers = fake_api.load_carpark_numbers()
+    # batches of 3 snapshots, so rollups are added to across transactions
+    with storage.SnapshotWriter(db_path, batch_size=3) as writer:
+        for date in importer.get_date_range('2018-02-13T02:00', '2018-02-13T05:00'):
+            writer.write(date, snapshot.parse_snapshot(fake_api.make_snapshot(date, numbers)))
+    return db_path
+
+
+def test_rollups_match_raw_aggregates(ingested):
+    db = storage.connect(ingested)
+    try:
+        assert storage.rollups_ready(db)
+        rollups = pr.load_aggregates(db, '2018-02-13', '2018-02-14')
+    finally:
+        db.close()
+    raw = pr.aggregate(pr.prepare_data('2018-02-13', '2018-02-14', db_path=ingested, column_store=False))
+
+    keys = ['timestamp', 'lot_type', 'car_park_type']
+    expected = raw['lot_stats'].sort_values(keys).reset_index(drop=True)
+    result = rollups['lot_stats'].sort_values(keys).reset_index(drop=True)
+    assert len(result) == len(expected) == 13 * expected['car_park_type'].nunique()
+    assert (result[keys] == expected[keys]).all().all()
+    assert (result['row_count'] == expected['row_count']).all()
+    assert np.allclose(result['occupied_sum'], expected['occupied_sum'])
+
+    expected = raw['carpark_stats'].sort_values('car_park_no').reset_index(drop=True)
+    result = rollups['carpark_stats'].sort_values('car_park_no').reset_index(drop=True)
+    assert (result['car_park_no'] == expected['car_park_no']).all()
+    assert (result['row_count'] == expected['row_count']).all()
+    assert np.allclose(result['occupied_sum'], expected['occupied_sum'])
+
+    for ranking in storage.RANKINGS:
+        expected = raw[ranking].reset_index(drop=True)
+        result = rollups[ranking].reset_index(drop=True)
+        assert len(result) == len(expected) == 13 * storage.TOP_K
+        columns = ['timestamp', 'car_park_no', 'total_lots']
+        assert (result[columns] == expected[columns]).all().all()
+        assert np.allclose(result['%occupied'], expected['%occupied'])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+import sqlite3
+
+import fake_api
+import importer
+import snapshot
+import storage
+
+DATES = importer.get_date_range('2018-02-13T23:00', '2018-02-14T01:00')
+
+# Table and row format of the original importer (version 0): varchar counts, ISO string timestamps
+V0_SCHEMA = '''create table if not exists carpark_availability_15min (total_lots varchar(20),lot_type varchar(5),
+            lots_available varchar(10),carpark_number varchar(20),update_datetime datetime,timestamp datetime,
+            PRIMARY KEY (carpark_number,lot_type,timestamp))'''
+
+
+def write_v0(db_path, numbers):
+    db = sqlite3.connect(db_path)
+    db.execute(V0_SCHEMA)
+    for date in DATES:
+        for carpark in fake_api.make_snapshot(date, numbers)['items'][0]['carpark_data']:
+            for info in carpark['carpark_info']:
+                db.execute('insert into carpark_availability_15min values (?, ?, ?, ?, ?, ?)',
+                           (info['total_lots'], info['lot_type'], info['lots_available'],
+                            carpark['carpark_number'], carpark['update_datetime'], date))
+    db.commit()
+    db.close()
+
+
+def write_v2(db_path, numbers):
+    with storage.SnapshotWriter(db_path) as writer:
+        for date in DATES:
+            writer.write(date, snapshot.parse_snapshot(fake_api.make_snapshot(date, numbers)))
+
+
+def dump(db_path, query):
+    db = storage.connect(db_path)
+    try:
+        return db.execute(query).fetchall()
+    finally:
+        db.close()
+
+
+def test_migrate_v0_matches_writer(tmp_path):
+    numbers = fake_api.load_carpark_numbers()[:200]
+    migrated, written = str(tmp_path / 'v0.db'), str(tmp_path / 'v2.db')
+    write_v0(migrated, numbers)
+    write_v2(written, numbers)
+
+    storage.migrate(migrated)
+
+    db = storage.connect(migrated)
+    try:
+        assert storage.schema_version(db) == storage.SCHEMA_VERSION
+        assert storage.rollups_ready(db)
+    finally:
+        db.close()
+    rows = '''select a.timestamp, c.carpark_number, a.lot_type, a.total_lots, a.lots_available, a.update_datetime
+              from carpark_availability_15min a join carpark c on c.carpark_id = a.carpark_id order by 1, 2, 3'''
+    result = dump(migrated, rows)
+    assert len(result) == len(DATES) * len(numbers)
+    assert sorted(set(row[0] for row in result)) == [storage.to_epoch(date) for date in DATES]
+    assert all(isinstance(value, int) for row in result for value in (row[0], row[3], row[4], row[5]))
+    assert result == dump(written, rows)
+
+    # sums are rounded, rows are added up in another order. Car parks tied in a ranking are ordered by carpark_id,
+    # which the two databases assign in another order, so only the ranked values are compared
+    for query in ['''select timestamp, lot_type, car_park_type, round(occupied_sum, 9), row_count
+                     from rollup_lot_stats order by 1, 2, 3''',
+                  '''select timestamp, ranking, rank,
+                            case ranking when 'largest' then total_lots else round(occupied, 9) end
+                     from rollup_rankings order by 1, 2, 3''',
+                  'select * from availability_days order by 1',
+                  '''select r.day, c.carpark_number, round(r.occupied_sum, 9), r.row_count from rollup_carpark_day r
+                     join carpark c on c.carpark_id = r.carpark_id order by 1, 2''']:
+        assert dump(migrated, query) == dump(written, query)
+
+
+def test_migrate_is_a_no_op_on_current_schema(tmp_path):
+    db_path = str(tmp_path / 'v2.db')
+    write_v2(db_path, fake_api.load_carpark_numbers()[:20])
+    before = dump(db_path, 'select * from carpark_availability_15min')
+    storage.migrate(db_path)
+    assert dump(db_path, 'select * from carpark_availability_15min') == before
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+import pandas as pd
+
+import processor as pr
+
+
+def series(values):
+    return pd.Series(values, index=pd.date_range('2018-02-13', periods=len(values), freq='15min'))
+
+
+def test_lttb_keeps_short_series():
+    values = series(np.arange(10.0))
+    assert pr.lttb(values, 10) is values
+    assert pr.lttb(values, 2) is values
+
+
+def test_lttb_thins_to_threshold_keeping_ends_and_peaks():
+    values = np.sin(np.linspace(0, 20, 1000))
+    values[377] = 5.0
+    values[612] = -5.0
+    result = pr.lttb(series(values), 50)
+    assert len(result) == 50
+    assert result.index.is_monotonic_increasing
+    assert result.index[0] == series(values).index[0] and result.index[-1] == series(values).index[-1]
+    assert result.max() == 5.0 and result.min() == -5.0
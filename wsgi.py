@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+
+'''
+Production entry point: the dashboard's Flask server as a WSGI application for a multi-worker server, e.g.
+
+    gunicorn --workers 4 --threads 4 --bind 0.0.0.0:8050 wsgi:application
+
+Every worker is a separate process, they share computed aggregates and figures through the disk tier of the
+result cache (CARPARK_CACHE_DIR, ./cache unless set), whose file locks make concurrent requests for the same
+date range compute it once. Aggregates are computed in background jobs the page polls, so HTTP threads
+only serve cached results. The live ingest is not started here, run live.py as its own process: it saves the
+live window to CARPARK_LIVE_FILE (./data/live_buffer.npz) after every snapshot and the workers' Live tab reads it.
+'''
+
+os.environ.setdefault('CARPARK_CACHE_DIR', './cache')
+
+from presenter import app  # noqa: E402  the cache directory must be set before the cache is created
+
+application = app.server